@@ -1,14 +1,27 @@
 from __future__ import annotations
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file
-from typing import List, Dict, Any
+from flask import (
+    Blueprint, Response, render_template, request, redirect, url_for, flash, send_file, abort,
+    stream_template, stream_with_context,
+)
+from typing import List, Dict, Any, Optional, Tuple
+import csv
+import io
+import json
 import os
-import shutil
-from ..db import get_conn
-from ..config import DB_PATH, DATA_DIR
+import re
+import sqlite3
+import time
+from ..db import get_conn, open_connection
+from ..backup import backup_history, create_backup, open_snapshot
+from ..config import DB_PATH, SQL_ROW_CAP, SQL_TIME_LIMIT, SQL_DOWNLOAD_TIME_LIMIT
 
 
 admin_bp = Blueprint("admin", __name__)
 
+# List views show at most this many characters of a TEXT cell; BLOBs show as
+# their byte length. The edit page still loads the full row.
+TEXT_PREVIEW_CHARS = 200
+
 
 def list_tables() -> List[str]:
     with get_conn() as conn:
@@ -34,9 +47,11 @@ def table_info(name: str) -> List[Dict[str, Any]]:
 
 def primary_key(name: str) -> str | None:
     cols = table_info(name)
-    for c in cols:
-        if c["pk"]:
-            return c["name"]
+    pks = [c for c in cols if c["pk"]]
+    if len(pks) == 1:
+        return pks[0]["name"]
+    if pks:
+        return None
     # Fall back to 'id'
     for c in cols:
         if c["name"].lower() == "id":
@@ -44,29 +59,73 @@ def primary_key(name: str) -> str | None:
     return None
 
 
+def _require_table(name: str) -> None:
+    if name not in list_tables():
+        abort(404)
+
+
+def approximate_counts(conn, tables: List[str]) -> Dict[str, Tuple[Optional[int], str]]:
+    """{table: (row estimate, source)} without scanning any table.
+
+    Uses sqlite_stat1 from the last ANALYZE, else MAX(rowid), which is a
+    single b-tree seek and an upper bound once rows have been deleted.
+    """
+    stats: Dict[str, int] = {}
+    try:
+        for tbl, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+            if stat:
+                stats[tbl] = max(stats.get(tbl, 0), int(str(stat).split()[0]))
+    except Exception:
+        pass  # never analyzed
+    out: Dict[str, Tuple[Optional[int], str]] = {}
+    for t in tables:
+        if t in stats:
+            out[t] = (stats[t], "analyze")
+            continue
+        try:
+            out[t] = (conn.execute(f"SELECT MAX(rowid) FROM {t}").fetchone()[0] or 0, "max_rowid")
+        except Exception:
+            out[t] = (None, "")
+    return out
+
+
 @admin_bp.route("/db")
 def db_home():
+    exact = request.args.get("exact") == "1"
     rows = []
     with get_conn() as conn:
-        for t in list_tables():
-            cnt = conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
-            rows.append({"table": t, "count": cnt})
-    return render_template("db_admin.html", tables=rows, db_path=str(DB_PATH))
+        tables = list_tables()
+        approx = {} if exact else approximate_counts(conn, tables)
+        for t in tables:
+            if exact:
+                rows.append({"table": t, "count": conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0], "source": "exact"})
+            else:
+                cnt, source = approx[t]
+                rows.append({"table": t, "count": cnt, "source": source})
+    return render_template("db_admin.html", tables=rows, db_path=str(DB_PATH), exact=exact, backups=backup_history(5))
+
+
+@admin_bp.route("/db/analyze", methods=["POST"])
+def db_analyze():
+    # analysis_limit bounds the rows sampled per index; counts stay estimates
+    with get_conn() as conn:
+        conn.execute("PRAGMA analysis_limit=1000")
+        conn.execute("ANALYZE")
+        conn.commit()
+    return redirect(url_for("admin.db_home"))
 
 
 @admin_bp.route("/db/download")
 def db_download():
-    return send_file(DB_PATH, as_attachment=True, download_name=os.path.basename(DB_PATH))
+    # A backup-API snapshot, never the live file with writes in flight
+    snapshot = open_snapshot()
+    return send_file(snapshot, as_attachment=True, download_name=os.path.basename(DB_PATH),
+                     mimetype="application/vnd.sqlite3")
 
 
 @admin_bp.route("/db/backup", methods=["POST"])
 def db_backup():
-    backups = DATA_DIR / "backups"
-    backups.mkdir(parents=True, exist_ok=True)
-    from datetime import datetime
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    out = backups / f"fae_{ts}.db"
-    shutil.copy2(DB_PATH, out)
+    create_backup()
     return redirect(url_for("admin.db_home"))
 
 
@@ -77,22 +136,113 @@ def db_vacuum():
     return redirect(url_for("admin.db_home"))
 
 
+def _without_rowid(name: str) -> bool:
+    with get_conn() as conn:
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone()
+    return bool(row and row[0] and re.search(r"\)\s*WITHOUT\s+ROWID\b", row[0], re.IGNORECASE))
+
+
+def _encode_key(values: List[Any]) -> str:
+    # Composite-key cursor for URLs: a JSON array, BLOBs as {"x": hex}
+    return json.dumps([{"x": v.hex()} if isinstance(v, bytes) else v for v in values], separators=(",", ":"))
+
+
+def _decode_key(raw: str, n: int) -> List[Any]:
+    values = json.loads(raw)
+    if not isinstance(values, list) or len(values) != n:
+        raise ValueError("bad key")
+    return [bytes.fromhex(v["x"]) if isinstance(v, dict) else v for v in values]
+
+
+def _list_projection(cols: List[Dict[str, Any]], keys: List[str]) -> str:
+    parts = []
+    for c in cols:
+        col, ctype = c["name"], (c["type"] or "").upper()
+        if col in keys:
+            parts.append(col)
+        elif "BLOB" in ctype:
+            parts.append(f"length({col}) AS {col}")
+        elif not ctype or any(t in ctype for t in ("TEXT", "CHAR", "CLOB")):
+            parts.append(f"substr({col}, 1, {TEXT_PREVIEW_CHARS + 1}) AS {col}")
+        else:
+            parts.append(col)
+    return ", ".join(parts)
+
+
 @admin_bp.route("/db/table/<name>")
 def db_table(name: str):
+    """Keyset-paged rows, newest key first: ?after=<key> pages older,
+    ?before=<key> pages newer. Tables without a single-column primary key
+    page on rowid, or on their whole primary key when WITHOUT ROWID (the
+    key is then a JSON array), and are read-only here."""
+    _require_table(name)
     cols = table_info(name)
     pk = primary_key(name)
-    page = max(1, int(request.args.get("page", 1)))
-    limit = min(200, int(request.args.get("limit", 50)))
-    offset = (page - 1) * limit
+    if pk:
+        keys = [pk]
+    elif _without_rowid(name):
+        keys = [c["name"] for c in sorted((c for c in cols if c["pk"]), key=lambda c: c["pk"])]
+    else:
+        keys = ["rowid"]
+    composite = len(keys) > 1
+    key_is_int = keys == ["rowid"] or (
+        not composite and "INT" in next((c["type"] or "" for c in cols if c["name"] == keys[0]), "").upper()
+    )
+    after = request.args.get("after")
+    before = request.args.get("before")
+    cursor: Any = after if after is not None else before
+    try:
+        limit = max(1, min(200, int(request.args.get("limit", 50))))
+        if cursor is not None and composite:
+            cursor = _decode_key(cursor, len(keys))
+        elif cursor is not None and key_is_int:
+            cursor = [int(cursor)]
+        elif cursor is not None:
+            cursor = [cursor]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        abort(400)
+    select = _list_projection(cols, keys)
+    if composite:
+        key = "(" + ", ".join(keys) + ")"
+        marks = "(" + ", ".join("?" for _ in keys) + ")"
+    else:
+        key, marks = keys[0], "?"
+        select = f"{key} AS __key__, {select}"
+    desc = ", ".join(f"{k} DESC" for k in keys)
+    asc = ", ".join(f"{k} ASC" for k in keys)
     with get_conn() as conn:
-        cur = conn.execute(f"SELECT * FROM {name} ORDER BY {pk or cols[0]['name']} DESC LIMIT ? OFFSET ?", (limit, offset))
+        if before is not None:
+            cur = conn.execute(f"SELECT {select} FROM {name} WHERE {key} > {marks} ORDER BY {asc} LIMIT ?", (*cursor, limit + 1))
+        elif after is not None:
+            cur = conn.execute(f"SELECT {select} FROM {name} WHERE {key} < {marks} ORDER BY {desc} LIMIT ?", (*cursor, limit + 1))
+        else:
+            cur = conn.execute(f"SELECT {select} FROM {name} ORDER BY {desc} LIMIT ?", (limit + 1,))
         rows = [dict(r) for r in cur.fetchall()]
-        total = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0]
-    return render_template("db_table.html", table=name, cols=cols, rows=rows, pk=pk, page=page, limit=limit, total=total)
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if before is not None:
+            rows.reverse()
+        if composite:
+            for r in rows:
+                r["__key__"] = _encode_key([r[k] for k in keys])
+        if request.args.get("exact") == "1":
+            total, source = conn.execute(f"SELECT COUNT(*) FROM {name}").fetchone()[0], "exact"
+        else:
+            total, source = approximate_counts(conn, [name])[name]
+    has_older = more if before is None else True
+    has_newer = more if before is not None else after is not None
+    blob_cols = {c["name"] for c in cols if "BLOB" in (c["type"] or "").upper()}
+    return render_template(
+        "db_table.html", table=name, cols=cols, rows=rows, pk=pk, limit=limit,
+        total=total, count_source=source, blob_cols=blob_cols, preview_chars=TEXT_PREVIEW_CHARS,
+        first_key=rows[0]["__key__"] if rows else None, last_key=rows[-1]["__key__"] if rows else None,
+        has_older=has_older, has_newer=has_newer,
+    )
 
 
 @admin_bp.route("/db/table/<name>/delete/<pk_value>", methods=["POST"])
 def db_delete(name: str, pk_value: str):
+    _require_table(name)
     pk = primary_key(name)
     if not pk:
         return "No primary key; delete not allowed", 400
@@ -104,6 +254,7 @@ def db_delete(name: str, pk_value: str):
 
 @admin_bp.route("/db/table/<name>/edit/<pk_value>", methods=["GET", "POST"])
 def db_edit(name: str, pk_value: str):
+    _require_table(name)
     pk = primary_key(name)
     if not pk:
         return "No primary key; edit not allowed", 400
@@ -133,32 +284,176 @@ def db_edit(name: str, pk_value: str):
     return render_template("db_edit.html", table=name, pk=pk, pk_value=pk_value, cols=cols, row=rowd)
 
 
+class QueryTimeout(Exception):
+    pass
+
+
+def _set_deadline(conn: sqlite3.Connection, seconds: float) -> None:
+    # The handler runs every N VM instructions; returning 1 interrupts the
+    # statement with OperationalError("interrupted")
+    deadline = time.monotonic() + seconds
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 10000)
+
+
+def _deny_attach(action, *_):
+    # mode=ro covers the main file only; an ATTACHed database would be writable
+    if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+        return sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+def _console_conn(allow_write: bool, seconds: float) -> sqlite3.Connection:
+    conn = open_connection(readonly=not allow_write)
+    if not allow_write:
+        conn.set_authorizer(_deny_attach)
+    _set_deadline(conn, seconds)
+    return conn
+
+
+def _execute(conn: sqlite3.Connection, sql_text: str, seconds: float) -> sqlite3.Cursor:
+    try:
+        return conn.execute(sql_text)
+    except sqlite3.OperationalError as e:
+        if str(e) == "interrupted":
+            raise QueryTimeout(f"Query exceeded the {seconds:g}s time limit") from e
+        raise
+
+
+class _StreamState:
+    def __init__(self) -> None:
+        self.count = 0
+        self.truncated = False
+        self.error: Optional[str] = None
+
+
+def _capped_rows(cur: sqlite3.Cursor, conn: sqlite3.Connection, cap: int, seconds: float, state: _StreamState):
+    """Yield at most cap rows, recording truncation or a timeout in state."""
+    try:
+        while True:
+            batch = cur.fetchmany(100)
+            if not batch:
+                break
+            for r in batch:
+                if state.count >= cap:
+                    state.truncated = True
+                    return
+                state.count += 1
+                yield list(r)
+    except sqlite3.OperationalError as e:
+        state.error = f"Stopped after {state.count} rows: query exceeded the {seconds:g}s time limit" if str(e) == "interrupted" else str(e)
+    finally:
+        conn.close()
+
+
+def _plan_rows(conn: sqlite3.Connection, sql_text: str) -> List[Dict[str, Any]]:
+    depth: Dict[int, int] = {0: -1}
+    out = []
+    for r in conn.execute(f"EXPLAIN QUERY PLAN {sql_text}").fetchall():
+        depth[r[0]] = depth.get(r[1], -1) + 1
+        out.append({"depth": depth[r[0]], "detail": r[3]})
+    return out
+
+
+def _download(sql_text: str, fmt: str) -> Response:
+    # Full result set, no row cap; the first statement step runs here so SQL
+    # errors are reported before any bytes are sent.
+    conn = _console_conn(False, SQL_DOWNLOAD_TIME_LIMIT)
+    try:
+        cur = _execute(conn, sql_text, SQL_DOWNLOAD_TIME_LIMIT)
+    except Exception:
+        conn.close()
+        raise
+    cols = [d[0] for d in cur.description] if cur.description else []
+
+    def generate():
+        try:
+            if fmt == "csv":
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                writer.writerow(cols)
+                for batch in iter(lambda: cur.fetchmany(500), []):
+                    for r in batch:
+                        writer.writerow([v.hex() if isinstance(v, bytes) else v for v in r])
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+                yield buf.getvalue()
+            else:
+                for batch in iter(lambda: cur.fetchmany(500), []):
+                    yield "".join(
+                        json.dumps({c: (v.hex() if isinstance(v, bytes) else v) for c, v in zip(cols, r)}, separators=(",", ":")) + "\n"
+                        for r in batch
+                    )
+        finally:
+            conn.close()
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    resp = Response(stream_with_context(generate()), mimetype=mimetype)
+    resp.headers["Content-Disposition"] = f"attachment; filename=query.{fmt}"
+    return resp
+
+
 @admin_bp.route("/db/sql", methods=["GET", "POST"])
 def db_sql():
-    result = None
-    error = None
+    """Console for one statement at a time.
+
+    Read-only queries run on a mode=ro connection. Results stream into the
+    page up to SQL_ROW_CAP rows, and execution is cut off after
+    SQL_TIME_LIMIT seconds. Explain shows EXPLAIN QUERY PLAN, and CSV/JSONL
+    download the full result set.
+    """
     sql_text = ""
     allow_write = False
+    action = "run"
+    ctx: Dict[str, Any] = {"result": None, "error": None, "plan": None, "row_cap": SQL_ROW_CAP, "time_limit": SQL_TIME_LIMIT}
     if request.method == "POST":
-        sql_text = request.form.get("sql", "").strip()
+        sql_text = request.form.get("sql", "").strip().rstrip(";")
         allow_write = request.form.get("allow_write") == "on"
+        action = request.form.get("action", "run")
+    ctx.update(sql_text=sql_text, allow_write=allow_write)
+    if not sql_text:
+        return render_template("db_sql.html", **ctx)
+    try:
+        if action in ("csv", "jsonl"):
+            return _download(sql_text, action)
+        if action == "explain":
+            conn = _console_conn(False, SQL_TIME_LIMIT)
+            try:
+                ctx["plan"] = _plan_rows(conn, sql_text)
+            finally:
+                conn.close()
+            return render_template("db_sql.html", **ctx)
+        conn = _console_conn(allow_write, SQL_TIME_LIMIT)
         try:
-            with get_conn() as conn:
-                if not allow_write:
-                    # Simple safety: only allow SELECT/PRAGMA/EXPLAIN/WITH
-                    for stmt in [s.strip() for s in sql_text.split(';') if s.strip()]:
-                        up = stmt.upper()
-                        if not (up.startswith("SELECT") or up.startswith("PRAGMA") or up.startswith("EXPLAIN") or up.startswith("WITH")):
-                            raise ValueError("Only read-only statements allowed without write permission")
-                cur = conn.execute(sql_text)
-                # Try fetching rows if any
-                try:
-                    rows = cur.fetchall()
-                    cols = [d[0] for d in cur.description] if cur.description else []
-                    result = {"cols": cols, "rows": [list(r) for r in rows]}
-                except Exception:
-                    result = {"ok": True}
-        except Exception as e:
-            error = str(e)
-    return render_template("db_sql.html", result=result, error=error, sql_text=sql_text, allow_write=allow_write)
-
+            cur = _execute(conn, sql_text, SQL_TIME_LIMIT)
+        except Exception:
+            conn.close()
+            raise
+        if allow_write:
+            # Writes commit before the page renders; any RETURNING rows are
+            # already buffered by SQLite at this point
+            try:
+                rows = [list(r) for r in cur.fetchmany(SQL_ROW_CAP)]
+                cols = [d[0] for d in cur.description] if cur.description else []
+                cur.close()
+                conn.commit()
+            finally:
+                conn.close()
+            state = _StreamState()
+            state.count = len(rows)
+            ctx["result"] = {"cols": cols, "rows": rows, "state": state}
+            return render_template("db_sql.html", **ctx)
+        if not cur.description:
+            conn.close()
+            ctx["result"] = {"cols": [], "rows": [], "state": _StreamState()}
+            return render_template("db_sql.html", **ctx)
+        state = _StreamState()
+        ctx["result"] = {
+            "cols": [d[0] for d in cur.description],
+            "rows": _capped_rows(cur, conn, SQL_ROW_CAP, SQL_TIME_LIMIT, state),
+            "state": state,
+        }
+        return Response(stream_template("db_sql.html", **ctx))
+    except Exception as e:
+        ctx["error"] = str(e)
+        return render_template("db_sql.html", **ctx)
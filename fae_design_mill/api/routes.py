@@ -1,6 +1,9 @@
 from __future__ import annotations
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 import os
+import sqlite3
+from datetime import datetime
+from markupsafe import escape
 
 from ..scheduler import run_once
 from ..prompt.engine import build_prompt
@@ -9,20 +12,46 @@ from ..repositories import (
     set_default_mode,
     get_policy,
     list_variable_lists,
-    list_variable_items,
-    add_variable_item,
+    variable_items_page,
+    bulk_add_variable_items,
     delete_variable_item,
     update_variable_item,
     add_variable_list,
+    get_variable_list,
     scaffold_lists_for_defaults,
     seed_comprehensive_variable_lists,
+    run_history,
+    search_available,
+    search_prompts,
+    config_generation,
+    ITEM_MATCH_MODES,
 )
 from ..db import get_conn
+from ..importers import ImportFormatError, detect_format, iter_rows
+from ..export import export_chunks
+from ..prompt.search import fts_query
+from ..storage.thumbs import thumb_url, thumb_urls
 
 
 api_bp = Blueprint("api", __name__)
 
 
+def _config_response(build):
+    """JSON from build() tagged with the config generation; 304 if unchanged.
+
+    The generation is read first, so a write racing build() can only make
+    the tag stale-low and force a refetch, never pin old data.
+    """
+    etag = f"cfg-{config_generation()}"
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        resp = jsonify(build())
+    resp.set_etag(etag, weak=True)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
 @api_bp.route("/preview", methods=["POST"])
 def preview():
     data = request.get_json(silent=True) or {}
@@ -36,37 +65,109 @@ def run_now():
     data = request.get_json(silent=True) or {}
     force_new = bool(data.get("force_new", False))
     random_seed = bool(data.get("random_seed", False))
-    res = run_once(force_new=force_new, random_seed=random_seed)
+    seed = data.get("seed")
+    if seed is not None and (isinstance(seed, bool) or not isinstance(seed, int)):
+        return jsonify({"error": "seed must be an integer"}), 400
+    res = run_once(force_new=force_new, random_seed=random_seed, seed=seed)
     return jsonify(res)
 
 @api_bp.route("/runs", methods=["GET"])
 def list_runs():
-    # minimal: last 20 assets
-    from ..db import get_conn
-    with get_conn() as conn:
-        cur = conn.execute(
-            """
-            SELECT dr.id as run_id, dr.status, pr.id as prompt_id, ar.id as asset_id, ar.file_path, ar.created_at
-            FROM design_run dr
-            LEFT JOIN prompt_record pr ON pr.design_run_id = dr.id
-            LEFT JOIN asset_record ar ON ar.design_run_id = dr.id
-            ORDER BY dr.id DESC LIMIT 20
-            """
+    # ?before=<run id cursor>&limit=&status=&provider=&since=&until=&fields=compact
+    args = request.args
+    try:
+        before = int(args["before"]) if args.get("before") else None
+        limit = int(args.get("limit", 20))
+    except ValueError:
+        return jsonify({"error": "before and limit must be integers"}), 400
+    compact = args.get("fields") == "compact"
+    try:
+        page, next_cursor = run_history(
+            before=before,
+            limit=limit,
+            status=(args.get("status") or "").upper() or None,
+            provider=(args.get("provider") or "").lower() or None,
+            since=args.get("since") or None,
+            until=args.get("until") or None,
+            compact=compact,
         )
-        rows = []
-        for r in cur.fetchall():
-            d = dict(r)
-            fp = d.get("file_path") or ""
-            if fp:
-                d["file_url"] = f"/assets/{os.path.basename(fp)}"
-            rows.append(d)
-    return jsonify({"items": rows})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rows = []
+    for d in page:
+        fp = (d.pop("file_path", None) if compact else d.get("file_path")) or ""
+        if fp and not d.get("file_url"):
+            d["file_url"] = f"/assets/{os.path.basename(fp)}"
+        content_hash = d.pop("content_hash", None) if compact else d.get("content_hash")
+        if content_hash:
+            d["thumb_url"] = thumb_url(content_hash, 256)
+            if not compact:
+                d["thumbs"] = thumb_urls(content_hash)
+        rows.append(d)
+    return jsonify({"items": rows, "next_cursor": next_cursor})
+
+
+@api_bp.route("/search", methods=["GET"])
+def search():
+    # ?q=words (all must match, last as prefix) or ?fts=<raw FTS5 query>&limit=&offset=
+    if not search_available():
+        return jsonify({"error": "search unavailable: this SQLite build has no FTS5"}), 501
+    raw = request.args.get("fts")
+    match = raw if raw else fts_query(request.args.get("q", ""))
+    if not match:
+        return jsonify({"items": [], "has_more": False})
+    try:
+        limit = int(request.args.get("limit", 20))
+        offset = int(request.args.get("offset", 0))
+        hits, has_more = search_prompts(match, limit, offset)
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+    except sqlite3.OperationalError as e:
+        return jsonify({"error": f"bad search query: {e}"}), 400
+    items = []
+    for d in hits:
+        fp = d.pop("file_path", None) or ""
+        if fp and not d.get("file_url"):
+            d["file_url"] = f"/assets/{os.path.basename(fp)}"
+        content_hash = d.pop("content_hash", None)
+        if content_hash:
+            d["thumb_url"] = thumb_url(content_hash, 256)
+        snippet = d.pop("snippet") or ""
+        d["snippet"] = snippet.replace("\x02", "").replace("\x03", "")
+        d["snippet_html"] = str(escape(snippet)).replace("\x02", "<mark>").replace("\x03", "</mark>")
+        items.append(d)
+    return jsonify({"items": items, "has_more": has_more, "query": match})
+
+
+@api_bp.route("/export", methods=["GET"])
+def export_runs():
+    # ?format=jsonl|csv&since=&until=&status=&prompt=0 ; streamed, never buffered
+    fmt = (request.args.get("format") or "jsonl").lower()
+    if fmt not in ("jsonl", "csv"):
+        return jsonify({"error": "format must be jsonl or csv"}), 400
+    # Validate up front: once streaming starts the status code is already sent
+    for key in ("since", "until"):
+        if request.args.get(key):
+            try:
+                datetime.fromisoformat(request.args[key])
+            except ValueError:
+                return jsonify({"error": f"{key} must be an ISO date or timestamp"}), 400
+    chunks = export_chunks(
+        fmt,
+        since=request.args.get("since") or None,
+        until=request.args.get("until") or None,
+        status=(request.args.get("status") or "").upper() or None,
+        include_prompt=request.args.get("prompt", "1") not in ("0", "false", "no"),
+    )
+    resp = Response(stream_with_context(chunks), mimetype="text/csv" if fmt == "csv" else "application/x-ndjson")
+    resp.headers["Content-Disposition"] = f"attachment; filename=fae_runs.{fmt}"
+    return resp
 
 
 @api_bp.route("/defaults", methods=["GET","POST"])
 def defaults():
     if request.method == "GET":
-        return jsonify({"defaults": get_defaults_map()})
+        return _config_response(lambda: {"defaults": get_defaults_map()})
     data = request.get_json(silent=True) or {}
     key_path = data.get("key_path")
     mode = data.get("mode")
@@ -77,6 +178,17 @@ def defaults():
     set_default_mode(key_path, mode, default_value, None, llm_template)
     return jsonify({"ok": True})
 
+@api_bp.route("/policy", methods=["GET"])
+def policy():
+    return _config_response(lambda: {"policy": get_policy()})
+
+
+@api_bp.route("/llm/cache", methods=["GET"])
+def llm_cache():
+    from ..llm_cache import cache_stats
+    return jsonify(cache_stats())
+
+
 @api_bp.route("/policy", methods=["POST"])  # update selected generator policy fields
 def set_policy():
     data = request.get_json(silent=True) or {}
@@ -113,7 +225,7 @@ def set_policy():
 @api_bp.route("/variables", methods=["GET", "POST"])
 def variables_root():
     if request.method == "GET":
-        return jsonify({"lists": list_variable_lists()})
+        return _config_response(lambda: {"lists": list_variable_lists()})
     data = request.get_json(silent=True) or {}
     name = data.get("name")
     description = data.get("description", "")
@@ -148,23 +260,58 @@ def variables_seed_defaults():
 @api_bp.route("/variables/<list_name>", methods=["GET", "POST"])
 def variables_list_items(list_name: str):
     if request.method == "GET":
-        return jsonify({"items": list_variable_items(list_name)})
+        # Keyset paging: pass next_cursor back as ?after= for the next (older) page
+        args = request.args
+        enabled = args.get("enabled")
+        match = args.get("match", "substring")
+        if match not in ITEM_MATCH_MODES:
+            return jsonify({"error": f"match must be one of {', '.join(ITEM_MATCH_MODES)}"}), 400
+
+        def page():
+            items, next_cursor = variable_items_page(
+                list_name,
+                after=args.get("after", type=int),
+                limit=args.get("limit", 100, type=int),
+                q=args.get("q") or None,
+                match=match,
+                enabled=None if enabled in (None, "") else enabled.lower() in ("1", "true", "yes", "on"),
+                tag=args.get("tag") or None,
+            )
+            return {"items": items, "next_cursor": next_cursor}
+
+        return _config_response(page)
     data = request.get_json(silent=True) or {}
     values = data.get("values")
     weight = float(data.get("weight", 1.0))
     cooldown_days = int(data.get("cooldown_days", 0))
     enabled = bool(data.get("enabled", True))
     tags = data.get("tags") or []
-    if isinstance(values, list):
-        ids = []
-        for v in values:
-            ids.append(add_variable_item(list_name, str(v), weight, enabled, cooldown_days, tags))
-        return jsonify({"ok": True, "created": ids})
-    elif isinstance(values, str):
-        iid = add_variable_item(list_name, values, weight, enabled, cooldown_days, tags)
-        return jsonify({"ok": True, "created": [iid]})
-    else:
+    if isinstance(values, str):
+        values = [values]
+    if not isinstance(values, list):
         return jsonify({"error": "values must be string or list of strings"}), 400
+    stats = bulk_add_variable_items(list_name, values, weight, enabled, cooldown_days, tags, with_ids=True)
+    return jsonify({"ok": True, "created": stats["ids"], "skipped": stats["skipped"]})
+
+
+@api_bp.route("/variables/<list_name>/import", methods=["POST"])
+def variables_import(list_name: str):
+    # Body is the raw JSON array / CSV / JSONL; defaults come from the query string
+    fmt = request.args.get("format") or detect_format(content_type=request.content_type) or "csv"
+    tags = request.args.get("tags")
+    try:
+        rows = iter_rows(request.stream, fmt)
+        stats = bulk_add_variable_items(
+            list_name,
+            rows,
+            weight=float(request.args.get("weight", 1.0)),
+            enabled=request.args.get("enabled", "1").lower() not in ("0", "false", "no", "off"),
+            cooldown_days=int(request.args.get("cooldown_days", 0)),
+            tags=[t.strip() for t in tags.split(",") if t.strip()] if tags else [],
+        )
+    except (ImportFormatError, ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"ok": True, "format": fmt, **stats})
 
 
 @api_bp.route("/variables/<list_name>/<int:item_id>", methods=["POST"])
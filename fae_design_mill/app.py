@@ -1,18 +1,54 @@
 from __future__ import annotations
-from flask import Flask, render_template, send_from_directory
+from flask import Flask, Response, abort, render_template, request, send_from_directory
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file as _wz_send_file
 from pathlib import Path
 import json
+import mimetypes
 from .db import get_conn
 from .db import init_db
 from .api.routes import api_bp
 from .admin.routes import admin_bp
-from .config import ASSETS_DIR
+from .config import ASSETS_DIR, THUMBS_DIR, DATA_DIR, ASSET_MAX_AGE, ASSET_SENDFILE, ASSET_ACCEL_PREFIX
+from .storage.assets import resolve_asset, content_hash_for
+from .storage.thumbs import parse_thumb_relpath, ensure_thumbnail
 
 
-def create_app() -> Flask:
+def _send_immutable(root: Path, relpath: str, etag: str) -> Response:
+    """Send a write-once file with a strong ETag and immutable caching.
+
+    Conditional GETs get a 304 and byte ranges a 206 (handled by Werkzeug), or
+    delivery is delegated to the front server per ASSET_SENDFILE.
+    """
+    full = safe_join(str(root), relpath)
+    if full is None or not Path(full).is_file():
+        abort(404)
+    if ASSET_SENDFILE == "x-accel":
+        if request.if_none_match.contains(etag):
+            resp = Response(status=304)
+        else:
+            resp = Response(mimetype=mimetypes.guess_type(relpath)[0] or "application/octet-stream")
+            internal = Path(full).resolve().relative_to(DATA_DIR.resolve()).as_posix()
+            resp.headers["X-Accel-Redirect"] = ASSET_ACCEL_PREFIX.rstrip("/") + "/" + internal
+        resp.set_etag(etag)
+    elif ASSET_SENDFILE == "x-sendfile":
+        resp = _wz_send_file(full, request.environ, use_x_sendfile=True, etag=etag, max_age=ASSET_MAX_AGE, conditional=True)
+    else:
+        resp = send_from_directory(str(root), relpath, as_attachment=False, etag=etag, max_age=ASSET_MAX_AGE)
+    resp.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    return resp
+
+
+def create_app(run_migrations: bool = True) -> Flask:
+    """Build the Flask app.
+
+    Pass run_migrations=False where the schema was already brought up to date
+    once before forking workers (see fae_design_mill.serve).
+    """
     template_dir = Path(__file__).with_name("ui") / "templates"
     app = Flask(__name__, template_folder=str(template_dir))
-    init_db()
+    if run_migrations:
+        init_db()
     app.register_blueprint(api_bp, url_prefix="/api")
     app.register_blueprint(admin_bp, url_prefix="/admin")
 
@@ -46,18 +82,14 @@ def create_app() -> Flask:
 
     @app.route("/variables/list/<name>")
     def variable_items_page(name: str):
-        # Server renders items; edits are done via API from client JS
+        # Rows are fetched page by page from /api/variables/<name> as the
+        # table scrolls; edits go through the same API
         with get_conn() as conn:
-            # Fetch list id and items
-            vlist = conn.execute("SELECT * FROM variable_list WHERE name=?", (name,)).fetchone()
-            items = []
-            if vlist:
-                cur = conn.execute(
-                    "SELECT * FROM variable_item WHERE variable_list_id = ? ORDER BY id DESC",
-                    (vlist["id"],),
-                )
-                items = [dict(r) for r in cur.fetchall()]
-        return render_template("variable_items.html", list_name=name, items=items)
+            row = conn.execute(
+                "SELECT COUNT(vi.id) FROM variable_list vl JOIN variable_item vi ON vi.variable_list_id = vl.id WHERE vl.name=?",
+                (name,),
+            ).fetchone()
+        return render_template("variable_items.html", list_name=name, item_count=row[0])
 
     @app.route("/health")
     def health():
@@ -65,7 +97,26 @@ def create_app() -> Flask:
 
     @app.route("/assets/<path:filename>")
     def assets(filename: str):
-        # Serve generated images from assets directory
-        return send_from_directory(str(ASSETS_DIR), filename, as_attachment=False)
+        # Serve generated images from the content-addressed store; legacy flat
+        # names resolve through asset_alias once migrated
+        relpath = resolve_asset(filename)
+        if relpath is None:
+            abort(404)
+        return _send_immutable(ASSETS_DIR, relpath, content_hash_for(relpath))
+
+    @app.route("/thumbs/<path:filename>")
+    def thumbs(filename: str):
+        # Renditions are content-addressed, so they can be cached forever
+        parsed = parse_thumb_relpath(filename)
+        if parsed is None:
+            abort(404)
+        try:
+            path = ensure_thumbnail(parsed[0], parsed[1])
+        except Exception:
+            path = None
+        if path is None:
+            abort(404)
+        content_hash, size = parsed
+        return _send_immutable(THUMBS_DIR, filename, f"{content_hash}-{size}")
 
     return app
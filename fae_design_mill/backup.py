@@ -0,0 +1,144 @@
+from __future__ import annotations
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Any, Dict, List, Optional
+
+from .config import (
+    BACKUPS_DIR,
+    BACKUP_COMPRESS,
+    BACKUP_KEEP,
+    BACKUP_PAGES,
+    BACKUP_STEP_SLEEP,
+)
+from .db import get_conn, open_connection
+
+
+# Online backups through sqlite3.Connection.backup(), copied in steps of
+# BACKUP_PAGES pages with a short sleep in between. The source connection
+# holds one read transaction for the whole copy: under WAL that pins a
+# consistent snapshot without blocking writers, and stops the backup from
+# restarting every time another connection commits.
+# Files are data/backups/fae_<timestamp>.db[.gz].
+
+_PREFIX = "fae_"
+
+
+def snapshot_to(dst: Path | str, pages: int = BACKUP_PAGES, sleep: float = BACKUP_STEP_SLEEP) -> int:
+    """Copy a consistent snapshot of the live database into dst (a .db file).
+
+    Returns the snapshot's size in bytes.
+    """
+    src = open_connection(readonly=True)
+    try:
+        src.execute("BEGIN")
+        src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        out = sqlite3.connect(str(dst))
+        try:
+            src.backup(out, pages=pages, sleep=sleep)
+        finally:
+            out.close()
+    finally:
+        src.close()
+    return os.path.getsize(dst)
+
+
+def create_backup(compress: bool = BACKUP_COMPRESS, keep: Optional[int] = BACKUP_KEEP) -> Dict[str, Any]:
+    """Write a new backup, log its size and duration, then apply retention."""
+    BACKUPS_DIR.mkdir(parents=True, exist_ok=True)
+    started = time.monotonic()
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    final = BACKUPS_DIR / f"{_PREFIX}{stamp}.db{'.gz' if compress else ''}"
+    part = BACKUPS_DIR / f"{_PREFIX}{stamp}.db.part"
+    try:
+        db_bytes = snapshot_to(part)
+        if compress:
+            gz_part = final.with_name(final.name + ".part")
+            with open(part, "rb") as f, gzip.open(gz_part, "wb", compresslevel=6) as g:
+                shutil.copyfileobj(f, g, 1 << 20)
+            part.unlink()
+            part = gz_part
+        os.replace(part, final)
+    finally:
+        if part.exists():
+            part.unlink()
+    info = {
+        "created_at": datetime.utcnow().isoformat(),
+        "path": str(final),
+        "compressed": bool(compress),
+        "db_bytes": db_bytes,
+        "backup_bytes": final.stat().st_size,
+        "duration_ms": int((time.monotonic() - started) * 1000),
+    }
+    with get_conn() as conn:
+        conn.execute(
+            "INSERT INTO backup_log(created_at, path, compressed, db_bytes, backup_bytes, duration_ms) VALUES(?,?,?,?,?,?)",
+            (info["created_at"], info["path"], 1 if compress else 0, info["db_bytes"], info["backup_bytes"], info["duration_ms"]),
+        )
+        conn.commit()
+    if keep is not None:
+        info["pruned"] = prune_backups(keep)
+    return info
+
+
+def list_backups() -> List[Path]:
+    """Backup files, newest first."""
+    if not BACKUPS_DIR.exists():
+        return []
+    files = [
+        p for p in BACKUPS_DIR.iterdir()
+        if p.is_file() and p.name.startswith(_PREFIX) and (p.name.endswith(".db") or p.name.endswith(".db.gz"))
+    ]
+    return sorted(files, key=lambda p: p.name, reverse=True)
+
+
+_STALE_PART_SECONDS = 24 * 3600
+
+
+def prune_backups(keep: int = BACKUP_KEEP) -> int:
+    """Delete all but the newest `keep` backup files; returns how many went.
+
+    Leftovers of interrupted backups (*.part*) older than a day go too.
+    """
+    removed = 0
+    cutoff = time.time() - _STALE_PART_SECONDS
+    stale = [
+        p for p in (BACKUPS_DIR.iterdir() if BACKUPS_DIR.exists() else [])
+        if ".part" in p.name and p.is_file() and p.stat().st_mtime < cutoff
+    ]
+    for p in list_backups()[max(0, keep):] + stale:
+        try:
+            p.unlink()
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def backup_history(limit: int = 10) -> List[Dict[str, Any]]:
+    with get_conn() as conn:
+        cur = conn.execute("SELECT * FROM backup_log ORDER BY id DESC LIMIT ?", (limit,))
+        rows = [dict(r) for r in cur.fetchall()]
+    for r in rows:
+        r["exists"] = Path(r["path"]).exists()
+    return rows
+
+
+def open_snapshot() -> IO[bytes]:
+    """A consistent snapshot as an open, already-unlinked temporary file."""
+    BACKUPS_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = BACKUPS_DIR / f".download_{os.getpid()}_{time.monotonic_ns()}.db"
+    try:
+        snapshot_to(tmp)
+        f = open(tmp, "rb")
+    finally:
+        # POSIX keeps the data readable through the open handle
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+    return f
@@ -1,31 +1,104 @@
 from pathlib import Path
 import os
 
-# Load .env if present
-try:
-    from dotenv import load_dotenv
-except Exception:  # optional dep
-    load_dotenv = None  # type: ignore
-
 # Project root (folder containing this package)
 ROOT_DIR = Path(__file__).resolve().parents[1]
 DATA_DIR = ROOT_DIR / "data"
 ASSETS_DIR = DATA_DIR / "assets"
 PROMPTS_DIR = DATA_DIR / "prompts"
+THUMBS_DIR = DATA_DIR / "thumbs"
+PROMPT_ARCHIVE_DIR = PROMPTS_DIR / "archive"
 DB_PATH = DATA_DIR / "fae.db"
+BACKUPS_DIR = DATA_DIR / "backups"
 
-# Load .env from project root early
-if load_dotenv:
-    env_path = ROOT_DIR / ".env"
-    if env_path.exists():
+# Load .env from project root early; python-dotenv (an optional dep that
+# pulls in logging) is only imported when there is a file to load
+env_path = ROOT_DIR / ".env"
+if env_path.exists():
+    try:
+        from dotenv import load_dotenv
+    except Exception:  # optional dep
+        load_dotenv = None  # type: ignore
+    if load_dotenv:
         load_dotenv(dotenv_path=env_path)
 
+# SQLite connection tuning (connections are long-lived, one per thread)
+DB_BUSY_TIMEOUT_MS = int(os.getenv("FAE_DB_BUSY_TIMEOUT_MS", "5000"))
+DB_MMAP_SIZE = int(os.getenv("FAE_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE = 256
+
+# Admin SQL console: rows rendered per query and wall-clock limits (seconds)
+# for console queries and for streamed CSV/JSONL downloads
+SQL_ROW_CAP = int(os.getenv("FAE_SQL_ROW_CAP", "1000"))
+SQL_TIME_LIMIT = float(os.getenv("FAE_SQL_TIME_LIMIT", "10"))
+SQL_DOWNLOAD_TIME_LIMIT = float(os.getenv("FAE_SQL_DOWNLOAD_TIME_LIMIT", "300"))
+
+# Online backups (sqlite3 backup API): pages copied per step and the pause
+# between steps so writers are never blocked for long; the newest
+# FAE_BACKUP_KEEP files are kept; the scheduler takes one after each daily run
+BACKUP_PAGES = int(os.getenv("FAE_BACKUP_PAGES", "1024"))
+BACKUP_STEP_SLEEP = float(os.getenv("FAE_BACKUP_STEP_SLEEP", "0.005"))
+BACKUP_COMPRESS = os.getenv("FAE_BACKUP_COMPRESS", "1").strip().lower() not in ("0", "false", "no", "off")
+BACKUP_KEEP = int(os.getenv("FAE_BACKUP_KEEP", "7"))
+BACKUP_ON_SCHEDULE = os.getenv("FAE_BACKUP_ON_SCHEDULE", "1").strip().lower() not in ("0", "false", "no", "off")
+
 # Scheduling defaults
 DEFAULT_SCHEDULE_HOUR = int(os.getenv("FAE_SCHEDULE_HOUR", "9"))  # 09:00 local
 
+# `manage.py serve --prod` (gunicorn): worker processes x threads each;
+# TIMEOUT restarts a worker that stops heartbeating for that many seconds,
+# GRACEFUL_TIMEOUT is how long in-flight requests get on restart/shutdown,
+# MAX_REQUESTS recycles a worker after that many requests (0 = never).
+# SERVE_SCHEDULER runs the daily scheduler in its own process alongside.
+SERVE_WORKERS = int(os.getenv("FAE_SERVE_WORKERS", "2"))
+SERVE_THREADS = int(os.getenv("FAE_SERVE_THREADS", "4"))
+SERVE_TIMEOUT = int(os.getenv("FAE_SERVE_TIMEOUT", "60"))
+SERVE_GRACEFUL_TIMEOUT = int(os.getenv("FAE_SERVE_GRACEFUL_TIMEOUT", "30"))
+SERVE_MAX_REQUESTS = int(os.getenv("FAE_SERVE_MAX_REQUESTS", "1000"))
+SERVE_SCHEDULER = os.getenv("FAE_SERVE_SCHEDULER", "1").strip().lower() not in ("0", "false", "no", "off")
+
+# Prompt persistence: "archive" (daily gzip segments + offset index) or
+# "files" (legacy pretty-printed JSON per run)
+PROMPT_STORE = os.getenv("FAE_PROMPT_STORE", "archive").strip().lower()
+
+# Dashboard thumbnail renditions (max side, px)
+THUMB_SIZES = (128, 256)
+
+# Asset delivery: files are immutable once written, so browsers may cache them
+# for a year. FAE_ASSET_SENDFILE hands the bytes to the front server:
+#   x-sendfile  -> Apache/lighttpd X-Sendfile header with the absolute path
+#   x-accel     -> nginx X-Accel-Redirect to FAE_ASSET_ACCEL_PREFIX + path under data/
+ASSET_MAX_AGE = 31536000
+ASSET_SENDFILE = os.getenv("FAE_ASSET_SENDFILE", "").strip().lower()
+ASSET_ACCEL_PREFIX = os.getenv("FAE_ASSET_ACCEL_PREFIX", "/_protected/")
+
 # Provider selection (can extend to use env)
 DEFAULT_PROVIDER = os.getenv("FAE_PROVIDER", "null")
 
+# LLM field generation (OpenAI chat completions). FAE_LLM_BASE_URL points the
+# client at any OpenAI-compatible endpoint, e.g. a local server for testing.
+LLM_MODEL = os.getenv("FAE_LLM_MODEL", "gpt-4o-mini")
+LLM_BASE_URL = os.getenv("FAE_LLM_BASE_URL", "").strip()
+LLM_TIMEOUT = float(os.getenv("FAE_LLM_TIMEOUT", "30"))
+LLM_TEMPERATURE = 0.7
+
+# LLM reply cache (separate SQLite file, safe to delete): replies kept per
+# identical request before lookups start reusing them, and their lifetime
+LLM_CACHE = os.getenv("FAE_LLM_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+LLM_CACHE_PATH = DATA_DIR / "llm_cache.db"
+LLM_CACHE_VARIANTS = max(1, int(os.getenv("FAE_LLM_CACHE_VARIANTS", "3")))
+LLM_CACHE_TTL = float(os.getenv("FAE_LLM_CACHE_TTL", str(7 * 24 * 3600)))
+
+# LLM value reservoir: candidates kept ready per LLM-mode key, how many to ask
+# for per request, and how often the background process tops it up (seconds)
+LLM_RESERVOIR_DEPTH = int(os.getenv("FAE_LLM_RESERVOIR_DEPTH", "20"))
+LLM_REFILL_BATCH = int(os.getenv("FAE_LLM_REFILL_BATCH", "10"))
+LLM_REFILL_INTERVAL = int(os.getenv("FAE_LLM_REFILL_INTERVAL", "600"))
+
+# Seconds a run holds the list items its prompt drew before they either turn
+# into cooldown_log rows (prompt accepted) or are released (run failed)
+ITEM_RESERVATION_TTL = int(os.getenv("FAE_ITEM_RESERVATION_TTL", "900"))
+
 # Generation policy defaults (if DB empty)
 POLICY_DEFAULTS = {
     "min_days_between_similar_prompt": 7,
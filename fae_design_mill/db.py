@@ -1,99 +1,475 @@
+import json
+import os
 import sqlite3
+import threading
+import weakref
 from contextlib import contextmanager
 from pathlib import Path
-from .config import DB_PATH, ROOT_DIR
+from typing import Any, Callable, List, Sequence, Tuple
+from .config import DB_PATH, ROOT_DIR, DB_BUSY_TIMEOUT_MS, DB_MMAP_SIZE, DB_STATEMENT_CACHE
 
 
-def _connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+class PooledConnection(sqlite3.Connection):
+    """Long-lived per-thread connection.
+
+    Inside transaction() the repository helpers' own commit() calls are
+    deferred so several writes land in one commit.
+    """
+
+    tx_depth = 0
+
+    def commit(self) -> None:
+        if self.tx_depth:
+            return
+        super().commit()
+
+
+_local = threading.local()
+_open_conns: "weakref.WeakSet[PooledConnection]" = weakref.WeakSet()
+_open_lock = threading.Lock()
+
+
+def _connect() -> PooledConnection:
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000.0,
+        cached_statements=DB_STATEMENT_CACHE,
+        factory=PooledConnection,
+    )
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
+    # WAL lets readers proceed while a writer commits; NORMAL is durable
+    # across application crashes in WAL mode and avoids an fsync per commit
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def _thread_conn() -> PooledConnection:
+    conn = getattr(_local, "conn", None)
+    # Never reuse a connection inherited across fork()
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+        with _open_lock:
+            _open_conns.add(conn)
+    return conn
+
+
+def open_connection(readonly: bool = False) -> sqlite3.Connection:
+    """Standalone connection outside the per-thread pool; the caller closes it.
+
+    For long reads (console queries, streamed downloads) that should not tie
+    up the pooled connection. readonly opens the file with mode=ro so SQLite
+    itself rejects writes.
+    """
+    if readonly:
+        uri = f"{Path(DB_PATH).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=DB_BUSY_TIMEOUT_MS / 1000.0, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000.0, check_same_thread=False)
+        conn.execute("PRAGMA foreign_keys = ON")
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
     return conn
 
 
 @contextmanager
 def get_conn():
-    conn = _connect()
+    conn = _thread_conn()
     try:
         yield conn
     finally:
-        conn.close()
+        # Outside transaction() anything left uncommitted is discarded, as it
+        # was when each call closed its own connection
+        if not conn.tx_depth and conn.in_transaction:
+            conn.rollback()
 
 
-def init_db():
-    schema_path = Path(__file__).with_name("schema.sql")
-    sql = schema_path.read_text(encoding="utf-8")
-    with get_conn() as conn:
-        conn.executescript(sql)
-        # Migrations: ensure variable_defaults has llm_template and allows LLM
-        try:
-            cur = conn.execute("PRAGMA table_info(variable_defaults)")
-            cols = [r[1] for r in cur.fetchall()]
-            needs_llm_template = "llm_template" not in cols
-            # Check mode constraint by reading sqlite_master
-            cur = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='variable_defaults'")
-            ddl = (cur.fetchone() or ("",))[0] or ""
-            allows_llm = "'LLM'" in ddl
-            if needs_llm_template or not allows_llm:
-                # Rebuild table to add llm_template and allow LLM in CHECK
-                conn.execute("ALTER TABLE variable_defaults RENAME TO variable_defaults_old")
-                conn.executescript(
-                    """
-                    CREATE TABLE variable_defaults (
-                      id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      key_path TEXT NOT NULL UNIQUE,
-                      mode TEXT NOT NULL CHECK(mode IN ('LOCKED','WEIGHTED','RANDOM','SEQUENCE','LLM')),
-                      default_value TEXT,
-                      weight_profile_id INTEGER,
-                      sequence_pointer INTEGER DEFAULT 0,
-                      llm_template TEXT
-                    );
-                    INSERT INTO variable_defaults(id, key_path, mode, default_value, weight_profile_id, sequence_pointer)
-                    SELECT id, key_path, mode, default_value, weight_profile_id, sequence_pointer FROM variable_defaults_old;
-                    DROP TABLE variable_defaults_old;
-                    """
-                )
-        except Exception:
-            pass
+@contextmanager
+def transaction(immediate: bool = False):
+    """Group repository writes on this thread into a single commit.
 
-        # Migrations: add provider columns if missing
+    Nested use joins the outer transaction. immediate=True takes the write
+    lock up front (BEGIN IMMEDIATE) for read-then-write sequences.
+    """
+    conn = _thread_conn()
+    if not conn.tx_depth:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    conn.tx_depth += 1
+    try:
+        yield conn
+    except BaseException:
+        conn.tx_depth -= 1
+        if not conn.tx_depth:
+            conn.rollback()
+        raise
+    else:
+        conn.tx_depth -= 1
+        if not conn.tx_depth:
+            conn.commit()
+
+
+def close_all() -> None:
+    """Close every pooled connection (before fork, backup restore, shutdown)."""
+    with _open_lock:
+        conns = list(_open_conns)
+        _open_conns.clear()
+    for conn in conns:
         try:
-            cur = conn.execute("PRAGMA table_info(generation_policy)")
-            cols = [r[1] for r in cur.fetchall()]
-            if "provider" not in cols:
-                conn.execute("ALTER TABLE generation_policy ADD COLUMN provider TEXT")
-            if "provider_params" not in cols:
-                conn.execute("ALTER TABLE generation_policy ADD COLUMN provider_params TEXT")
+            conn.close()
         except Exception:
             pass
-        # Ensure a policy row exists
-        cur = conn.execute("SELECT COUNT(*) AS c FROM generation_policy")
-        if cur.fetchone()[0] == 0:
-            from .config import POLICY_DEFAULTS, DEFAULT_PROVIDER
+    _local.__dict__.clear()
+
+
+def _schema_version(conn: sqlite3.Connection) -> int:
+    try:
+        row = conn.execute("SELECT version FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return int(row[0]) if row else 0
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _m001_baseline(conn: sqlite3.Connection) -> None:
+    """schema.sql plus the column probes init_db used to run every time."""
+    conn.executescript(Path(__file__).with_name("schema.sql").read_text(encoding="utf-8"))
+    # variable_defaults needs llm_template and must allow LLM in its CHECK
+    cur = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='variable_defaults'")
+    ddl = (cur.fetchone() or ("",))[0] or ""
+    if "llm_template" not in _columns(conn, "variable_defaults") or "'LLM'" not in ddl:
+        conn.execute("ALTER TABLE variable_defaults RENAME TO variable_defaults_old")
+        conn.executescript(
+            """
+            CREATE TABLE variable_defaults (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              key_path TEXT NOT NULL UNIQUE,
+              mode TEXT NOT NULL CHECK(mode IN ('LOCKED','WEIGHTED','RANDOM','SEQUENCE','LLM')),
+              default_value TEXT,
+              weight_profile_id INTEGER,
+              sequence_pointer INTEGER DEFAULT 0,
+              llm_template TEXT
+            );
+            INSERT INTO variable_defaults(id, key_path, mode, default_value, weight_profile_id, sequence_pointer)
+            SELECT id, key_path, mode, default_value, weight_profile_id, sequence_pointer FROM variable_defaults_old;
+            DROP TABLE variable_defaults_old;
+            """
+        )
+    cols = _columns(conn, "generation_policy")
+    if "provider" not in cols:
+        conn.execute("ALTER TABLE generation_policy ADD COLUMN provider TEXT")
+    if "provider_params" not in cols:
+        conn.execute("ALTER TABLE generation_policy ADD COLUMN provider_params TEXT")
+    # Ensure a policy row exists
+    cur = conn.execute("SELECT COUNT(*) AS c FROM generation_policy")
+    if cur.fetchone()[0] == 0:
+        from .config import POLICY_DEFAULTS, DEFAULT_PROVIDER
+        conn.execute(
+            """
+            INSERT INTO generation_policy (
+                min_days_between_similar_prompt,
+                min_novelty_score,
+                max_similarity_pct,
+                image_dupe_threshold,
+                prompt_dupe_threshold,
+                cooldown_multiplier,
+                topic_drift_rate,
+                provider,
+                provider_params
+            ) VALUES (?,?,?,?,?,?,?,?,?)
+            """,
+            (
+                POLICY_DEFAULTS["min_days_between_similar_prompt"],
+                POLICY_DEFAULTS["min_novelty_score"],
+                POLICY_DEFAULTS["max_similarity_pct"],
+                POLICY_DEFAULTS["image_dupe_threshold"],
+                POLICY_DEFAULTS["prompt_dupe_threshold"],
+                POLICY_DEFAULTS["cooldown_multiplier"],
+                POLICY_DEFAULTS["topic_drift_rate"],
+                DEFAULT_PROVIDER,
+                None,
+            ),
+        )
+
+
+def _m002_asset_content_hash(conn: sqlite3.Connection) -> None:
+    if "content_hash" not in _columns(conn, "asset_record"):
+        conn.execute("ALTER TABLE asset_record ADD COLUMN content_hash TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_asset_content_hash ON asset_record(content_hash)")
+
+
+def _m003_prompt_payload(conn: sqlite3.Connection) -> None:
+    if "payload" not in _columns(conn, "prompt_record"):
+        _migrate_prompt_payloads(conn)
+
+
+def _m004_hot_path_indexes(conn: sqlite3.Connection) -> None:
+    conn.executescript(
+        """
+        CREATE INDEX IF NOT EXISTS idx_cooldown_item_used ON cooldown_log(variable_item_id, used_at);
+        CREATE INDEX IF NOT EXISTS idx_prompt_record_run ON prompt_record(design_run_id);
+        CREATE INDEX IF NOT EXISTS idx_asset_record_run ON asset_record(design_run_id);
+        CREATE INDEX IF NOT EXISTS idx_variable_item_list_value ON variable_item(variable_list_id, value);
+        CREATE INDEX IF NOT EXISTS idx_variable_item_list_enabled ON variable_item(variable_list_id, enabled);
+        DROP INDEX IF EXISTS idx_variable_item_list;
+        """
+    )
+
+
+def _m005_run_history_indexes(conn: sqlite3.Connection) -> None:
+    conn.executescript(
+        """
+        CREATE INDEX IF NOT EXISTS idx_design_run_created ON design_run(created_at);
+        CREATE INDEX IF NOT EXISTS idx_asset_record_provider_run ON asset_record(provider, design_run_id);
+        """
+    )
+
+
+def _m006_backup_log(conn: sqlite3.Connection) -> None:
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS backup_log (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          created_at TEXT NOT NULL,
+          path TEXT NOT NULL,
+          compressed INTEGER NOT NULL DEFAULT 0,
+          db_bytes INTEGER NOT NULL,
+          backup_bytes INTEGER NOT NULL,
+          duration_ms INTEGER NOT NULL
+        );
+        """
+    )
+
+
+def _m007_prompt_search(conn: sqlite3.Connection) -> None:
+    """prompt_fts: FTS5 index over the creative subset of every prompt.
+
+    Skipped on SQLite builds without FTS5; /api/search then reports search as
+    unavailable. Rows are written by insert/update_prompt_record; only the
+    delete is a trigger, as it needs nothing but SQL.
+    """
+    from .prompt.search import FTS_COLUMNS, FTS_WEIGHTS, index_prompts
+    try:
+        conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS prompt_fts USING fts5({', '.join(FTS_COLUMNS)}, tokenize='porter unicode61')"
+        )
+    except sqlite3.OperationalError:
+        return
+    conn.execute(
+        "INSERT INTO prompt_fts(prompt_fts, rank) VALUES('rank', ?)",
+        (f"bm25({', '.join(str(w) for w in FTS_WEIGHTS)})",),
+    )
+    conn.executescript(
+        """
+        CREATE TRIGGER IF NOT EXISTS prompt_fts_ad AFTER DELETE ON prompt_record BEGIN
+          DELETE FROM prompt_fts WHERE rowid = old.id;
+        END;
+        """
+    )
+    index_prompts(conn)
+
+
+def _m008_variable_item_paging(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_variable_item_list_id ON variable_item(variable_list_id, id)")
+
+
+# Writes to these bump config_generation, which keys the read-through config
+# cache in repositories and the ETags of the config endpoints.
+CONFIG_TABLES = ("variable_defaults", "variable_list", "variable_item", "generation_policy")
+
+
+def _m009_config_generation(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS config_generation (id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL)"
+    )
+    conn.execute("INSERT OR IGNORE INTO config_generation(id, generation) VALUES(1, 1)")
+    for table in CONFIG_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
             conn.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_cfg_{event.lower()} AFTER {event} ON {table} BEGIN
+                  UPDATE config_generation SET generation = generation + 1 WHERE id = 1;
+                END
                 """
-                INSERT INTO generation_policy (
-                    min_days_between_similar_prompt,
-                    min_novelty_score,
-                    max_similarity_pct,
-                    image_dupe_threshold,
-                    prompt_dupe_threshold,
-                    cooldown_multiplier,
-                    topic_drift_rate,
-                    provider,
-                    provider_params
-                ) VALUES (?,?,?,?,?,?,?,?,?)
-                """,
-                (
-                    POLICY_DEFAULTS["min_days_between_similar_prompt"],
-                    POLICY_DEFAULTS["min_novelty_score"],
-                    POLICY_DEFAULTS["max_similarity_pct"],
-                    POLICY_DEFAULTS["image_dupe_threshold"],
-                    POLICY_DEFAULTS["prompt_dupe_threshold"],
-                    POLICY_DEFAULTS["cooldown_multiplier"],
-                    POLICY_DEFAULTS["topic_drift_rate"],
-                    DEFAULT_PROVIDER,
-                    None,
-                ),
             )
+
+
+def _m010_llm_reservoir(conn: sqlite3.Connection) -> None:
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS llm_reservoir (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          key_path TEXT NOT NULL,
+          template_hash TEXT NOT NULL,
+          model TEXT NOT NULL,
+          value TEXT NOT NULL,
+          value_hash TEXT NOT NULL,
+          created_at TEXT NOT NULL,
+          UNIQUE(key_path, template_hash, model, value_hash)
+        );
+        CREATE INDEX IF NOT EXISTS idx_llm_reservoir_pop ON llm_reservoir(key_path, template_hash, model, id);
+        """
+    )
+
+
+def _m011_design_run_rng_seed(conn: sqlite3.Connection) -> None:
+    if "rng_seed" not in _columns(conn, "design_run"):
+        conn.execute("ALTER TABLE design_run ADD COLUMN rng_seed INTEGER")
+
+
+def _m012_item_reservation(conn: sqlite3.Connection) -> None:
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS item_reservation (
+          design_run_id INTEGER NOT NULL,
+          variable_item_id INTEGER NOT NULL,
+          expires_at TEXT NOT NULL,
+          PRIMARY KEY(design_run_id, variable_item_id),
+          FOREIGN KEY(variable_item_id) REFERENCES variable_item(id) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS idx_item_reservation_expires ON item_reservation(expires_at);
+        """
+    )
+
+
+def _m013_prompt_fts_app_sync(conn: sqlite3.Connection) -> None:
+    """Drop the insert/update prompt_fts triggers from the first migration 7.
+
+    They called a Python SQL function, so writes to prompt_record from any
+    connection that had not registered it failed. The repository now writes
+    the rows itself.
+    """
+    conn.execute("DROP TRIGGER IF EXISTS prompt_fts_ai")
+    conn.execute("DROP TRIGGER IF EXISTS prompt_fts_au")
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'prompt_fts'").fetchone():
+        from .prompt.search import index_prompts
+        index_prompts(conn)
+
+
+# Ordered, append-only. Each step must be idempotent: fresh databases get the
+# current schema.sql in step 1 and then replay the rest.
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Connection], None]]] = [
+    (1, _m001_baseline),
+    (2, _m002_asset_content_hash),
+    (3, _m003_prompt_payload),
+    (4, _m004_hot_path_indexes),
+    (5, _m005_run_history_indexes),
+    (6, _m006_backup_log),
+    (7, _m007_prompt_search),
+    (8, _m008_variable_item_paging),
+    (9, _m009_config_generation),
+    (10, _m010_llm_reservoir),
+    (11, _m011_design_run_rng_seed),
+    (12, _m012_item_reservation),
+    (13, _m013_prompt_fts_app_sync),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_migrated = False
+
+
+def init_db():
+    """Bring the database up to SCHEMA_VERSION; a no-op once it is current."""
+    global _migrated
+    if _migrated:
+        return
+    with get_conn() as conn:
+        version = _schema_version(conn)
+        if version < SCHEMA_VERSION:
+            conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
             conn.commit()
+            for target, step in MIGRATIONS:
+                if target <= version:
+                    continue
+                step(conn)
+                conn.execute("DELETE FROM schema_version")
+                conn.execute("INSERT INTO schema_version(version) VALUES(?)", (target,))
+                conn.commit()
+    _migrated = True
+
+
+def query_plan(conn: sqlite3.Connection, sql: str, params: Sequence[Any] = ()) -> List[str]:
+    """EXPLAIN QUERY PLAN detail lines for one statement."""
+    return [r[3] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}", tuple(params)).fetchall()]
+
+
+def full_scans(plan: Sequence[str]) -> List[str]:
+    """Plan lines that read a whole table rather than seeking an index.
+
+    AUTOMATIC indexes count too: SQLite builds them by scanning the table on
+    every execution.
+    """
+    out = []
+    for line in plan:
+        if (line.startswith("SCAN ") and " USING " not in line) or " AUTOMATIC " in line:
+            out.append(line)
+    return out
+
+
+def _migrate_prompt_payloads(conn: sqlite3.Connection) -> None:
+    """Rebuild prompt_record, folding json_payload/canonical_str into payload."""
+    from .prompt.codec import encode_canonical
+    from .prompt.schema import ordered_dump
+    conn.commit()
+    # DROP TABLE would otherwise cascade into asset_record
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        # sqlite3 only opens a transaction before DML on its own; begin
+        # explicitly so the CREATE rolls back with the rows on failure
+        conn.execute("BEGIN")
+        # Left over by a failed rebuild that predates the explicit BEGIN
+        conn.execute("DROP TABLE IF EXISTS prompt_record_new")
+        conn.execute(
+            """
+            CREATE TABLE prompt_record_new (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              design_run_id INTEGER NOT NULL,
+              payload BLOB NOT NULL,
+              payload_codec TEXT NOT NULL,
+              prompt_hash_simhash TEXT,
+              prompt_hash_minhash TEXT,
+              embedding BLOB,
+              novelty_score REAL,
+              staleness_score REAL,
+              FOREIGN KEY(design_run_id) REFERENCES design_run(id) ON DELETE CASCADE
+            )
+            """
+        )
+        cur = conn.execute(
+            "SELECT id, design_run_id, json_payload, canonical_str, prompt_hash_simhash, prompt_hash_minhash, embedding, novelty_score, staleness_score FROM prompt_record"
+        )
+        while True:
+            batch = cur.fetchmany(500)
+            if not batch:
+                break
+            out = []
+            for r in batch:
+                canon = r["canonical_str"] or ordered_dump(json.loads(r["json_payload"]))
+                blob, codec = encode_canonical(conn, canon)
+                out.append((r["id"], r["design_run_id"], blob, codec, r["prompt_hash_simhash"], r["prompt_hash_minhash"], r["embedding"], r["novelty_score"], r["staleness_score"]))
+            conn.executemany(
+                """
+                INSERT INTO prompt_record_new(id, design_run_id, payload, payload_codec, prompt_hash_simhash, prompt_hash_minhash, embedding, novelty_score, staleness_score)
+                VALUES(?,?,?,?,?,?,?,?,?)
+                """,
+                out,
+            )
+        conn.execute("DROP TABLE prompt_record")
+        conn.execute("ALTER TABLE prompt_record_new RENAME TO prompt_record")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
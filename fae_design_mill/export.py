@@ -0,0 +1,114 @@
+from __future__ import annotations
+import csv
+import io
+import json
+from typing import Any, Dict, Iterator, List, Optional
+
+from .db import open_connection
+from .prompt.codec import decode_canonical
+from .repositories import run_id_window
+
+
+# Bulk export of run history (runs + prompt_record + asset_record). Rows are
+# pulled from a cursor on a dedicated read-only connection in fetchmany()
+# batches and written out as they arrive, so memory does not grow with the
+# size of the export.
+
+EXPORT_FIELDS: List[str] = [
+    "run_id", "status", "reason", "job_key", "run_created_at",
+    "prompt_id", "prompt_hash_simhash", "prompt_hash_minhash", "novelty_score", "staleness_score",
+    "asset_id", "provider", "file_path", "file_url", "content_hash",
+    "image_hash_phash", "image_hash_dhash", "width", "height", "dpi", "asset_created_at",
+    "prompt",
+]
+
+_SQL_EXPORT = """
+    SELECT dr.id AS run_id, dr.status, dr.reason, dr.job_key, dr.created_at AS run_created_at,
+           pr.id AS prompt_id, pr.prompt_hash_simhash, pr.prompt_hash_minhash, pr.novelty_score, pr.staleness_score,
+           pr.payload, pr.payload_codec,
+           ar.id AS asset_id, ar.provider, ar.file_path, ar.file_url, ar.content_hash,
+           ar.image_hash_phash, ar.image_hash_dhash, ar.width, ar.height, ar.dpi, ar.created_at AS asset_created_at
+    FROM design_run dr
+    LEFT JOIN prompt_record pr ON pr.design_run_id = dr.id
+    LEFT JOIN asset_record ar ON ar.design_run_id = dr.id
+"""
+
+_BATCH = 500
+
+
+def iter_export_rows(since: Optional[str] = None, until: Optional[str] = None, status: Optional[str] = None,
+                     include_prompt: bool = True) -> Iterator[Dict[str, Any]]:
+    """Yield one dict per run/asset in run id order; prompt is the canonical JSON string."""
+    conn = open_connection(readonly=True)
+    # One sequential pass: mmap would only add the touched file pages to RSS
+    conn.execute("PRAGMA mmap_size = 0")
+    try:
+        window = run_id_window(conn, since, until)
+        if window is None:
+            return
+        where: List[str] = []
+        params: List[Any] = []
+        lo, hi = window
+        if lo is not None:
+            where.append("dr.id >= ?")
+            params.append(lo)
+        if hi is not None:
+            where.append("dr.id <= ?")
+            params.append(hi)
+        if status:
+            where.append("dr.status = ?")
+            params.append(status)
+        sql = _SQL_EXPORT + (f" WHERE {' AND '.join(where)}" if where else "") + " ORDER BY dr.id"
+        cur = conn.execute(sql, params)
+        while True:
+            batch = cur.fetchmany(_BATCH)
+            if not batch:
+                break
+            for r in batch:
+                row = dict(r)
+                payload, codec = row.pop("payload"), row.pop("payload_codec")
+                if include_prompt and payload is not None:
+                    row["prompt"] = decode_canonical(conn, payload, codec)
+                else:
+                    row["prompt"] = None
+                yield row
+    finally:
+        conn.close()
+
+
+def jsonl_chunks(rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    """JSONL with the prompt embedded as an object rather than a string."""
+    buf: List[str] = []
+    for row in rows:
+        # The canonical string is already compact JSON, so it is spliced in
+        # as-is instead of being parsed and re-encoded
+        prompt = row.pop("prompt", None)
+        head = json.dumps(row, separators=(",", ":"), ensure_ascii=False)
+        buf.append(f'{head[:-1]},"prompt":{prompt or "null"}}}\n')
+        if len(buf) >= _BATCH:
+            yield "".join(buf)
+            buf = []
+    if buf:
+        yield "".join(buf)
+
+
+def csv_chunks(rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    n = 0
+    for row in rows:
+        writer.writerow(row)
+        n += 1
+        if n % _BATCH == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+
+
+def export_chunks(fmt: str, **filters: Any) -> Iterator[str]:
+    if fmt not in ("jsonl", "csv"):
+        raise ValueError(f"Unsupported export format {fmt!r}; expected jsonl or csv")
+    rows = iter_export_rows(**filters)
+    return csv_chunks(rows) if fmt == "csv" else jsonl_chunks(rows)
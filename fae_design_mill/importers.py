@@ -0,0 +1,119 @@
+from __future__ import annotations
+import csv
+import io
+import json
+from typing import IO, Any, Dict, Iterator, List, Optional, Union
+
+
+# Parsers for bulk variable item imports. Each yields plain values or dicts
+# shaped for repositories.bulk_add_variable_items(); CSV and JSONL are read a
+# line at a time so large uploads are never held in memory as text.
+
+FORMATS = ("json", "csv", "jsonl")
+
+_CONTENT_TYPES = {
+    "application/json": "json",
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/x-ndjson": "jsonl",
+    "application/jsonl": "jsonl",
+    "application/x-jsonlines": "jsonl",
+}
+
+_COLUMNS = ("value", "weight", "enabled", "cooldown_days", "tags")
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def detect_format(name: Optional[str] = None, content_type: Optional[str] = None) -> Optional[str]:
+    """Guess the format from a file name or a request Content-Type."""
+    if content_type:
+        fmt = _CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+        if fmt:
+            return fmt
+    if name:
+        lower = name.lower()
+        for ext, fmt in ((".jsonl", "jsonl"), (".ndjson", "jsonl"), (".json", "json"), (".csv", "csv"), (".txt", "csv")):
+            if lower.endswith(ext):
+                return fmt
+    return None
+
+
+def iter_rows(stream: IO[Any], fmt: str) -> Iterator[Union[str, Dict[str, Any]]]:
+    """Yield import rows from a text or binary stream."""
+    if fmt not in FORMATS:
+        raise ImportFormatError(f"Unsupported format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "json":
+        return _iter_json(stream)
+    if fmt == "jsonl":
+        return _iter_jsonl(stream)
+    return _iter_csv(stream)
+
+
+def _iter_json(stream: IO[str]) -> Iterator[Union[str, Dict[str, Any]]]:
+    try:
+        data = json.load(stream)
+    except json.JSONDecodeError as e:
+        raise ImportFormatError(f"Invalid JSON: {e}") from e
+    if isinstance(data, dict):
+        data = data.get("values")
+    if not isinstance(data, list):
+        raise ImportFormatError("JSON import must be an array of values or objects")
+    for entry in data:
+        yield _normalize(entry)
+
+
+def _iter_jsonl(stream: IO[str]) -> Iterator[Union[str, Dict[str, Any]]]:
+    for lineno, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ImportFormatError(f"Invalid JSON on line {lineno}: {e}") from e
+        yield _normalize(entry)
+
+
+def _iter_csv(stream: IO[str]) -> Iterator[Union[str, Dict[str, Any]]]:
+    # A header row naming a "value" column enables per-row fields; otherwise
+    # every non-empty cell is a value, matching the Quick Add textarea.
+    reader = csv.reader(stream)
+    header: Optional[List[str]] = None
+    for cells in reader:
+        if header is None and any(c.strip().lower() == "value" for c in cells):
+            header = [c.strip().lower() for c in cells]
+            continue
+        if header is None:
+            for c in cells:
+                if c.strip():
+                    yield c.strip()
+            continue
+        entry = {k: v for k, v in zip(header, cells) if k in _COLUMNS and v.strip() != ""}
+        if "tags" in entry:
+            entry["tags"] = _parse_tags(entry["tags"])
+        if "enabled" in entry:
+            entry["enabled"] = entry["enabled"].strip().lower() in ("1", "true", "yes", "y", "on")
+        yield entry
+
+
+def _parse_tags(raw: str) -> List[str]:
+    raw = raw.strip()
+    if raw.startswith("["):
+        try:
+            return [str(t) for t in json.loads(raw)]
+        except json.JSONDecodeError:
+            pass
+    return [t.strip() for t in raw.split(";") if t.strip()]
+
+
+def _normalize(entry: Any) -> Union[str, Dict[str, Any]]:
+    if isinstance(entry, dict):
+        return {k: v for k, v in entry.items() if k in _COLUMNS}
+    if entry is None:
+        return ""
+    return str(entry)
@@ -0,0 +1,27 @@
+from __future__ import annotations
+import importlib
+from typing import Any, Dict, Optional
+
+
+# Deferred imports for optional dependencies that are slow to load (the
+# openai SDK alone costs over a second). Modules call optional_import() at
+# the point of use instead of importing at top level, so CLI commands that
+# never reach that code never pay for it. `manage.py check-startup` keeps
+# the eager import path within budget.
+
+_MISSING = object()
+_cache: Dict[str, Any] = {}
+
+
+def optional_import(module: str, attr: Optional[str] = None) -> Any:
+    """Import `module` (and return its `attr`) on first call; None if unavailable."""
+    key = f"{module}:{attr or ''}"
+    hit = _cache.get(key, _MISSING)
+    if hit is _MISSING:
+        try:
+            obj = importlib.import_module(module)
+            hit = getattr(obj, attr) if attr else obj
+        except Exception:
+            hit = None
+        _cache[key] = hit
+    return hit
@@ -1,67 +1,194 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
 import os
+import random
+import threading
 
-try:
-    from openai import OpenAI
-except Exception:  # optional
-    OpenAI = None  # type: ignore
+from .config import LLM_BASE_URL, LLM_MODEL, LLM_TEMPERATURE, LLM_TIMEOUT
+from .lazy import optional_import
+from .llm_cache import cached_completion
+
+
+# Default templates by key shape
+DEFAULT_TEMPLATES = {
+    "subject": (
+        "Return a JSON array of 3 concise subject phrases for a merch design. "
+        "Style: concise, evocative, no periods."
+    ),
+    "icons_symbols": (
+        "Return a JSON array of 2-3 succinct icon/symbol keywords coherent with the design."
+    ),
+    "text.secondary": (
+        "Return a single short brand tagline string (no quotes) coherent with FULLY AUTOMATED ENTERPRISES aesthetics."
+    ),
+}
+
+SYSTEM_PROMPT = (
+    "You generate structured JSON snippets that fit a merch design JSON spec. "
+    "Only output the requested JSON value and nothing else."
+)
+
+BATCH_SYSTEM_PROMPT = (
+    "You generate structured JSON snippets that fit a merch design JSON spec. "
+    "Reply with a single JSON object whose keys are exactly the requested key "
+    "paths, each holding the value described for it, and nothing else."
+)
+
+_client_lock = threading.Lock()
+_client: Optional[Tuple[Tuple[str, str], Any]] = None
 
 
 def _client_or_none():
-    if OpenAI is None:
-        return None
+    """Shared OpenAI client (thread-safe, keeps its connection pool), or None."""
+    global _client
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         return None
-    return OpenAI(api_key=api_key)
+    key = (api_key, LLM_BASE_URL)
+    cached = _client
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    # Imported on first use: the SDK is slow to load and optional
+    OpenAI = optional_import("openai", "OpenAI")
+    if OpenAI is None:
+        return None
+    with _client_lock:
+        if _client is None or _client[0] != key:
+            _client = (key, OpenAI(api_key=api_key, base_url=LLM_BASE_URL or None, timeout=LLM_TIMEOUT))
+        return _client[1]
+
 
+def template_for(key_path: str, template: Optional[str] = None) -> str:
+    return template or DEFAULT_TEMPLATES.get(key_path, f"Return a concise JSON string value for {key_path}.")
 
-def generate_value_for_key(key_path: str, context: Dict[str, Any], template: Optional[str] = None) -> Any:
+
+def template_hash(key_path: str, template: Optional[str] = None) -> str:
+    """Identifies the instruction a value was generated from (default templates included)."""
+    return hashlib.sha1(template_for(key_path, template).encode("utf-8")).hexdigest()[:16]
+
+
+def _chat(system: str, user: str, temperature: float = LLM_TEMPERATURE, cache: bool = True,
+          rng: Optional[random.Random] = None) -> Optional[str]:
+    """One chat completion; the reply text, or None when unavailable or failed.
+
+    Replies go through the on-disk cache (llm_cache) unless cache=False; rng
+    picks among its stored replies.
+    """
     client = _client_or_none()
     if client is None:
-        # Fallback: return None to signal caller to use defaults
         return None
-
-    # Default templates by key shape
-    default_templates = {
-        "subject": (
-            "Return a JSON array of 3 concise subject phrases for a merch design. "
-            "Style: concise, evocative, no periods."
-        ),
-        "icons_symbols": (
-            "Return a JSON array of 2-3 succinct icon/symbol keywords coherent with the design."
-        ),
-        "text.secondary": (
-            "Return a single short brand tagline string (no quotes) coherent with FULLY AUTOMATED ENTERPRISES aesthetics."
-        ),
-    }
-
-    sys_prompt = (
-        "You generate structured JSON snippets that fit a merch design JSON spec. "
-        "Only output the requested JSON value and nothing else."
-    )
-    user_prompt = template or default_templates.get(key_path, f"Return a concise JSON string value for {key_path}.")
-
-    # Use Responses/Chat; prefer Responses if available in SDK
+    if cache:
+        return cached_completion(
+            LLM_MODEL, system, user, temperature, lambda: _chat(system, user, temperature, cache=False), rng
+        )
     try:
         resp = client.chat.completions.create(
-            model=os.getenv("FAE_LLM_MODEL", "gpt-4o-mini"),
+            model=LLM_MODEL,
             messages=[
-                {"role": "system", "content": sys_prompt},
-                {"role": "user", "content": user_prompt},
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
             ],
-            temperature=0.7,
+            temperature=temperature,
         )
-        text = resp.choices[0].message.content.strip()
+        return (resp.choices[0].message.content or "").strip()
     except Exception:
         return None
 
-    # Try to parse JSON arrays; else treat as raw string
-    import json
+
+def _parse_value(text: str) -> Any:
+    # JSON arrays/objects/strings as asked; else treat as raw string
     try:
-        val = json.loads(text)
-        return val
+        return json.loads(text)
     except Exception:
         return text.strip('"')
 
+
+def _parse_object(text: str) -> Optional[Dict[str, Any]]:
+    # Tolerate a fenced ```json block around the object
+    body = text.strip()
+    if body.startswith("```"):
+        body = body.strip("`")
+        body = body[body.find("\n") + 1:] if "\n" in body else body
+    start, end = body.find("{"), body.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    try:
+        obj = json.loads(body[start:end + 1])
+    except Exception:
+        return None
+    return obj if isinstance(obj, dict) else None
+
+
+def generate_value_for_key(key_path: str, context: Dict[str, Any], template: Optional[str] = None,
+                           rng: Optional[random.Random] = None) -> Any:
+    text = _chat(SYSTEM_PROMPT, template_for(key_path, template), rng=rng)
+    if text is None:
+        # Fallback: return None to signal caller to use defaults
+        return None
+    return _parse_value(text)
+
+
+def generate_candidates(key_path: str, template: Optional[str], n: int) -> List[Any]:
+    """Up to n distinct alternative values for one key from one completion."""
+    if n <= 0:
+        return []
+    user = (
+        f"Return a JSON array of {n} distinct alternatives, each one a complete value "
+        f"as described here: {template_for(key_path, template)}"
+    )
+    # Uncached: the reservoir wants new candidates, not the last reply again
+    text = _chat(SYSTEM_PROMPT, user, temperature=max(LLM_TEMPERATURE, 0.9), cache=False)
+    if text is None:
+        return []
+    start, end = text.find("["), text.rfind("]")
+    try:
+        values = json.loads(text[start:end + 1]) if 0 <= start < end else None
+    except Exception:
+        values = None
+    if not isinstance(values, list):
+        return []
+    return [v for v in values if v not in (None, "", [])][:n]
+
+
+def batch_prompt(templates: Dict[str, Optional[str]]) -> str:
+    lines = ["Return a JSON object with exactly these keys:"]
+    for key_path, template in templates.items():
+        lines.append(f"- {json.dumps(key_path)}: {template_for(key_path, template)}")
+    return "\n".join(lines)
+
+
+def generate_values(templates: Dict[str, Optional[str]], rng: Optional[random.Random] = None) -> Dict[str, Any]:
+    """Values for several LLM-mode keys from one completion.
+
+    templates maps key path -> llm_template (None for the default). Keys the
+    reply leaves out, or the whole set when the reply is not a JSON object,
+    are asked for one at a time. Keys with no value at all are omitted, so
+    callers fall back as they do for generate_value_for_key() returning None.
+    rng picks among cached replies (see llm_cache.cached_completion).
+    """
+    if not templates:
+        return {}
+    if len(templates) == 1:
+        (key_path, template), = templates.items()
+        value = generate_value_for_key(key_path, {}, template, rng)
+        return {} if value is None else {key_path: value}
+    text = _chat(BATCH_SYSTEM_PROMPT, batch_prompt(templates), rng=rng)
+    if text is None:
+        # Unavailable or failed outright: per-key calls would fail the same way
+        return {}
+    obj = _parse_object(text) or {}
+    out: Dict[str, Any] = {}
+    missing: List[str] = []
+    for key_path in templates:
+        value = obj.get(key_path)
+        if value is None or value == "":
+            missing.append(key_path)
+        else:
+            out[key_path] = value
+    for key_path in missing:
+        value = generate_value_for_key(key_path, {}, templates[key_path], rng)
+        if value is not None:
+            out[key_path] = value
+    return out
@@ -0,0 +1,163 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from .config import (
+    DB_BUSY_TIMEOUT_MS,
+    LLM_CACHE,
+    LLM_CACHE_PATH,
+    LLM_CACHE_TTL,
+    LLM_CACHE_VARIANTS,
+)
+
+
+# Persistent cache of LLM replies in its own SQLite file (data/llm_cache.db),
+# so it can be deleted at any time and never contends with the main DB.
+# Entries are keyed by a hash of (model, system prompt, user prompt,
+# temperature). Up to LLM_CACHE_VARIANTS replies accumulate per key: until
+# then a lookup still calls the LLM (and stores the reply), after that it
+# returns one of the stored replies at random. Replies older than
+# LLM_CACHE_TTL seconds are ignored and purged.
+#
+# Concurrent callers in one process asking for the same key share a single
+# outstanding request (single-flight). Counters live in the cache file so
+# every worker process and the CLI see the same totals.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_response (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  cache_key TEXT NOT NULL,
+  response TEXT NOT NULL,
+  created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_response_key ON llm_response(cache_key, created_at);
+CREATE INDEX IF NOT EXISTS idx_llm_response_created ON llm_response(created_at);
+CREATE TABLE IF NOT EXISTS llm_cache_stat (
+  name TEXT PRIMARY KEY,
+  value INTEGER NOT NULL
+);
+"""
+
+COUNTERS = ("hits", "misses", "shared", "stored", "failed")
+
+_local = threading.local()
+_inflight_lock = threading.Lock()
+_inflight: Dict[str, "_Flight"] = {}
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Optional[str] = None
+
+
+def _conn() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    # Never reuse a connection inherited across fork()
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        LLM_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(LLM_CACHE_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def cache_key(model: str, system: str, user: str, temperature: float) -> str:
+    data = json.dumps([model, system, user, round(float(temperature), 4)], ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _bump(conn: sqlite3.Connection, name: str) -> None:
+    conn.execute(
+        "INSERT INTO llm_cache_stat(name, value) VALUES(?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1",
+        (name,),
+    )
+
+
+def cached_completion(model: str, system: str, user: str, temperature: float,
+                      call: Callable[[], Optional[str]],
+                      rng: Optional[random.Random] = None) -> Optional[str]:
+    """A stored reply for this request, or call() once and store its reply.
+
+    call() returns the reply text or None on failure; failures are not cached.
+    Which stored reply a hit returns is drawn from rng (the module's random
+    when omitted), so a seeded run replays the same pick.
+    """
+    if not LLM_CACHE:
+        return call()
+    key = cache_key(model, system, user, temperature)
+    conn = _conn()
+    rows = conn.execute(
+        "SELECT response FROM llm_response WHERE cache_key = ? AND created_at >= ? ORDER BY id DESC LIMIT ?",
+        (key, time.time() - LLM_CACHE_TTL, LLM_CACHE_VARIANTS),
+    ).fetchall()
+    if len(rows) >= LLM_CACHE_VARIANTS:
+        _bump(conn, "hits")
+        return (rng or random).choice(rows)[0]
+
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = _Flight()
+    if not leader:
+        flight.done.wait()
+        _bump(conn, "shared")
+        return flight.result
+
+    try:
+        _bump(conn, "misses")
+        flight.result = call()
+        if flight.result is None:
+            _bump(conn, "failed")
+        else:
+            conn.execute(
+                "INSERT INTO llm_response(cache_key, response, created_at) VALUES(?, ?, ?)",
+                (key, flight.result, time.time()),
+            )
+            _bump(conn, "stored")
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        flight.done.set()
+    return flight.result
+
+
+def purge_expired(ttl: float = LLM_CACHE_TTL) -> int:
+    return _conn().execute("DELETE FROM llm_response WHERE created_at < ?", (time.time() - ttl,)).rowcount
+
+
+def clear() -> int:
+    conn = _conn()
+    removed = conn.execute("DELETE FROM llm_response").rowcount
+    conn.execute("DELETE FROM llm_cache_stat")
+    return removed
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Counters since the last clear(), hit rate and entry counts."""
+    conn = _conn()
+    stats: Dict[str, Any] = {name: 0 for name in COUNTERS}
+    for name, value in conn.execute("SELECT name, value FROM llm_cache_stat"):
+        stats[name] = value
+    lookups = stats["hits"] + stats["misses"] + stats["shared"]
+    # Joining an in-flight request saved a call just like a stored reply
+    stats["hit_rate"] = round((stats["hits"] + stats["shared"]) / lookups, 4) if lookups else None
+    row = conn.execute(
+        "SELECT COUNT(*), COUNT(DISTINCT cache_key) FROM llm_response WHERE created_at >= ?",
+        (time.time() - LLM_CACHE_TTL,),
+    ).fetchone()
+    stats["responses"], stats["keys"] = row
+    stats["enabled"] = LLM_CACHE
+    stats["variants"] = LLM_CACHE_VARIANTS
+    stats["ttl_seconds"] = LLM_CACHE_TTL
+    return stats
@@ -15,6 +15,11 @@ def canonical_similarity_dump(obj: Dict[str, Any]) -> str:
     references, most constraints/background boilerplate so SimHash/MinHash
     are sensitive to creative variation.
     """
+    return ordered_dump(similarity_subset(obj))
+
+
+def similarity_subset(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """The creative fields behind canonical_similarity_dump (also indexed for search)."""
     slim: Dict[str, Any] = {}
     slim["design_title"] = obj.get("design_title")
     t = obj.get("text", {}) or {}
@@ -47,4 +52,4 @@ def canonical_similarity_dump(obj: Dict[str, Any]) -> str:
     }
     slim["icons_symbols"] = obj.get("icons_symbols")
     slim["negative_prompt"] = obj.get("negative_prompt")
-    return ordered_dump(slim)
+    return slim
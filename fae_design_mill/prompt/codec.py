@@ -0,0 +1,81 @@
+from __future__ import annotations
+import hashlib
+import json
+import sqlite3
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .schema import default_frame, ordered_dump
+
+
+# prompt_record keeps a single canonical form (sorted-key compact JSON),
+# zlib-compressed against a preset dictionary built from default_frame(). The
+# dictionary is stored in prompt_dict under its hash so rows stay decodable
+# after the frame changes; payload_codec is "zd:<dict id>".
+
+_dicts: Dict[str, bytes] = {}
+_current: Optional[Tuple[str, bytes]] = None
+
+
+def _frame_dictionary() -> Tuple[str, bytes]:
+    global _current
+    if _current is None:
+        data = ordered_dump(default_frame()).encode("utf-8")
+        _current = (hashlib.sha1(data).hexdigest()[:12], data)
+        _dicts[_current[0]] = data
+    return _current
+
+
+def _dictionary(conn: sqlite3.Connection, dict_id: str) -> bytes:
+    data = _dicts.get(dict_id)
+    if data is None:
+        row = conn.execute("SELECT data FROM prompt_dict WHERE id = ?", (dict_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown prompt dictionary {dict_id}")
+        data = bytes(row[0])
+        _dicts[dict_id] = data
+    return data
+
+
+def encode_canonical(conn: sqlite3.Connection, canonical_str: str) -> Tuple[bytes, str]:
+    dict_id, data = _frame_dictionary()
+    # Same transaction as the row, so a rollback never orphans a payload
+    conn.execute("INSERT OR IGNORE INTO prompt_dict(id, data) VALUES(?, ?)", (dict_id, data))
+    comp = zlib.compressobj(level=9, zdict=data)
+    blob = comp.compress(canonical_str.encode("utf-8")) + comp.flush()
+    return blob, f"zd:{dict_id}"
+
+
+def decode_canonical(conn: sqlite3.Connection, blob: bytes, codec: str) -> str:
+    if not codec.startswith("zd:"):
+        raise ValueError(f"Unsupported prompt codec {codec!r}")
+    dec = zlib.decompressobj(zdict=_dictionary(conn, codec[3:]))
+    return (dec.decompress(bytes(blob)) + dec.flush()).decode("utf-8")
+
+
+def frame_ordered(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """Re-key a canonical (sorted) prompt in default_frame() order.
+
+    Keys unknown to the frame follow in sorted order, which reproduces the
+    json_payload view that build_prompt() emits.
+    """
+    return _reorder(obj, default_frame())
+
+
+def _reorder(obj: Any, frame: Any) -> Any:
+    if not isinstance(obj, dict):
+        return obj
+    frame = frame if isinstance(frame, dict) else {}
+    out: Dict[str, Any] = OrderedDict()
+    for k in frame:
+        if k in obj:
+            out[k] = _reorder(obj[k], frame[k])
+    for k in sorted(obj):
+        if k not in out:
+            out[k] = _reorder(obj[k], None)
+    return out
+
+
+def payload_view(canonical_str: str) -> Dict[str, Any]:
+    return frame_ordered(json.loads(canonical_str))
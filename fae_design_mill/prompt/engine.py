@@ -1,44 +1,67 @@
 from __future__ import annotations
+import copy
 import json
 import random
-from typing import Any, Dict, List, Tuple
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
+from ..db import transaction
 from ..repositories import (
     get_defaults_map,
     eligible_items,
-    log_cooldown,
     get_policy,
-    recent_prompt_hashes,
+    get_prompt_record,
+    recent_prompt_fingerprints,
+    release_item_reservations,
+    reserve_items,
+    run_reservations,
 )
 from .schema import default_frame, validate_prompt
-from .canonical import canonical_dump, canonical_similarity_dump
-from .hashers import simhash64, minhash_hex
+from .canonical import similarity_subset
+from .fingerprint import PromptFingerprint
+from .hashers import hamming_distance_hex, minhash_similarity_hex, tokenize
 from .rules import apply_mutual_exclusions
-from ..llm import generate_value_for_key
+from ..llm import generate_value_for_key, generate_values
+from ..reservoir import llm_templates, take
 
 
-def _resolve_value(mode: str, key_path: str, defaults_map: Dict[str, Dict[str, Any]], policy: Dict[str, Any]) -> Tuple[Any, List[int]]:
+def _eligible(key_path: str, cooldown_multiplier: float) -> List[dict]:
+    # Fallback: ignore cooldown if list exists but all are cooling down, then
+    # share items other runs hold rather than drop to the default value
+    return (
+        eligible_items(key_path, cooldown_multiplier)
+        or eligible_items(key_path, 0.0)
+        or eligible_items(key_path, 0.0, include_reserved=True)
+    )
+
+
+def _resolve_value(mode: str, key_path: str, defaults_map: Dict[str, Dict[str, Any]], policy: Dict[str, Any],
+                   llm_values: Optional[Dict[str, Any]] = None,
+                   rng: Optional[random.Random] = None) -> Tuple[Any, List[int]]:
     # Returns value, used_item_ids
+    rng = rng or random.Random()
     used_ids: List[int] = []
     dm = defaults_map.get(key_path, {})
     cooldown_multiplier = float(policy.get("cooldown_multiplier", 1.0))
     if mode == "LOCKED":
         return dm.get("default_value"), used_ids
     elif mode == "LLM":
-        # Use LLM to synthesize a value; if unavailable, fall back to RANDOM/LOCKED
-        value = generate_value_for_key(key_path, {}, dm.get("llm_template"))
+        # Use LLM to synthesize a value; if unavailable, fall back to RANDOM/LOCKED.
+        # build_prompt() resolves all LLM keys in one request up front.
+        if llm_values is not None:
+            value = llm_values.get(key_path)
+        else:
+            value = generate_value_for_key(key_path, {}, dm.get("llm_template"), rng)
         if value is not None:
             return value, used_ids
         # Fallback path: try RANDOM
         mode = "RANDOM"
     elif mode == "RANDOM":
-        items = eligible_items(key_path, cooldown_multiplier)
-        if not items:
-            # Fallback: ignore cooldown if list exists but all are cooling down
-            items = eligible_items(key_path, 0.0)
+        items = _eligible(key_path, cooldown_multiplier)
         if not items:
             return dm.get("default_value"), used_ids
-        choice = random.choices(items, weights=[max(0.0001, i["weight"]) for i in items], k=1)[0]
+        choice = rng.choices(items, weights=[max(0.0001, i["weight"]) for i in items], k=1)[0]
         used_ids.append(choice["id"])
         # list-valued fields
         if key_path in _list_multi_keys():
@@ -46,18 +69,16 @@ def _resolve_value(mode: str, key_path: str, defaults_map: Dict[str, Dict[str, A
             vals = [_coerce_value(key_path, choice["value"])]
             pool = [i for i in items if i["id"] != choice["id"]]
             if pool and k > 1:
-                extra = random.sample(pool, min(len(pool), k-1))
+                extra = rng.sample(pool, min(len(pool), k-1))
                 vals.extend([_coerce_value(key_path, e["value"]) for e in extra])
                 used_ids.extend([e["id"] for e in extra])
             return vals, used_ids
         return _coerce_value(key_path, choice["value"]), used_ids
     elif mode == "WEIGHTED":
-        items = eligible_items(key_path, cooldown_multiplier)
-        if not items:
-            items = eligible_items(key_path, 0.0)
+        items = _eligible(key_path, cooldown_multiplier)
         if not items:
             return dm.get("default_value"), used_ids
-        choice = random.choices(items, weights=[max(0.0001, i["weight"]) for i in items], k=1)[0]
+        choice = rng.choices(items, weights=[max(0.0001, i["weight"]) for i in items], k=1)[0]
         used_ids.append(choice["id"])
         # Special case: visual_style.genre_tags list is stored as JSON array strings in DB
         if key_path == "visual_style.genre_tags":
@@ -70,15 +91,13 @@ def _resolve_value(mode: str, key_path: str, defaults_map: Dict[str, Dict[str, A
             pool = [i for i in items if i["id"] != choice["id"]]
             vals = [_coerce_value(key_path, choice["value"])]
             if pool:
-                extra = random.sample(pool, min(len(pool), k-1))
+                extra = rng.sample(pool, min(len(pool), k-1))
                 vals.extend([_coerce_value(key_path, e["value"]) for e in extra])
                 used_ids.extend([e["id"] for e in extra])
             return vals, used_ids
         return _coerce_value(key_path, choice["value"]), used_ids
     elif mode == "SEQUENCE":
-        items = eligible_items(key_path, cooldown_multiplier)
-        if not items:
-            items = eligible_items(key_path, 0.0)
+        items = _eligible(key_path, cooldown_multiplier)
         if not items:
             return dm.get("default_value"), used_ids
         items_sorted = sorted(items, key=lambda x: x["id"])  # stable order
@@ -90,7 +109,20 @@ def _resolve_value(mode: str, key_path: str, defaults_map: Dict[str, Dict[str, A
         return dm.get("default_value"), used_ids
 
 
-def build_prompt(design_title: str = "") -> Tuple[Dict[str, Any], Dict[str, str], List[int]]:
+def compose_prompt(design_title: str = "", rng: Optional[random.Random] = None,
+                   run_id: Optional[int] = None) -> Tuple[Dict[str, Any], List[int]]:
+    """Resolve every key into a validated prompt; returns (prompt, used item ids).
+
+    All random draws come from rng (a fresh unseeded Random when omitted), so
+    a run seeded with the same value over the same lists and cooldowns
+    resolves to the same prompt. LLM-mode values are reproducible only when
+    served from the LLM reply cache; reservoir values and fresh replies are not.
+
+    With run_id the used items are reserved for that run in the transaction
+    that read their eligibility (see reserve_items), replacing any earlier
+    reservation of the run; previews reserve nothing.
+    """
+    rng = rng or random.Random()
     defaults_map = get_defaults_map()
     policy = get_policy()
     obj = default_frame()
@@ -101,11 +133,22 @@ def build_prompt(design_title: str = "") -> Tuple[Dict[str, Any], Dict[str, str]
 
     key_paths = list(defaults_map.keys())
     used_items: List[int] = []
-    for kp, conf in defaults_map.items():
-        val, used = _resolve_value(conf["mode"], kp, defaults_map, policy)
-        used_items.extend(used)
-        # Set value into nested obj by kp path
-        _set_by_path(obj, kp, val)
+    # LLM-mode keys: pre-generated values first; only keys whose reservoir is
+    # empty wait on the LLM, all in one request
+    templates = llm_templates(defaults_map)
+    llm_values = take(templates)
+    llm_values.update(generate_values({kp: t for kp, t in templates.items() if kp not in llm_values}, rng))
+    with transaction(immediate=True) if run_id is not None else nullcontext():
+        if run_id is not None:
+            # A rebuild replaces the run's earlier picks
+            release_item_reservations(run_id)
+        for kp, conf in defaults_map.items():
+            val, used = _resolve_value(conf["mode"], kp, defaults_map, policy, llm_values, rng)
+            used_items.extend(used)
+            # Set value into nested obj by kp path
+            _set_by_path(obj, kp, val)
+        if run_id is not None:
+            reserve_items(run_id, used_items)
 
     # Apply mutual exclusions and finish shaping
     apply_mutual_exclusions(obj)
@@ -114,26 +157,33 @@ def build_prompt(design_title: str = "") -> Tuple[Dict[str, Any], Dict[str, str]
     errs = validate_prompt(obj)
     if errs:
         raise ValueError("Prompt validation failed: " + "; ".join(errs))
+    return obj, used_items
 
-    # Canonical + hashes (use slim canonical for similarity)
-    canon_full = canonical_dump(obj)
-    canon_sim = canonical_similarity_dump(obj)
-    hashes = {
-        "simhash": simhash64(canon_sim),
-        "minhash": minhash_hex(canon_sim),
-    }
 
-    return obj, hashes, used_items
+def build_prompt(design_title: str = "", rng: Optional[random.Random] = None,
+                 run_id: Optional[int] = None) -> Tuple[Dict[str, Any], Dict[str, str], List[int]]:
+    """compose_prompt() plus the similarity hashes; returns (prompt, hashes, used item ids).
+
+    Callers that mutate the prompt afterwards keep a PromptFingerprint
+    instead, so the hashes can follow the mutations field by field.
+    """
+    obj, used_items = compose_prompt(design_title, rng, run_id)
+    return obj, PromptFingerprint(obj).hashes(), used_items
 
 
-def novelty_check(hashes: Dict[str, str], policy: Dict[str, Any]) -> Tuple[bool, str]:
+_RECENT_PROMPTS = 200
+
+
+def _collisions(hashes: Dict[str, str], policy: Dict[str, Any], exclude: Optional[int] = None,
+                recent: Optional[List[Tuple[int, str, str]]] = None) -> Iterator[Tuple[int, str]]:
+    # (prompt_record id, reason) for each recent prompt the hashes are too close to
     sim_thresh = int(policy.get("prompt_dupe_threshold", 3))
     max_jaccard = float(policy.get("max_similarity_pct", 0.92))
+    if recent is None:
+        recent = recent_prompt_fingerprints(_RECENT_PROMPTS)
     # Use both SimHash and MinHash (Jaccard) checks
-    recent = recent_prompt_hashes(200)
-    from .hashers import hamming_distance_hex, minhash_similarity_hex
-    for simhash_hex, minhash_prev in recent:
-        if not simhash_hex:
+    for prompt_id, simhash_hex, minhash_prev in recent:
+        if not simhash_hex or prompt_id == exclude:
             continue
         dist = hamming_distance_hex(hashes["simhash"], simhash_hex)
         sim_close = dist <= sim_thresh
@@ -145,18 +195,208 @@ def novelty_check(hashes: Dict[str, str], policy: Dict[str, Any]) -> Tuple[bool,
         # Be lenient: only reject when both metrics deem it too similar.
         if sim_close and (jac_close or jac is None):
             # If we don't have minhash_prev (legacy records), use simhash alone
-            return False, f"SimHash distance {dist} <= {sim_thresh}"
-        if jac_close and sim_close:
-            return False, f"MinHash similarity {jac:.2f} >= {max_jaccard:.2f} and SimHash {dist} <= {sim_thresh}"
+            yield prompt_id, f"SimHash distance {dist} <= {sim_thresh}"
+        elif jac_close and sim_close:
+            yield prompt_id, f"MinHash similarity {jac:.2f} >= {max_jaccard:.2f} and SimHash {dist} <= {sim_thresh}"
+
+
+def novelty_check(hashes: Dict[str, str], policy: Dict[str, Any]) -> Tuple[bool, str]:
+    for _, reason in _collisions(hashes, policy):
+        return False, reason
     return True, "ok"
 
 
-def mutate_prompt(obj: Dict[str, Any]) -> Dict[str, Any]:
-    """Mutate prompt to increase novelty.
+# Neighbours loaded per failed gate; the closest few are enough to steer a redraw
+_MAX_NEIGHBOURS = 5
+
+
+@dataclass
+class NoveltyVerdict:
+    ok: bool
+    reason: str
+    matched: List[int] = field(default_factory=list)  # prompt_record ids, newest first
+    shared_fields: List[str] = field(default_factory=list)  # key paths with values in common
+    neighbours: List[Dict[str, Any]] = field(default_factory=list, repr=False)  # their similarity subsets
+
+
+def _leaf_values(slim: Dict[str, Any], prefix: str = "") -> Dict[str, Set[str]]:
+    # key path -> normalised values (list fields: one per element)
+    out: Dict[str, Set[str]] = {}
+    for k, v in slim.items():
+        path = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(_leaf_values(v, path + "."))
+        elif v is not None:
+            out[path] = {_norm(x) for x in (v if isinstance(v, list) else [v])}
+    return out
+
+
+def _norm(value: Any) -> str:
+    return (value if isinstance(value, str) else json.dumps(value, sort_keys=True)).strip().lower()
+
+
+def _item_values(key_path: str, item: Dict[str, Any]) -> Set[str]:
+    # Normalised values an item contributes (genre_tags items are JSON arrays)
+    if key_path == "visual_style.genre_tags":
+        try:
+            tags = json.loads(item["value"])
+            if isinstance(tags, list):
+                return {_norm(t) for t in tags}
+        except Exception:
+            pass
+    return {_norm(_coerce_value(key_path, item["value"]))}
+
+
+def novelty_gate(obj: Dict[str, Any], hashes: Dict[str, str], policy: Dict[str, Any],
+                 exclude: Optional[int] = None,
+                 recent: Optional[List[Tuple[int, str, str]]] = None) -> NoveltyVerdict:
+    """novelty_check() that also names the prompts it matched and the
+    redrawable fields (non-LOCKED keys) the prompt shares with them.
+
+    exclude skips one prompt_record (the run's own, when re-gating it).
+    """
+    hits = list(_collisions(hashes, policy, exclude, recent))
+    if not hits:
+        return NoveltyVerdict(True, "ok")
+    verdict = NoveltyVerdict(False, hits[0][1], matched=[pid for pid, _ in hits])
+    for pid in verdict.matched[:_MAX_NEIGHBOURS]:
+        rec = get_prompt_record(pid)
+        if rec is not None:
+            verdict.neighbours.append(similarity_subset(json.loads(rec["canonical_str"])))
+    defaults_map = get_defaults_map()
+    mine = _leaf_values(similarity_subset(obj))
+    theirs = [_leaf_values(n) for n in verdict.neighbours]
+    verdict.shared_fields = [
+        kp for kp, values in mine.items()
+        if kp in defaults_map and defaults_map[kp]["mode"] != "LOCKED"
+        and any(values & t.get(kp, set()) for t in theirs)
+    ]
+    return verdict
+
+
+def redraw_shared_fields(obj: Dict[str, Any], verdict: NoveltyVerdict,
+                         rng: Optional[random.Random] = None) -> List[int]:
+    """Redraw only the fields the prompt shares with its matched neighbours.
+
+    Candidates are the key's items (cooldowns ignored, reserved items left
+    out) whose values none of the neighbours use; among them the ones whose
+    words overlap the neighbours' least win, ties broken by rng. Returns the
+    ids of the items drawn (empty when no field could change).
+    """
+    rng = rng or random.Random()
+    theirs = [_leaf_values(n) for n in verdict.neighbours]
+    neighbour_tokens: Set[str] = set()
+    for n in verdict.neighbours:
+        neighbour_tokens.update(t for t in tokenize(json.dumps(n)) if t.isalnum())
+    drawn: List[int] = []
+    for key_path in verdict.shared_fields:
+        taken = set().union(*(t.get(key_path, set()) for t in theirs))
+        current = _get_by_path(obj, key_path)
+        items = [it for it in eligible_items(key_path, cooldown_multiplier=0.0) if not _item_values(key_path, it) & taken]
+        if not items:
+            continue
+        ranked = sorted(
+            items,
+            key=lambda it: (len(neighbour_tokens.intersection(tokenize(str(it["value"])))), rng.random()),
+        )
+        if key_path == "visual_style.genre_tags":
+            # Stored as JSON arrays; one item is the whole cluster
+            pick = ranked[:1]
+            try:
+                value: Any = json.loads(pick[0]["value"])
+            except Exception:
+                value = [pick[0]["value"]]
+        elif isinstance(current, list) or key_path in _list_multi_keys():
+            k = len(current) if isinstance(current, list) and current else _list_multi_keys().get(key_path, 1)
+            pick = ranked[:k]
+            value = [_coerce_value(key_path, it["value"]) for it in pick]
+        else:
+            pick = ranked[:1]
+            value = _coerce_value(key_path, pick[0]["value"])
+        _set_by_path(obj, key_path, value)
+        drawn.extend(it["id"] for it in pick)
+    return drawn
+
+
+# Redraws tried per failed gate; the one colliding with the fewest recent
+# prompts is kept (each costs an incremental re-hash and a hash-index scan)
+_REDRAW_CANDIDATES = 8
+
+
+def make_novel(obj: Dict[str, Any], fingerprint: PromptFingerprint, policy: Dict[str, Any],
+               rng: Optional[random.Random] = None, max_mutations: int = 4,
+               exclude: Optional[int] = None,
+               run_id: Optional[int] = None) -> Tuple[NoveltyVerdict, List[int]]:
+    """Gate the prompt; on a collision redraw the shared fields and gate again.
+
+    Each round tries a few redraws of the shared fields (mutate_prompt() when
+    none can be redrawn) and keeps the one the recent prompts' hashes collide
+    with least. obj and fingerprint are updated in place. Returns the last
+    verdict and the ids of the items the kept redraws used.
+
+    With run_id each round's draws are reserved for the run in the transaction
+    that read their eligibility, as in compose_prompt(), and the run's
+    reservations of items the redraw replaced are released.
+    """
+    rng = rng or random.Random()
+    recent = recent_prompt_fingerprints(_RECENT_PROMPTS)
+    drawn: List[int] = []
+    verdict = novelty_gate(obj, fingerprint.hashes(), policy, exclude, recent)
+    for _ in range(max_mutations):
+        if verdict.ok:
+            break
+        with transaction(immediate=True) if run_id is not None else nullcontext():
+            best = None
+            for _ in range(_REDRAW_CANDIDATES):
+                trial = copy.deepcopy(obj)
+                ids = redraw_shared_fields(trial, verdict, rng)
+                if not ids:
+                    _, ids = mutate_prompt(trial, rng)
+                trial_fp = fingerprint.copy()
+                trial_fp.update(trial)
+                hits = sum(1 for _ in _collisions(trial_fp.hashes(), policy, exclude, recent))
+                if best is None or hits < best[0]:
+                    best = (hits, trial, trial_fp, ids)
+                if not hits:
+                    break
+            _, trial, trial_fp, ids = best
+            obj.clear()
+            obj.update(trial)
+            fingerprint.assign(trial_fp)
+            drawn.extend(ids)
+            if run_id is not None:
+                _hold_items(run_id, obj, ids)
+        verdict = novelty_gate(obj, fingerprint.hashes(), policy, exclude, recent)
+    return verdict, drawn
+
+
+def _hold_items(run_id: int, obj: Dict[str, Any], drawn: List[int]) -> None:
+    # Reserve the new draws and free the run's items whose values the prompt
+    # no longer uses (a list's name is the key path it fills)
+    reserve_items(run_id, drawn)
+    stale: List[int] = []
+    for it in run_reservations(run_id):
+        if it["id"] in drawn:
+            continue
+        current = _get_by_path(obj, it["list_name"])
+        values = {_norm(x) for x in (current if isinstance(current, list) else [current]) if x is not None}
+        if not _item_values(it["list_name"], it) & values:
+            stale.append(it["id"])
+    if stale:
+        release_item_reservations(run_id, stale)
+
+
+def mutate_prompt(obj: Dict[str, Any], rng: Optional[random.Random] = None,
+                  run_id: Optional[int] = None) -> Tuple[Dict[str, Any], List[int]]:
+    """Mutate prompt to increase novelty; returns (prompt, drawn item ids).
 
     Strategy: rotate existing lists if present; otherwise redraw from DB
-    ignoring cooldowns for high-impact fields.
+    ignoring cooldowns for high-impact fields. Draws come from rng. With
+    run_id the draws are reserved like compose_prompt()'s and the items they
+    replaced released.
     """
+    rng = rng or random.Random()
+    drawn: List[int] = []
     # Rotate existing values
     for key in ("subject", "icons_symbols"):
         vals = obj.get(key, [])
@@ -167,36 +407,50 @@ def mutate_prompt(obj: Dict[str, Any]) -> Dict[str, Any]:
         items = eligible_items(key_path, cooldown_multiplier=0.0)
         if not items:
             return None
-        pick = random.sample(items, min(len(items), k))
+        pick = rng.sample(items, min(len(items), k))
+        drawn.extend(p["id"] for p in pick)
         vals = [ _coerce_value(key_path, p["value"]) for p in pick ]
         return vals if k > 1 else vals[0]
 
-    # Try redraws
-    new_subj = redraw_list("subject", 3)
-    if new_subj:
-        obj["subject"] = new_subj
-    new_icons = redraw_list("icons_symbols", 2)
-    if new_icons:
-        obj["icons_symbols"] = new_icons
-    new_style = redraw_list("composition.style", 2)
-    if new_style:
-        obj.setdefault("composition", {})["style"] = new_style
-    # genre_tags stored as JSON arrays in DB; redraw one cluster
-    items = eligible_items("visual_style.genre_tags", cooldown_multiplier=0.0)
-    if items:
-        import json as _json
-        choice = random.choice(items)
-        try:
-            obj.setdefault("visual_style", {})["genre_tags"] = _json.loads(choice["value"])  # type: ignore
-        except Exception:
-            obj.setdefault("visual_style", {})["genre_tags"] = [choice["value"]]
-    scheme = redraw_list("color.gradient_map.scheme", 1)
-    if scheme:
-        obj.setdefault("color", {}).setdefault("gradient_map", {})["scheme"] = scheme
-    sec = redraw_list("text.secondary", 1)
-    if sec:
-        obj.setdefault("text", {})["secondary"] = sec
-    return obj
+    with transaction(immediate=True) if run_id is not None else nullcontext():
+        # Try redraws
+        new_subj = redraw_list("subject", 3)
+        if new_subj:
+            obj["subject"] = new_subj
+        new_icons = redraw_list("icons_symbols", 2)
+        if new_icons:
+            obj["icons_symbols"] = new_icons
+        new_style = redraw_list("composition.style", 2)
+        if new_style:
+            obj.setdefault("composition", {})["style"] = new_style
+        # genre_tags stored as JSON arrays in DB; redraw one cluster
+        items = eligible_items("visual_style.genre_tags", cooldown_multiplier=0.0)
+        if items:
+            import json as _json
+            choice = rng.choice(items)
+            drawn.append(choice["id"])
+            try:
+                obj.setdefault("visual_style", {})["genre_tags"] = _json.loads(choice["value"])  # type: ignore
+            except Exception:
+                obj.setdefault("visual_style", {})["genre_tags"] = [choice["value"]]
+        scheme = redraw_list("color.gradient_map.scheme", 1)
+        if scheme:
+            obj.setdefault("color", {}).setdefault("gradient_map", {})["scheme"] = scheme
+        sec = redraw_list("text.secondary", 1)
+        if sec:
+            obj.setdefault("text", {})["secondary"] = sec
+        if run_id is not None:
+            _hold_items(run_id, obj, drawn)
+    return obj, drawn
+
+
+def _get_by_path(obj: Dict[str, Any], key_path: str) -> Any:
+    cur: Any = obj
+    for p in key_path.split('.'):
+        if not isinstance(cur, dict):
+            return None
+        cur = cur.get(p)
+    return cur
 
 
 def _set_by_path(obj: Dict[str, Any], key_path: str, value: Any) -> None:
@@ -0,0 +1,100 @@
+from __future__ import annotations
+import json
+from typing import Any, Dict, List
+
+from .canonical import similarity_subset
+from .hashers import (
+    minhash_partial,
+    minhash_to_hex,
+    shingles_bytes,
+    simhash_from_votes,
+    simhash_votes,
+    tokenize,
+)
+
+
+# canonical_similarity_dump() is compact sorted-key JSON of
+# similarity_subset(), i.e. "{" + seg(f1) + "," + ... + seg(fn) + "}" with
+# seg(f) = '"f":' + value. Both prompt hashes decompose over those segments:
+# - SimHash: the separators are not alphanumeric, so no token spans two
+#   segments; the bit votes are the per-segment votes plus the separators'.
+# - MinHash: a 5-byte shingle belongs to the segment it starts in; the ones
+#   that run past its end only see the separator and the first 4 bytes of the
+#   next segment (the quoted key). The signature is the element-wise min of
+#   the per-segment partial signatures.
+# A changed field therefore costs one segment's tokens and shingles (plus the
+# previous segment's shingles if its lookahead bytes changed).
+
+_K = 5
+
+
+def _segment(field: str, value: Any) -> bytes:
+    # Same encoding as ordered_dump()
+    return (json.dumps(field) + ":" + json.dumps(value, separators=(",", ":"), sort_keys=True)).encode("utf-8")
+
+
+class PromptFingerprint:
+    """SimHash/MinHash of a prompt's similarity dump, kept per top-level field.
+
+    hashes() always equals {"simhash": simhash64(dump), "minhash":
+    minhash_hex(dump)} for the prompt last passed to update().
+    """
+
+    def __init__(self, obj: Dict[str, Any], num_perm: int = 64):
+        self.num_perm = num_perm
+        self._fields: List[str] = []
+        self._segs: Dict[str, bytes] = {}
+        self._votes: Dict[str, List[int]] = {}
+        self._sigs: Dict[str, List[int]] = {}
+        self._lookahead: Dict[str, bytes] = {}
+        self._sep_votes: List[int] = []
+        self._size = 0
+        self.update(obj)
+
+    def update(self, obj: Dict[str, Any]) -> List[str]:
+        """Re-hash the fields that changed since the last call; returns their names."""
+        slim = similarity_subset(obj)
+        fields = sorted(slim)
+        segs = {f: _segment(f, slim[f]) for f in fields}
+        if fields != self._fields:
+            # Different field set: segment positions moved, start over
+            self._fields = fields
+            self._segs, self._votes, self._sigs, self._lookahead = {}, {}, {}, {}
+            self._sep_votes = simhash_votes(["{", "}"] + [","] * (len(fields) - 1))
+        changed = [f for f in fields if segs[f] != self._segs.get(f)]
+        last = len(fields) - 1
+        for i, f in enumerate(fields):
+            lookahead = segs[fields[i + 1]][:_K - 1] if i < last else b""
+            if f not in changed and lookahead == self._lookahead.get(f):
+                continue
+            if f in changed:
+                self._votes[f] = simhash_votes(tokenize(segs[f].decode("utf-8")))
+            region = (b"{" if i == 0 else b"") + segs[f] + (b"," if i < last else b"}")
+            self._sigs[f] = minhash_partial(shingles_bytes(region + lookahead, _K, starts=len(region)), self.num_perm)
+            self._lookahead[f] = lookahead
+        self._segs = segs
+        self._size = 2 + last + sum(len(s) for s in segs.values())
+        return changed
+
+    def copy(self) -> "PromptFingerprint":
+        """Independent state to try a mutation on without touching this one."""
+        other = object.__new__(PromptFingerprint)
+        other.__dict__.update(self.__dict__)
+        for name in ("_segs", "_votes", "_sigs", "_lookahead"):
+            setattr(other, name, dict(getattr(self, name)))
+        return other
+
+    def assign(self, other: "PromptFingerprint") -> None:
+        """Take over the state of a copy() the chosen mutation was hashed on."""
+        self.__dict__.update(other.__dict__)
+
+    def hashes(self) -> Dict[str, str]:
+        votes = list(self._sep_votes)
+        for f in self._fields:
+            for i, v in enumerate(self._votes[f]):
+                votes[i] += v
+        if self._size < _K:
+            sig = [0] * self.num_perm
+        else:
+            sig = [min(col) for col in zip(*(self._sigs[f] for f in self._fields))]
+        return {"simhash": simhash_from_votes(votes), "minhash": minhash_to_hex(sig)}
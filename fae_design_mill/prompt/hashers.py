@@ -2,10 +2,11 @@ from __future__ import annotations
 import hashlib
 import math
 import random
-from typing import Iterable, List, Sequence, Tuple
+from functools import lru_cache
+from typing import Iterable, List, Optional, Sequence, Tuple
 
 
-def _tokenize(text: str) -> List[str]:
+def tokenize(text: str) -> List[str]:
     # Simple alnum tokens + key separators
     out: List[str] = []
     buf = []
@@ -23,14 +24,17 @@ def _tokenize(text: str) -> List[str]:
     return out
 
 
-def simhash64(text: str) -> str:
-    # Classic SimHash over tokens
-    tokens = _tokenize(text)
+def simhash_votes(tokens: Iterable[str]) -> List[int]:
+    # Per-bit +1/-1 votes; votes of concatenated token streams add up
     v = [0] * 64
     for tok in tokens:
         h = int.from_bytes(hashlib.sha1(tok.encode("utf-8")).digest()[:8], "big")
         for i in range(64):
             v[i] += 1 if ((h >> i) & 1) else -1
+    return v
+
+
+def simhash_from_votes(v: Sequence[int]) -> str:
     out = 0
     for i in range(64):
         if v[i] > 0:
@@ -38,24 +42,41 @@ def simhash64(text: str) -> str:
     return f"{out:016x}"
 
 
+def simhash64(text: str) -> str:
+    # Classic SimHash over tokens
+    return simhash_from_votes(simhash_votes(tokenize(text)))
+
+
 def shingles(text: str, k: int = 5) -> List[int]:
     # Byte-level k-grams hashed to ints
-    b = text.encode("utf-8")
-    out: List[int] = []
-    for i in range(0, max(0, len(b) - k + 1)):
-        out.append(int.from_bytes(hashlib.sha1(b[i:i+k]).digest()[:8], "big"))
-    return out
+    return shingles_bytes(text.encode("utf-8"), k)
 
 
-def minhash(text: str, num_perm: int = 64) -> List[int]:
-    # Simple MinHash with random a,b per permutation over 64-bit universe
-    sh = shingles(text, 5)
-    if not sh:
-        return [0] * num_perm
-    random.seed(42)
-    perms = [(random.randrange(1, 2**61-1), random.randrange(0, 2**61-1)) for _ in range(num_perm)]
+def shingles_bytes(b: bytes, k: int = 5, starts: Optional[int] = None) -> List[int]:
+    # k-grams starting before offset `starts` (all of them by default)
+    n = max(0, len(b) - k + 1)
+    if starts is not None:
+        n = min(n, starts)
+    return [int.from_bytes(hashlib.sha1(b[i:i+k]).digest()[:8], "big") for i in range(n)]
+
+
+@lru_cache(maxsize=None)
+def _minhash_perms(num_perm: int) -> Tuple[Tuple[int, int], ...]:
+    # Fixed seed so signatures stay comparable across runs; a private Random
+    # leaves the global generator alone (same values random.seed(42) gave)
+    rng = random.Random(42)
+    return tuple((rng.randrange(1, 2**61-1), rng.randrange(0, 2**61-1)) for _ in range(num_perm))
+
+
+MINHASH_EMPTY = 2**63 - 1
+
+
+def minhash_partial(sh: Iterable[int], num_perm: int = 64) -> List[int]:
+    # Signature of a set of shingles; the signature of a union is the
+    # element-wise min of its parts' signatures
+    perms = _minhash_perms(num_perm)
     m = 2**61 - 1
-    sig = [2**63-1] * num_perm
+    sig = [MINHASH_EMPTY] * num_perm
     for x in sh:
         for i, (a, b) in enumerate(perms):
             v = (a * x + b) % m
@@ -64,12 +85,23 @@ def minhash(text: str, num_perm: int = 64) -> List[int]:
     return sig
 
 
-def minhash_hex(text: str, num_perm: int = 64) -> str:
-    sig = minhash(text, num_perm)
+def minhash(text: str, num_perm: int = 64) -> List[int]:
+    # Simple MinHash with random a,b per permutation over 64-bit universe
+    sh = shingles(text, 5)
+    if not sh:
+        return [0] * num_perm
+    return minhash_partial(sh, num_perm)
+
+
+def minhash_to_hex(sig: Sequence[int]) -> str:
     # hex-encode as concatenated 8-byte hex blocks
     return "".join(f"{x:016x}" for x in sig)
 
 
+def minhash_hex(text: str, num_perm: int = 64) -> str:
+    return minhash_to_hex(minhash(text, num_perm))
+
+
 def hamming_distance_hex(a_hex: str, b_hex: str, bits: int = 64) -> int:
     try:
         a = int(a_hex, 16)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+import json
+import re
+from typing import Any, Dict, List
+
+from .codec import decode_canonical
+
+from .canonical import similarity_subset
+
+
+# Full-text search document for one prompt: the creative subset used for
+# similarity hashing, split into weighted columns. prompt_fts (FTS5) rows are
+# written by the repository functions that insert or update a prompt_record,
+# in the same transaction; a trigger drops the row when the prompt is deleted.
+# Prompts written by other tools are picked up by index_prompts() (manage.py
+# rebuild-search).
+
+FTS_COLUMNS = ("subject", "icons", "style", "color", "text", "title")
+# bm25() weights, same order as FTS_COLUMNS
+FTS_WEIGHTS = (4.0, 2.0, 1.5, 1.5, 1.0, 0.5)
+
+
+def _flat(*values: Any) -> str:
+    out: List[str] = []
+    for v in values:
+        if v is None or v == "" or isinstance(v, bool):
+            continue
+        if isinstance(v, (list, tuple)):
+            out.extend(str(x) for x in v if x not in (None, ""))
+        elif isinstance(v, dict):
+            out.append(_flat(*v.values()))
+        else:
+            out.append(str(v))
+    return " ; ".join(x for x in out if x)
+
+
+def fts_document(obj: Dict[str, Any]) -> List[str]:
+    slim = similarity_subset(obj)
+    text = slim.get("text") or {}
+    comp = slim.get("composition") or {}
+    vs = slim.get("visual_style") or {}
+    gm = (slim.get("color") or {}).get("gradient_map") or {}
+    return [
+        _flat(slim.get("subject")),
+        _flat(slim.get("icons_symbols")),
+        _flat(comp.get("style"), vs.get("genre_tags"), vs.get("shading"), vs.get("finish"),
+              comp.get("framing"), comp.get("perspective"), comp.get("balance")),
+        _flat(gm.get("scheme"), gm.get("apply_to")),
+        _flat(text.get("primary"), text.get("secondary"), text.get("layout"),
+              text.get("font_vibe"), text.get("text_treatment")),
+        _flat(slim.get("design_title")),
+    ]
+
+
+def fts_document_safe(canonical_str: str) -> List[str]:
+    # A prompt that cannot be indexed must still be stored, so failures index
+    # an empty document
+    try:
+        return fts_document(json.loads(canonical_str))
+    except Exception:
+        return [""] * len(FTS_COLUMNS)
+
+
+_SQL_FTS_INSERT = (
+    f"INSERT INTO prompt_fts(rowid, {', '.join(FTS_COLUMNS)}) VALUES(?{', ?' * len(FTS_COLUMNS)})"
+)
+
+
+def index_prompt(conn, prompt_id: int, canonical_str: str) -> None:
+    """Write (or replace) one prompt's row in prompt_fts."""
+    conn.execute("DELETE FROM prompt_fts WHERE rowid = ?", (prompt_id,))
+    conn.execute(_SQL_FTS_INSERT, (prompt_id, *fts_document_safe(canonical_str)))
+
+
+def index_prompts(conn, missing_only: bool = True) -> int:
+    """Index stored prompts: those without a prompt_fts row, or all of them
+    after clearing the index. Returns the number indexed."""
+    if not missing_only:
+        conn.execute("DELETE FROM prompt_fts")
+    sql = "SELECT id, payload, payload_codec FROM prompt_record WHERE id > ?"
+    if missing_only:
+        sql += " AND id NOT IN (SELECT rowid FROM prompt_fts)"
+    sql += " ORDER BY id LIMIT 500"
+    n, last = 0, 0
+    while True:
+        rows = conn.execute(sql, (last,)).fetchall()
+        if not rows:
+            return n
+        for row in rows:
+            try:
+                canonical_str = decode_canonical(conn, row[1], row[2])
+            except Exception:
+                canonical_str = ""
+            index_prompt(conn, row[0], canonical_str)
+        n += len(rows)
+        last = rows[-1][0]
+
+
+_TOKEN_RE = re.compile(r"[\w\-']+", re.UNICODE)
+
+
+def fts_query(q: str) -> str:
+    """Plain search text to an FTS5 query: every word must match, the last one
+    as a prefix so results show up while typing."""
+    words = [w for w in _TOKEN_RE.findall(q) if w.strip("-'")]
+    if not words:
+        return ""
+    quoted = ['"' + w.replace('"', '""') + '"' for w in words]
+    quoted[-1] += "*"
+    return " ".join(quoted)
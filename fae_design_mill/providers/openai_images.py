@@ -5,13 +5,9 @@ from typing import Any, Dict, List
 from pathlib import Path
 import urllib.request
 
-try:
-    from openai import OpenAI
-except Exception:  # pragma: no cover - optional dep at runtime
-    OpenAI = None  # type: ignore
-
 from .base import ImageProvider, ProviderResult
 from ..config import ASSETS_DIR
+from ..lazy import optional_import
 
 
 def _prompt_from_json(j: Dict[str, Any]) -> str:
@@ -52,6 +48,7 @@ def _prompt_from_json(j: Dict[str, Any]) -> str:
 
 class OpenAIImageProvider(ImageProvider):
     def __init__(self, model: str = "gpt-image-1"):
+        OpenAI = optional_import("openai", "OpenAI")
         if OpenAI is None:
             raise RuntimeError("openai library not installed. pip install openai")
         api_key = os.getenv("OPENAI_API_KEY")
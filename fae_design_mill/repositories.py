@@ -1,10 +1,48 @@
 from __future__ import annotations
+import copy
 import json
 from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Sequence, Tuple
-
-from .db import get_conn
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from .config import ITEM_RESERVATION_TTL
+from .db import get_conn, transaction, query_plan, full_scans
+from .prompt.codec import encode_canonical, decode_canonical, payload_view
+from .prompt.search import index_prompt, index_prompts
+
+
+# Read queries on hot paths. Kept as constants so check_query_plans() can
+# EXPLAIN exactly what the functions below run.
+_SQL_LIST_ID = "SELECT id FROM variable_list WHERE name=?"
+_SQL_ITEM_EXISTS = "SELECT id FROM variable_item WHERE variable_list_id=? AND value=?"
+_SQL_LIST_VALUES = "SELECT value FROM variable_item WHERE variable_list_id=?"
+_SQL_LIST_BY_NAME = "SELECT * FROM variable_list WHERE name=?"
+_SQL_LIST_ITEMS = """
+    SELECT vi.* FROM variable_item vi
+    JOIN variable_list vl ON vl.id = vi.variable_list_id
+    WHERE vl.name = ?
+    ORDER BY vi.id DESC
+"""
+_SQL_ENABLED_ITEMS = """
+    SELECT vi.*, vl.name AS list_name FROM variable_item vi
+    JOIN variable_list vl ON vl.id = vi.variable_list_id
+    WHERE vl.name = ? AND vi.enabled = 1
+    ORDER BY vi.id
+"""
+_SQL_COOLDOWN_HITS = "SELECT COUNT(*) AS c FROM cooldown_log WHERE variable_item_id = ? AND used_at >= ?"
+_SQL_RESERVED_ITEMS = "SELECT variable_item_id FROM item_reservation WHERE expires_at > ?"
+_SQL_RUN_RESERVATIONS = """
+    SELECT vi.id, vi.value, vl.name AS list_name FROM item_reservation ir
+    JOIN variable_item vi ON vi.id = ir.variable_item_id
+    JOIN variable_list vl ON vl.id = vi.variable_list_id
+    WHERE ir.design_run_id = ?
+"""
+_SQL_RECENT_PROMPT_HASHES = "SELECT prompt_hash_simhash, prompt_hash_minhash FROM prompt_record ORDER BY id DESC LIMIT ?"
+_SQL_RECENT_PROMPT_FINGERPRINTS = "SELECT id, prompt_hash_simhash, prompt_hash_minhash FROM prompt_record ORDER BY id DESC LIMIT ?"
+_SQL_RECENT_ASSET_HASHES = "SELECT image_hash_phash, image_hash_dhash FROM asset_record ORDER BY id DESC LIMIT ?"
+_SQL_RUN_ID_FROM = "SELECT id FROM design_run WHERE created_at >= ? ORDER BY created_at LIMIT 1"
+_SQL_RUN_ID_UNTIL = "SELECT id FROM design_run WHERE created_at < ? ORDER BY created_at DESC LIMIT 1"
+_SQL_CONFIG_GENERATION = "SELECT generation FROM config_generation WHERE id = 1"
 
 
 def now_iso() -> str:
@@ -17,10 +55,12 @@ def add_variable_list(name: str, description: str = "") -> int:
             "INSERT OR IGNORE INTO variable_list(name, description) VALUES(?, ?)",
             (name, description),
         )
-        if cur.lastrowid:
+        # rowcount, not lastrowid: the pooled connection keeps the rowid of its
+        # previous insert when this one is ignored
+        if cur.rowcount:
             conn.commit()
             return cur.lastrowid
-        cur = conn.execute("SELECT id FROM variable_list WHERE name=?", (name,))
+        cur = conn.execute(_SQL_LIST_ID, (name,))
         return cur.fetchone()[0]
 
 
@@ -44,10 +84,7 @@ def ensure_variable_item(list_name: str, value: str, weight: float = 1.0, enable
     """Idempotently ensure a variable item exists; returns True if created."""
     lst_id = add_variable_list(list_name)
     with get_conn() as conn:
-        cur = conn.execute(
-            "SELECT id FROM variable_item WHERE variable_list_id=? AND value=?",
-            (lst_id, value),
-        )
+        cur = conn.execute(_SQL_ITEM_EXISTS, (lst_id, value))
         if cur.fetchone():
             return False
         conn.execute(
@@ -61,41 +98,157 @@ def ensure_variable_item(list_name: str, value: str, weight: float = 1.0, enable
         return True
 
 
+_BULK_BATCH = 1000
+
+
+def bulk_add_variable_items(list_name: str, rows: Iterable[Union[str, Dict[str, Any]]], weight: float = 1.0,
+                            enabled: bool = True, cooldown_days: int = 0,
+                            tags: Optional[List[str]] = None, with_ids: bool = False) -> Dict[str, Any]:
+    """Insert many items into one list in a single transaction.
+
+    rows are plain values or dicts with "value" and optional per-row weight,
+    enabled, cooldown_days and tags overriding the defaults. Values already in
+    the list, or repeated within rows, are skipped. with_ids adds the new
+    item ids, in insertion order, as "ids".
+    """
+    stats: Dict[str, Any] = {"created": 0, "skipped": 0}
+    lst_id = add_variable_list(list_name)
+    with transaction(immediate=True) as conn:
+        seen = {r[0] for r in conn.execute(_SQL_LIST_VALUES, (lst_id,))}
+        # ids are AUTOINCREMENT and the write lock is held, so everything
+        # above this mark in the list was inserted here
+        mark = conn.execute("SELECT COALESCE(MAX(id), 0) FROM variable_item").fetchone()[0] if with_ids else 0
+        batch: List[Tuple[Any, ...]] = []
+        for row in rows:
+            item = row if isinstance(row, dict) else {"value": row}
+            value = item.get("value")
+            value = "" if value is None else str(value).strip()
+            if not value or value in seen:
+                stats["skipped"] += 1
+                continue
+            seen.add(value)
+            item_tags = item.get("tags")
+            batch.append((
+                lst_id,
+                value,
+                float(item.get("weight", weight)),
+                1 if item.get("enabled", enabled) else 0,
+                int(item.get("cooldown_days", cooldown_days)),
+                json.dumps(item_tags if item_tags is not None else (tags or [])),
+            ))
+            if len(batch) >= _BULK_BATCH:
+                _insert_item_batch(conn, batch)
+                stats["created"] += len(batch)
+                batch = []
+        if batch:
+            _insert_item_batch(conn, batch)
+            stats["created"] += len(batch)
+        if with_ids:
+            stats["ids"] = [r[0] for r in conn.execute(
+                "SELECT id FROM variable_item WHERE variable_list_id = ? AND id > ? ORDER BY id", (lst_id, mark)
+            )]
+    return stats
+
+
+def _insert_item_batch(conn, batch: List[Tuple[Any, ...]]) -> None:
+    conn.executemany(
+        """
+        INSERT INTO variable_item(variable_list_id, value, weight, enabled, cooldown_days, tags)
+        VALUES(?,?,?,?,?,?)
+        """,
+        batch,
+    )
+
+
+def _load_variable_lists(conn) -> List[Dict[str, Any]]:
+    cur = conn.execute(
+        """
+        SELECT vl.id, vl.name, vl.description, COUNT(vi.id) AS item_count
+        FROM variable_list vl
+        LEFT JOIN variable_item vi ON vi.variable_list_id = vl.id
+        GROUP BY vl.id, vl.name, vl.description
+        ORDER BY vl.name
+        """
+    )
+    return [dict(r) for r in cur.fetchall()]
+
+
 def list_variable_lists() -> List[Dict[str, Any]]:
-    with get_conn() as conn:
-        cur = conn.execute(
-            """
-            SELECT vl.id, vl.name, vl.description, COUNT(vi.id) AS item_count
-            FROM variable_list vl
-            LEFT JOIN variable_item vi ON vi.variable_list_id = vl.id
-            GROUP BY vl.id, vl.name, vl.description
-            ORDER BY vl.name
-            """
-        )
-        return [dict(r) for r in cur.fetchall()]
+    return [dict(r) for r in _cached_config(("lists",), _load_variable_lists)]
 
 
 def get_variable_list(name: str) -> Optional[Dict[str, Any]]:
     with get_conn() as conn:
-        cur = conn.execute("SELECT * FROM variable_list WHERE name=?", (name,))
+        cur = conn.execute(_SQL_LIST_BY_NAME, (name,))
         row = cur.fetchone()
         return dict(row) if row else None
 
 
 def list_variable_items(list_name: str) -> List[Dict[str, Any]]:
     with get_conn() as conn:
-        cur = conn.execute(
-            """
-            SELECT vi.* FROM variable_item vi
-            JOIN variable_list vl ON vl.id = vi.variable_list_id
-            WHERE vl.name = ?
-            ORDER BY vi.id DESC
-            """,
-            (list_name,),
-        )
+        cur = conn.execute(_SQL_LIST_ITEMS, (list_name,))
         return [dict(r) for r in cur.fetchall()]
 
 
+ITEM_PAGE_MAX = 500
+ITEM_MATCH_MODES = ("substring", "prefix")
+
+
+def _like_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _item_page_sql(list_id: int, after: Optional[int], limit: int, q: Optional[str], match: str,
+                   enabled: Optional[bool], tag: Optional[str]) -> Tuple[str, List[Any]]:
+    """Keyset query for one page of a list's items, newest first.
+
+    Pages walk idx_variable_item_list_id down from the cursor. A prefix match
+    is a value range (case-sensitive, like the duplicate check) that the
+    planner serves from idx_variable_item_list_value once ANALYZE has run;
+    a substring match is a LIKE filter on the walk.
+    """
+    where = ["vi.variable_list_id = ?"]
+    params: List[Any] = [list_id]
+    if after is not None:
+        where.append("vi.id < ?")
+        params.append(after)
+    if q:
+        if match == "prefix":
+            where.append("vi.value >= ? AND vi.value < ?")
+            params.extend([q, q + "\uffff"])
+        else:
+            where.append("vi.value LIKE ? ESCAPE '\\'")
+            params.append(f"%{_like_escape(q)}%")
+    if enabled is not None:
+        where.append("vi.enabled = ?")
+        params.append(1 if enabled else 0)
+    if tag:
+        where.append("EXISTS (SELECT 1 FROM json_each(CASE WHEN json_valid(vi.tags) THEN vi.tags ELSE '[]' END) WHERE json_each.value = ?)")
+        params.append(tag)
+    sql = f"SELECT vi.* FROM variable_item vi WHERE {' AND '.join(where)} ORDER BY vi.id DESC LIMIT ?"
+    params.append(limit)
+    return sql, params
+
+
+def variable_items_page(list_name: str, after: Optional[int] = None, limit: int = 100, q: Optional[str] = None,
+                        match: str = "substring", enabled: Optional[bool] = None,
+                        tag: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """One page of a list's items (newest first) and the cursor for the next page, if any."""
+    if match not in ITEM_MATCH_MODES:
+        raise ValueError(f"match must be one of {', '.join(ITEM_MATCH_MODES)}")
+    limit = max(1, min(int(limit), ITEM_PAGE_MAX))
+    with get_conn() as conn:
+        row = conn.execute(_SQL_LIST_ID, (list_name,)).fetchone()
+        if row is None:
+            return [], None
+        sql, params = _item_page_sql(row["id"], after, limit + 1, q, match, enabled, tag)
+        rows = [dict(r) for r in conn.execute(sql, params).fetchall()]
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1]["id"]
+    return rows, None
+
+
 def scaffold_lists_for_defaults() -> int:
     """Ensure a variable_list exists for each key_path in variable_defaults."""
     count = 0
@@ -109,137 +262,54 @@ def scaffold_lists_for_defaults() -> int:
     return count
 
 
-def seed_comprehensive_variable_lists() -> int:
-    """Seed reasonable options for most key paths so RANDOM works broadly."""
-    created = 0
-    # text.primary
-    for v in [
+# (key path, options, bulk_add_variable_items overrides)
+_COMPREHENSIVE_OPTIONS: List[Tuple[str, List[str], Dict[str, Any]]] = [
+    ("text.primary", [
         "FULLY AUTOMATED ENTERPRISES LLC",
         "FULLY AUTOMATED ENTERPRISES",
         "FAE", "FAE AUTOMATION", "FAE OPS",
-    ]:
-        if ensure_variable_item("text.primary", v, weight=1.0, cooldown_days=14):
-            created += 1
-
-    # text.layout
-    for v in ["horizontal", "stacked", "badge", "circular"]:
-        if ensure_variable_item("text.layout", v):
-            created += 1
-
-    # text.font_vibe
-    for v in ["bold sans", "condensed", "mono", "rounded", "slab", "humanist"]:
-        if ensure_variable_item("text.font_vibe", v):
-            created += 1
-
-    # text.text_treatment
-    for v in ["solid", "outlined", "inline-shadow:none", "inline-shadow:soft", "etched", "inset", "stroke-only"]:
-        if ensure_variable_item("text.text_treatment", v):
-            created += 1
-
-    # composition.framing
-    for v in ["centered", "badge", "crest", "off-center"]:
-        if ensure_variable_item("composition.framing", v):
-            created += 1
-
-    # composition.perspective
-    for v in ["orthographic", "isometric", "oblique", "front"]:
-        if ensure_variable_item("composition.perspective", v):
-            created += 1
-
-    # composition.balance
-    for v in ["symmetrical", "asymmetrical", "radial", "triangular"]:
-        if ensure_variable_item("composition.balance", v):
-            created += 1
-
-    # visual_style.detail_level
-    for v in ["low", "medium", "medium-high", "high"]:
-        if ensure_variable_item("visual_style.detail_level", v):
-            created += 1
-
-    # visual_style.shading
-    for v in ["hatching/minimal", "none", "crosshatch", "dot-shade"]:
-        if ensure_variable_item("visual_style.shading", v):
-            created += 1
-
-    # visual_style.texture
-    for v in ["none", "paper", "grain", "halftone"]:
-        if ensure_variable_item("visual_style.texture", v):
-            created += 1
-
-    # visual_style.finish
-    for v in ["clean neon etching", "matte", "gloss", "metallic-outline"]:
-        if ensure_variable_item("visual_style.finish", v):
-            created += 1
-
-    # background.type
-    for v in ["transparent", "none", "solid"]:
-        if ensure_variable_item("background.type", v):
-            created += 1
-
-    # background.drop_shadow
-    for v in ["none", "soft", "hard"]:
-        if ensure_variable_item("background.drop_shadow", v):
-            created += 1
-
-    # background.halo
-    for v in ["none", "soft"]:
-        if ensure_variable_item("background.halo", v):
-            created += 1
-
-    # background.background_elements
-    for v in ["none", "grid", "guides", "circuit-traces"]:
-        if ensure_variable_item("background.background_elements", v):
-            created += 1
-
-    # output.format
-    for v in ["png", "webp"]:
-        if ensure_variable_item("output.format", v):
-            created += 1
-
-    # output.transparent (bool as string)
-    for v in ["true", "false"]:
-        if ensure_variable_item("output.transparent", v):
-            created += 1
-
-    # constraints (bools as strings)
-    for key in [
-        "constraints.no_photographic_textures",
-        "constraints.no_raster_noise",
-        "constraints.no_background_box",
-        "constraints.no_watermarks",
-        "constraints.no_small_illegible_text",
-    ]:
-        for v in ["true", "false"]:
-            if ensure_variable_item(key, v):
-                created += 1
-
-    # negative_prompt variations
-    negs = [
+    ], {"cooldown_days": 14}),
+    ("text.layout", ["horizontal", "stacked", "badge", "circular"], {}),
+    ("text.font_vibe", ["bold sans", "condensed", "mono", "rounded", "slab", "humanist"], {}),
+    ("text.text_treatment", ["solid", "outlined", "inline-shadow:none", "inline-shadow:soft", "etched", "inset", "stroke-only"], {}),
+    ("composition.framing", ["centered", "badge", "crest", "off-center"], {}),
+    ("composition.perspective", ["orthographic", "isometric", "oblique", "front"], {}),
+    ("composition.balance", ["symmetrical", "asymmetrical", "radial", "triangular"], {}),
+    ("visual_style.detail_level", ["low", "medium", "medium-high", "high"], {}),
+    ("visual_style.shading", ["hatching/minimal", "none", "crosshatch", "dot-shade"], {}),
+    ("visual_style.texture", ["none", "paper", "grain", "halftone"], {}),
+    ("visual_style.finish", ["clean neon etching", "matte", "gloss", "metallic-outline"], {}),
+    ("background.type", ["transparent", "none", "solid"], {}),
+    ("background.drop_shadow", ["none", "soft", "hard"], {}),
+    ("background.halo", ["none", "soft"], {}),
+    ("background.background_elements", ["none", "grid", "guides", "circuit-traces"], {}),
+    ("output.format", ["png", "webp"], {}),
+    # bools as strings
+    ("output.transparent", ["true", "false"], {}),
+    ("constraints.no_photographic_textures", ["true", "false"], {}),
+    ("constraints.no_raster_noise", ["true", "false"], {}),
+    ("constraints.no_background_box", ["true", "false"], {}),
+    ("constraints.no_watermarks", ["true", "false"], {}),
+    ("constraints.no_small_illegible_text", ["true", "false"], {}),
+    ("negative_prompt", [
         "no photo, no 3D render, no background, no gradients, no glow, no watermark, no mockup",
         "no photo realism, no raster textures, no background boxes, no glow, no watermarks",
         "avoid photographic textures, avoid 3D rendering, avoid background blocks, avoid glows",
-    ]
-    for v in negs:
-        if ensure_variable_item("negative_prompt", v):
-            created += 1
-
+    ], {}),
     # numeric-like options (stored as text; engine coerces types)
-    for v in ["1", "2", "3", "4", "5"]:
-        if ensure_variable_item("visual_style.line_weight_px", v):
-            created += 1
-    for v in ["4", "6", "8", "10"]:
-        if ensure_variable_item("composition.padding_percent", v):
-            created += 1
-    for v in ["1", "2", "3"]:
-        if ensure_variable_item("output.n_variations", v):
-            created += 1
-    for v in ["0.00", "0.01", "0.02", "0.04"]:
-        if ensure_variable_item("color.gradient_map.clip_black", v):
-            created += 1
-    for v in ["0.00", "0.01", "0.02"]:
-        if ensure_variable_item("color.gradient_map.clip_white", v):
-            created += 1
+    ("visual_style.line_weight_px", ["1", "2", "3", "4", "5"], {}),
+    ("composition.padding_percent", ["4", "6", "8", "10"], {}),
+    ("output.n_variations", ["1", "2", "3"], {}),
+    ("color.gradient_map.clip_black", ["0.00", "0.01", "0.02", "0.04"], {}),
+    ("color.gradient_map.clip_white", ["0.00", "0.01", "0.02"], {}),
+]
+
 
+def seed_comprehensive_variable_lists() -> int:
+    """Seed reasonable options for most key paths so RANDOM works broadly."""
+    created = 0
+    for key_path, values, opts in _COMPREHENSIVE_OPTIONS:
+        created += bulk_add_variable_items(key_path, values, **opts)["created"]
     return created
 
 
@@ -280,41 +350,65 @@ def set_default_mode(key_path: str, mode: str, default_value: Optional[Any] = No
         conn.commit()
 
 
-def get_defaults_map() -> Dict[str, Dict[str, Any]]:
+# Read-through cache for configuration reads. Triggers (migration 9) bump
+# config_generation on every write to the config tables, whichever process
+# or code path makes it, so an entry is served only while the generation it
+# was read at is still current. Callers get copies.
+_config_cache: Dict[Tuple[str, ...], Tuple[int, Any]] = {}
+
+
+def config_generation(conn=None) -> int:
+    if conn is None:
+        with get_conn() as conn:
+            return config_generation(conn)
+    row = conn.execute(_SQL_CONFIG_GENERATION).fetchone()
+    return row[0] if row else 0
+
+
+def _cached_config(key: Tuple[str, ...], load):
     with get_conn() as conn:
-        cur = conn.execute("SELECT key_path, mode, default_value, weight_profile_id, sequence_pointer, llm_template FROM variable_defaults")
-        out: Dict[str, Dict[str, Any]] = {}
-        for r in cur.fetchall():
-            out[r["key_path"]] = {
-                "mode": r["mode"],
-                "default_value": json.loads(r["default_value"]) if r["default_value"] else None,
-                "weight_profile_id": r["weight_profile_id"],
-                "sequence_pointer": r["sequence_pointer"],
-                "llm_template": r["llm_template"],
-            }
-        return out
+        gen = config_generation(conn)
+        hit = _config_cache.get(key)
+        if hit is not None and hit[0] == gen:
+            return hit[1]
+        value = load(conn)
+    _config_cache[key] = (gen, value)
+    return value
+
+
+def _load_defaults_map(conn) -> Dict[str, Dict[str, Any]]:
+    cur = conn.execute("SELECT key_path, mode, default_value, weight_profile_id, sequence_pointer, llm_template FROM variable_defaults")
+    out: Dict[str, Dict[str, Any]] = {}
+    for r in cur.fetchall():
+        out[r["key_path"]] = {
+            "mode": r["mode"],
+            "default_value": json.loads(r["default_value"]) if r["default_value"] else None,
+            "weight_profile_id": r["weight_profile_id"],
+            "sequence_pointer": r["sequence_pointer"],
+            "llm_template": r["llm_template"],
+        }
+    return out
+
+
+def get_defaults_map() -> Dict[str, Dict[str, Any]]:
+    return copy.deepcopy(_cached_config(("defaults",), _load_defaults_map))
+
+
+def _load_policy(conn) -> Dict[str, Any]:
+    row = conn.execute("SELECT * FROM generation_policy LIMIT 1").fetchone()
+    return dict(row) if row else {}
 
 
 def get_policy() -> Dict[str, Any]:
-    with get_conn() as conn:
-        cur = conn.execute("SELECT * FROM generation_policy LIMIT 1")
-        row = cur.fetchone()
-        if not row:
-            return {}
-        return dict(row)
+    return dict(_cached_config(("policy",), _load_policy))
 
 
 def _items_in_list(list_name: str) -> List[dict]:
-    with get_conn() as conn:
-        cur = conn.execute(
-            """
-            SELECT vi.*, vl.name AS list_name FROM variable_item vi
-            JOIN variable_list vl ON vl.id = vi.variable_list_id
-            WHERE vl.name = ? AND vi.enabled = 1
-            """,
-            (list_name,),
-        )
-        return [dict(r) for r in cur.fetchall()]
+    items = _cached_config(
+        ("items", list_name),
+        lambda conn: [dict(r) for r in conn.execute(_SQL_ENABLED_ITEMS, (list_name,)).fetchall()],
+    )
+    return [dict(it) for it in items]
 
 
 def _is_in_cooldown(variable_item_id: int, cooldown_days: int, multiplier: float) -> bool:
@@ -323,22 +417,78 @@ def _is_in_cooldown(variable_item_id: int, cooldown_days: int, multiplier: float
     window_days = int(round(cooldown_days * multiplier))
     cutoff = datetime.utcnow() - timedelta(days=window_days)
     with get_conn() as conn:
-        cur = conn.execute(
-            "SELECT COUNT(*) AS c FROM cooldown_log WHERE variable_item_id = ? AND used_at >= ?",
-            (variable_item_id, cutoff.isoformat()),
-        )
+        cur = conn.execute(_SQL_COOLDOWN_HITS, (variable_item_id, cutoff.isoformat()))
         return cur.fetchone()[0] > 0
 
 
-def eligible_items(list_name: str, cooldown_multiplier: float = 1.0) -> List[dict]:
+def _reserved_item_ids() -> set:
+    with get_conn() as conn:
+        return {r[0] for r in conn.execute(_SQL_RESERVED_ITEMS, (now_iso(),))}
+
+
+def eligible_items(list_name: str, cooldown_multiplier: float = 1.0, include_reserved: bool = False) -> List[dict]:
+    """Enabled items out of cooldown; items reserved by runs in flight are
+    left out unless include_reserved."""
     items = _items_in_list(list_name)
+    reserved = set() if include_reserved else _reserved_item_ids()
     out: List[dict] = []
     for it in items:
+        if it["id"] in reserved:
+            continue
         if not _is_in_cooldown(it["id"], int(it["cooldown_days"]), cooldown_multiplier):
             out.append(it)
     return out
 
 
+def reserve_items(run_id: int, item_ids: Sequence[int], ttl: int = ITEM_RESERVATION_TTL):
+    """Hold items for a run; call inside the transaction that read their
+    eligibility so concurrent builds cannot draw them too."""
+    ts = now_iso()
+    expires = (datetime.utcnow() + timedelta(seconds=ttl)).isoformat()
+    with get_conn() as conn:
+        conn.execute("DELETE FROM item_reservation WHERE expires_at <= ?", (ts,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO item_reservation(design_run_id, variable_item_id, expires_at) VALUES(?, ?, ?)",
+            [(run_id, i, expires) for i in set(item_ids)],
+        )
+        conn.commit()
+
+
+def confirm_item_reservations(run_id: int) -> int:
+    """Turn a run's reservations into cooldown_log rows; returns how many."""
+    ts = now_iso()
+    with get_conn() as conn:
+        conn.execute(
+            "INSERT INTO cooldown_log(variable_item_id, used_at) SELECT variable_item_id, ? FROM item_reservation WHERE design_run_id = ?",
+            (ts, run_id),
+        )
+        n = conn.execute("DELETE FROM item_reservation WHERE design_run_id = ?", (run_id,)).rowcount
+        conn.commit()
+        return n
+
+
+def run_reservations(run_id: int) -> List[Dict[str, Any]]:
+    """Items a run holds, with their value and list name."""
+    with get_conn() as conn:
+        return [dict(r) for r in conn.execute(_SQL_RUN_RESERVATIONS, (run_id,))]
+
+
+def release_item_reservations(run_id: int, item_ids: Optional[Sequence[int]] = None) -> int:
+    """Free a run's reservations: all of them, or only item_ids."""
+    with get_conn() as conn:
+        if item_ids is None:
+            n = conn.execute("DELETE FROM item_reservation WHERE design_run_id = ?", (run_id,)).rowcount
+        else:
+            n = sum(
+                conn.execute(
+                    "DELETE FROM item_reservation WHERE design_run_id = ? AND variable_item_id = ?", (run_id, i)
+                ).rowcount
+                for i in set(item_ids)
+            )
+        conn.commit()
+        return n
+
+
 def log_cooldown(item_ids: Sequence[int]):
     if not item_ids:
         return
@@ -351,12 +501,12 @@ def log_cooldown(item_ids: Sequence[int]):
         conn.commit()
 
 
-def create_design_run(job_key: str, scheduled_for: Optional[str] = None) -> int:
+def create_design_run(job_key: str, scheduled_for: Optional[str] = None, rng_seed: Optional[int] = None) -> int:
     ts = now_iso()
     with get_conn() as conn:
         cur = conn.execute(
-            "INSERT INTO design_run(scheduled_for, status, reason, job_key, created_at, updated_at) VALUES(?, 'PENDING', '', ?, ?, ?)",
-            (scheduled_for, job_key, ts, ts),
+            "INSERT INTO design_run(scheduled_for, status, reason, job_key, rng_seed, created_at, updated_at) VALUES(?, 'PENDING', '', ?, ?, ?, ?)",
+            (scheduled_for, job_key, rng_seed, ts, ts),
         )
         conn.commit()
         return cur.lastrowid
@@ -371,26 +521,61 @@ def update_design_run_status(run_id: int, status: str, reason: str = ""):
         conn.commit()
 
 
-def insert_prompt_record(run_id: int, json_payload: dict, canonical_str: str, simhash_hex: str, minhash_hex: str, novelty_score: float, staleness_score: float = 0.0) -> int:
-    with get_conn() as conn:
+def _search_enabled(conn) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'prompt_fts'").fetchone() is not None
+
+
+def insert_prompt_record(run_id: int, canonical_str: str, simhash_hex: str, minhash_hex: str, novelty_score: float, staleness_score: float = 0.0) -> int:
+    with transaction() as conn:
+        payload, codec = encode_canonical(conn, canonical_str)
         cur = conn.execute(
             """
-            INSERT INTO prompt_record(design_run_id, json_payload, canonical_str, prompt_hash_simhash, prompt_hash_minhash, novelty_score, staleness_score)
+            INSERT INTO prompt_record(design_run_id, payload, payload_codec, prompt_hash_simhash, prompt_hash_minhash, novelty_score, staleness_score)
             VALUES(?,?,?,?,?,?,?)
             """,
-            (run_id, json.dumps(json_payload, separators=(",", ":")), canonical_str, simhash_hex, minhash_hex, novelty_score, staleness_score),
+            (run_id, payload, codec, simhash_hex, minhash_hex, novelty_score, staleness_score),
         )
-        conn.commit()
-        return cur.lastrowid
+        prompt_id = cur.lastrowid
+        if _search_enabled(conn):
+            index_prompt(conn, prompt_id, canonical_str)
+        return prompt_id
+
+
+def update_prompt_record(prompt_id: int, canonical_str: str, simhash_hex: str, minhash_hex: str):
+    """Replace a record's prompt and hashes (the prompt was mutated after it was stored)."""
+    with transaction() as conn:
+        payload, codec = encode_canonical(conn, canonical_str)
+        conn.execute(
+            "UPDATE prompt_record SET payload=?, payload_codec=?, prompt_hash_simhash=?, prompt_hash_minhash=? WHERE id=?",
+            (payload, codec, simhash_hex, minhash_hex, prompt_id),
+        )
+        if _search_enabled(conn):
+            index_prompt(conn, prompt_id, canonical_str)
+
+
+def prompt_record_views(conn, row) -> Dict[str, Any]:
+    """Row as a dict with canonical_str and json_payload rebuilt from payload."""
+    d = dict(row)
+    canonical_str = decode_canonical(conn, d.pop("payload"), d.pop("payload_codec"))
+    d["canonical_str"] = canonical_str
+    d["json_payload"] = payload_view(canonical_str)
+    return d
+
+
+def get_prompt_record(prompt_id: int) -> Optional[Dict[str, Any]]:
+    with get_conn() as conn:
+        row = conn.execute("SELECT * FROM prompt_record WHERE id = ?", (prompt_id,)).fetchone()
+        return prompt_record_views(conn, row) if row else None
 
 
 def insert_asset_record(run_id: int, prompt_record_id: int, provider: str, request_payload: dict, response_payload: dict,
-                        file_path: str, phash_hex: str, dhash_hex: str, width: int, height: int, dpi: int = 300) -> int:
+                        file_path: str, phash_hex: str, dhash_hex: str, width: int, height: int, dpi: int = 300,
+                        file_url: Optional[str] = None, content_hash: Optional[str] = None) -> int:
     with get_conn() as conn:
         cur = conn.execute(
             """
-            INSERT INTO asset_record(design_run_id, prompt_record_id, provider, request_payload, response_payload, file_path, image_hash_phash, image_hash_dhash, width, height, dpi, created_at)
-            VALUES(?,?,?,?,?,?,?,?,?,?,?,?)
+            INSERT INTO asset_record(design_run_id, prompt_record_id, provider, request_payload, response_payload, file_path, file_url, image_hash_phash, image_hash_dhash, width, height, dpi, created_at, content_hash)
+            VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)
             """,
             (
                 run_id,
@@ -399,12 +584,14 @@ def insert_asset_record(run_id: int, prompt_record_id: int, provider: str, reque
                 json.dumps(request_payload, separators=(",", ":")) if request_payload else None,
                 json.dumps(response_payload, separators=(",", ":")) if response_payload else None,
                 file_path,
+                file_url,
                 phash_hex,
                 dhash_hex,
                 width,
                 height,
                 dpi,
                 now_iso(),
+                content_hash,
             ),
         )
         conn.commit()
@@ -413,22 +600,217 @@ def insert_asset_record(run_id: int, prompt_record_id: int, provider: str, reque
 
 def recent_prompt_hashes(limit: int = 100) -> List[Tuple[str, str]]:
     with get_conn() as conn:
-        cur = conn.execute(
-            "SELECT prompt_hash_simhash, prompt_hash_minhash FROM prompt_record ORDER BY id DESC LIMIT ?",
-            (limit,),
-        )
+        cur = conn.execute(_SQL_RECENT_PROMPT_HASHES, (limit,))
         return [(r[0] or "", r[1] or "") for r in cur.fetchall()]
 
 
+def recent_prompt_fingerprints(limit: int = 100) -> List[Tuple[int, str, str]]:
+    """(prompt_record id, simhash, minhash) of the newest prompts."""
+    with get_conn() as conn:
+        cur = conn.execute(_SQL_RECENT_PROMPT_FINGERPRINTS, (limit,))
+        return [(r[0], r[1] or "", r[2] or "") for r in cur.fetchall()]
+
+
 def recent_asset_hashes(limit: int = 100) -> List[Tuple[str, str]]:
     with get_conn() as conn:
-        cur = conn.execute(
-            "SELECT image_hash_phash, image_hash_dhash FROM asset_record ORDER BY id DESC LIMIT ?",
-            (limit,),
-        )
+        cur = conn.execute(_SQL_RECENT_ASSET_HASHES, (limit,))
         return [(r[0] or "", r[1] or "") for r in cur.fetchall()]
 
 
+RUN_PAGE_MAX = 200
+
+_RUN_COLUMNS_FULL = """
+    dr.id AS run_id, dr.status, dr.reason, dr.rng_seed, pr.id AS prompt_id, ar.id AS asset_id, ar.provider,
+    ar.file_path, ar.file_url, ar.content_hash, ar.width, ar.height,
+    COALESCE(ar.created_at, dr.created_at) AS created_at
+"""
+_RUN_COLUMNS_COMPACT = """
+    dr.id AS run_id, dr.status, ar.file_path, ar.file_url, ar.content_hash,
+    COALESCE(ar.created_at, dr.created_at) AS created_at
+"""
+
+
+def _run_history_sql(before: Optional[int] = None, limit: int = 20, status: Optional[str] = None,
+                     provider: Optional[str] = None, id_range: Tuple[Optional[int], Optional[int]] = (None, None),
+                     compact: bool = False) -> Tuple[str, List[Any]]:
+    """Keyset query over runs, newest first, starting below run id `before`.
+
+    Every filter is an index seek plus a walk down the run id, so a page costs
+    the same however far back it is. With a provider filter the walk is driven
+    from asset_record(provider, design_run_id) instead of design_run.
+    """
+    key = "ar.design_run_id" if provider else "dr.id"
+    where: List[str] = []
+    params: List[Any] = []
+    if provider:
+        where.append("ar.provider = ?")
+        params.append(provider)
+    if status:
+        where.append("dr.status = ?")
+        params.append(status)
+    if before is not None:
+        where.append(f"{key} < ?")
+        params.append(before)
+    lo, hi = id_range
+    if lo is not None:
+        where.append(f"{key} >= ?")
+        params.append(lo)
+    if hi is not None:
+        where.append(f"{key} <= ?")
+        params.append(hi)
+    if provider:
+        joins = """
+    FROM asset_record ar
+    JOIN design_run dr ON dr.id = ar.design_run_id"""
+    else:
+        joins = """
+    FROM design_run dr
+    LEFT JOIN asset_record ar ON ar.design_run_id = dr.id"""
+    if not compact:
+        joins += """
+    LEFT JOIN prompt_record pr ON pr.design_run_id = dr.id"""
+    sql = (
+        f"SELECT {_RUN_COLUMNS_COMPACT if compact else _RUN_COLUMNS_FULL}{joins}"
+        + (f"\n    WHERE {' AND '.join(where)}" if where else "")
+        + f"\n    ORDER BY {key} DESC LIMIT ?"
+    )
+    params.append(limit)
+    return sql, params
+
+
+def run_id_window(conn, since: Optional[str], until: Optional[str]) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    """Run id bounds (lo, hi) for a created_at window, or None if it is empty.
+
+    Runs are inserted with increasing created_at, so a date window is a run
+    id window found with two index seeks. A date-only `until` is inclusive.
+    """
+    lo = hi = None
+    if since:
+        row = conn.execute(_SQL_RUN_ID_FROM, (since,)).fetchone()
+        if row is None:
+            return None
+        lo = row[0]
+    if until:
+        if len(until) == 10:
+            until = (datetime.fromisoformat(until) + timedelta(days=1)).date().isoformat()
+        else:
+            until = until + "\uffff"
+        row = conn.execute(_SQL_RUN_ID_UNTIL, (until,)).fetchone()
+        if row is None:
+            return None
+        hi = row[0]
+    return lo, hi
+
+
+def run_history(before: Optional[int] = None, limit: int = 20, status: Optional[str] = None,
+                provider: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                compact: bool = False) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """One page of runs (newest first) and the cursor for the next page, if any."""
+    limit = max(1, min(int(limit), RUN_PAGE_MAX))
+    with get_conn() as conn:
+        id_range = run_id_window(conn, since, until)
+        if id_range is None:
+            return [], None
+        sql, params = _run_history_sql(before, limit + 1, status, provider, id_range, compact)
+        rows = [dict(r) for r in conn.execute(sql, params).fetchall()]
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1]["run_id"]
+    return rows, None
+
+
+SEARCH_PAGE_MAX = 100
+
+# Rank inside the FTS index first (rank is bm25 with the configured column
+# weights), then join only the page of hits to runs and assets.
+_SQL_SEARCH = """
+    SELECT m.prompt_id, pr.design_run_id AS run_id, dr.status, dr.created_at,
+           ar.file_path, ar.file_url, ar.content_hash, m.score, m.snippet
+    FROM (
+        SELECT rowid AS prompt_id, rank AS score,
+               snippet(prompt_fts, -1, char(2), char(3), '…', 12) AS snippet
+        FROM prompt_fts WHERE prompt_fts MATCH ?
+        ORDER BY rank LIMIT ? OFFSET ?
+    ) m
+    JOIN prompt_record pr ON pr.id = m.prompt_id
+    JOIN design_run dr ON dr.id = pr.design_run_id
+    LEFT JOIN asset_record ar ON ar.design_run_id = dr.id
+    ORDER BY m.score
+"""
+
+
+def search_available() -> bool:
+    with get_conn() as conn:
+        return _search_enabled(conn)
+
+
+def rebuild_search_index() -> Optional[int]:
+    """Re-index every prompt from its stored payload, e.g. after prompts were
+    written by a tool that bypassed insert_prompt_record. Returns the number
+    of prompts indexed, or None without FTS5."""
+    with transaction(immediate=True) as conn:
+        if not _search_enabled(conn):
+            return None
+        return index_prompts(conn, missing_only=False)
+
+
+def search_prompts(match: str, limit: int = 20, offset: int = 0) -> Tuple[List[Dict[str, Any]], bool]:
+    """Best-ranked prompts for an FTS5 MATCH expression and whether more follow.
+
+    snippet is plain text with \x02 / \x03 around matched terms.
+    """
+    limit = max(1, min(int(limit), SEARCH_PAGE_MAX))
+    with get_conn() as conn:
+        rows = [dict(r) for r in conn.execute(_SQL_SEARCH, (match, limit + 1, max(0, int(offset)))).fetchall()]
+    return rows[:limit], len(rows) > limit
+
+
+def recent_runs(limit: int = 20) -> List[Dict[str, Any]]:
+    return run_history(limit=limit)[0]
+
+
+# (name, sql, sample params, tables a bounded scan is expected on).
+# ORDER BY id DESC LIMIT walks the rowid b-tree from the end, which EXPLAIN
+# reports as a plain SCAN even though it stops after LIMIT rows.
+HOT_QUERIES: List[Tuple[str, str, Tuple[Any, ...], Tuple[str, ...]]] = [
+    ("add_variable_list", _SQL_LIST_ID, ("subject",), ()),
+    ("ensure_variable_item", _SQL_ITEM_EXISTS, (1, "x"), ()),
+    ("bulk_add_variable_items", _SQL_LIST_VALUES, (1,), ()),
+    ("get_variable_list", _SQL_LIST_BY_NAME, ("subject",), ()),
+    ("list_variable_items", _SQL_LIST_ITEMS, ("subject",), ()),
+    ("variable_items_page", *_item_page_sql(1, 1000, 101, None, "substring", None, None), ()),
+    ("variable_items_search", *_item_page_sql(1, None, 101, "neo", "substring", True, "x"), ("json_each",)),
+    ("eligible_items", _SQL_ENABLED_ITEMS, ("subject",), ()),
+    ("cooldown_check", _SQL_COOLDOWN_HITS, (1, "2000-01-01"), ()),
+    ("reserved_items", _SQL_RESERVED_ITEMS, ("2000-01-01",), ()),
+    ("run_reservations", _SQL_RUN_RESERVATIONS, (1,), ()),
+    ("config_generation", _SQL_CONFIG_GENERATION, (), ()),
+    ("recent_prompt_hashes", _SQL_RECENT_PROMPT_HASHES, (200,), ("prompt_record",)),
+    ("recent_prompt_fingerprints", _SQL_RECENT_PROMPT_FINGERPRINTS, (200,), ("prompt_record",)),
+    ("recent_asset_hashes", _SQL_RECENT_ASSET_HASHES, (200,), ("asset_record",)),
+    ("run_history", *_run_history_sql(), ("dr",)),
+    ("run_history_page", *_run_history_sql(before=1000, id_range=(1, 5000)), ()),
+    ("run_history_status", *_run_history_sql(before=1000, status="GENERATED"), ()),
+    ("run_history_provider", *_run_history_sql(before=1000, provider="null", compact=True), ()),
+    ("run_history_since", _SQL_RUN_ID_FROM, ("2000-01-01",), ()),
+    ("run_history_until", _SQL_RUN_ID_UNTIL, ("2000-01-01",), ()),
+]
+
+
+def check_query_plans() -> Dict[str, List[str]]:
+    """Return {query name: offending plan lines} for hot queries that full-scan."""
+    problems: Dict[str, List[str]] = {}
+    with get_conn() as conn:
+        for name, sql, params, bounded in HOT_QUERIES:
+            scans = [
+                line for line in full_scans(query_plan(conn, sql, params))
+                if line.split()[1] not in bounded
+            ]
+            if scans:
+                problems[name] = scans
+    return problems
+
+
 def seed_initial_data() -> int:
     # Seed lists and defaults based on the provided spec
     seeded = 0
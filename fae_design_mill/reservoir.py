@@ -0,0 +1,122 @@
+from __future__ import annotations
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+from .config import LLM_MODEL, LLM_REFILL_BATCH, LLM_RESERVOIR_DEPTH
+from .db import get_conn, transaction
+from .llm import generate_candidates, template_hash
+from .repositories import get_defaults_map, now_iso
+
+
+# Reservoir of pre-generated values for LLM-mode keys, so build_prompt() can
+# take one without waiting on the LLM. Rows are tagged with the hash of the
+# key's effective template and the model: a value only matches while both are
+# unchanged, and refill() deletes the rest. Values are consumed oldest first.
+
+_SQL_POP = """
+    SELECT id, value FROM llm_reservoir
+    WHERE key_path = ? AND template_hash = ? AND model = ?
+    ORDER BY id LIMIT 1
+"""
+_SQL_DEPTH = "SELECT COUNT(*) FROM llm_reservoir WHERE key_path = ? AND template_hash = ? AND model = ?"
+_SQL_STALE = "DELETE FROM llm_reservoir WHERE key_path = ? AND NOT (template_hash = ? AND model = ?)"
+_SQL_LIST_VALUES = """
+    SELECT vi.value FROM variable_item vi
+    JOIN variable_list vl ON vl.id = vi.variable_list_id
+    WHERE vl.name = ?
+"""
+
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def _value_hash(value: Any) -> str:
+    return hashlib.sha1(_canonical(value).encode("utf-8")).hexdigest()
+
+
+def llm_templates(defaults_map: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Optional[str]]:
+    """key path -> llm_template for every LLM-mode key."""
+    dmap = defaults_map if defaults_map is not None else get_defaults_map()
+    return {kp: conf.get("llm_template") for kp, conf in dmap.items() if conf.get("mode") == "LLM"}
+
+
+def take(templates: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    """Pop one ready value per key; keys with an empty reservoir are left out."""
+    out: Dict[str, Any] = {}
+    if not templates:
+        return out
+    with transaction(immediate=True) as conn:
+        for key_path, template in templates.items():
+            row = conn.execute(_SQL_POP, (key_path, template_hash(key_path, template), LLM_MODEL)).fetchone()
+            if row is None:
+                continue
+            conn.execute("DELETE FROM llm_reservoir WHERE id = ?", (row["id"],))
+            out[key_path] = json.loads(row["value"])
+    return out
+
+
+def depth(key_path: str, template: Optional[str] = None) -> int:
+    with get_conn() as conn:
+        return conn.execute(_SQL_DEPTH, (key_path, template_hash(key_path, template), LLM_MODEL)).fetchone()[0]
+
+
+def add_values(key_path: str, template: Optional[str], values: List[Any]) -> int:
+    """Store new candidates; returns how many were kept.
+
+    Values already waiting in the reservoir, and string values that are
+    already items of the key's variable list, are dropped.
+    """
+    thash = template_hash(key_path, template)
+    ts = now_iso()
+    kept = 0
+    with transaction(immediate=True) as conn:
+        existing = {r[0].strip().lower() for r in conn.execute(_SQL_LIST_VALUES, (key_path,))}
+        for value in values:
+            if isinstance(value, str) and value.strip().lower() in existing:
+                continue
+            cur = conn.execute(
+                """
+                INSERT OR IGNORE INTO llm_reservoir(key_path, template_hash, model, value, value_hash, created_at)
+                VALUES(?,?,?,?,?,?)
+                """,
+                (key_path, thash, LLM_MODEL, _canonical(value), _value_hash(value), ts),
+            )
+            kept += cur.rowcount
+    return kept
+
+
+def expire_stale(templates: Dict[str, Optional[str]]) -> int:
+    """Delete values generated from an old template or model, or for keys no longer in LLM mode."""
+    removed = 0
+    with transaction(immediate=True) as conn:
+        for key_path, template in templates.items():
+            removed += conn.execute(_SQL_STALE, (key_path, template_hash(key_path, template), LLM_MODEL)).rowcount
+        if templates:
+            marks = ",".join("?" for _ in templates)
+            removed += conn.execute(f"DELETE FROM llm_reservoir WHERE key_path NOT IN ({marks})", list(templates)).rowcount
+        else:
+            removed += conn.execute("DELETE FROM llm_reservoir").rowcount
+    return removed
+
+
+def refill(target: int = LLM_RESERVOIR_DEPTH, batch: int = LLM_REFILL_BATCH) -> Dict[str, Any]:
+    """Top every LLM-mode key up to `target` ready values.
+
+    Asks for at most `batch` candidates per request and gives up on a key
+    after a request that adds nothing new (LLM unavailable or repeating).
+    """
+    templates = llm_templates()
+    stats: Dict[str, Any] = {"expired": expire_stale(templates), "added": {}}
+    for key_path, template in templates.items():
+        added = 0
+        need = target - depth(key_path, template)
+        while need > 0:
+            kept = add_values(key_path, template, generate_candidates(key_path, template, min(batch, need)))
+            if not kept:
+                break
+            added += kept
+            need -= kept
+        stats["added"][key_path] = added
+    return stats
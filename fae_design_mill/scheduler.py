@@ -1,22 +1,28 @@
 from __future__ import annotations
+import random
 import time
 from datetime import datetime, timedelta
 from typing import Dict, Optional
 
-from .config import DEFAULT_SCHEDULE_HOUR, DEFAULT_PROVIDER, ASSETS_DIR
-import uuid
+from .config import DEFAULT_SCHEDULE_HOUR, DEFAULT_PROVIDER, BACKUP_ON_SCHEDULE, LLM_REFILL_INTERVAL
+from .db import transaction
 from .repositories import (
     create_design_run,
     update_design_run_status,
     insert_prompt_record,
+    update_prompt_record,
     insert_asset_record,
-    log_cooldown,
+    confirm_item_reservations,
+    release_item_reservations,
     get_policy,
     recent_asset_hashes,
 )
-from .prompt.engine import build_prompt, novelty_check, mutate_prompt
+from .prompt.engine import compose_prompt, make_novel, mutate_prompt
+from .prompt.fingerprint import PromptFingerprint
 from .prompt.hashers import phash_gray, dhash_gray
-from .storage.files import save_prompt_json
+from .storage.files import save_prompt
+from .storage.assets import put_file
+from .storage.thumbs import make_thumbnails
 
 
 def _load_provider():
@@ -37,116 +43,161 @@ def _job_key_for(dt: datetime, manual: bool = True) -> str:
     return dt.strftime("%Y-%m-%d")
 
 
-def run_once(force_new: bool = False, random_seed: bool = False) -> Dict[str, str]:
+def run_once(force_new: bool = False, random_seed: bool = False, seed: Optional[int] = None) -> Dict[str, str]:
+    """Generate one design.
+
+    Every random draw of the run comes from its own random.Random seeded with
+    `seed` (fresh when None), stored as design_run.rng_seed: concurrent runs
+    never share generator state, and passing a stored seed back replays the
+    same draws.
+    """
     provider = _load_provider()
     now = datetime.utcnow()
     job_key = _job_key_for(now, manual=True)
-    run_id = create_design_run(job_key=job_key, scheduled_for=now.isoformat())
+    if seed is None:
+        # 53 bits round-trip through JSON clients as exact numbers
+        seed = random.SystemRandom().getrandbits(53)
+    rng = random.Random(seed)
+    run_id = create_design_run(job_key=job_key, scheduled_for=now.isoformat(), rng_seed=seed)
     try:
-        # Build prompt with retries if too similar
         policy = get_policy()
-        attempts = 0
         max_retries = 4
-        attempts = 0
-        while True:
-            prompt, hashes, used_item_ids = build_prompt(design_title="FAE Auto Design")
-            # If requested, mutate proactively to push novelty
-            if force_new:
-                prompt = mutate_prompt(prompt)
-            if random_seed:
-                import random as _r
-                prompt.setdefault("output", {})["seed"] = _r.randint(1, 2**31-1)
-            ok, reason = novelty_check(hashes, policy)
-            if ok:
-                break
-            attempts += 1
-            if attempts > max_retries:
-                update_design_run_status(run_id, "SKIPPED", f"Novelty failure: {reason}")
-                return {"status": "SKIPPED", "reason": reason}
-            # mutate and try again
-            prompt = mutate_prompt(prompt)
-
-        update_design_run_status(run_id, "PROMPTED")
-        # Persist prompt and cooldown logs
+        prompt, used_item_ids = compose_prompt(design_title="FAE Auto Design", rng=rng, run_id=run_id)
+        # Hashes follow every mutation; only the changed fields are re-hashed
+        fingerprint = PromptFingerprint(prompt)
+        # If requested, mutate proactively to push novelty
+        if force_new:
+            prompt, _ = mutate_prompt(prompt, rng, run_id=run_id)
+            fingerprint.update(prompt)
+        if random_seed:
+            prompt.setdefault("output", {})["seed"] = rng.randint(1, 2**31-1)
+        # Gate; on a collision redraw the fields shared with the matched
+        # prompts and gate the result again (redraws are reserved as drawn)
+        verdict, _ = make_novel(prompt, fingerprint, policy, rng, max_retries, run_id=run_id)
+        if not verdict.ok:
+            update_design_run_status(run_id, "SKIPPED", f"Novelty failure: {verdict.reason}")
+            return {"status": "SKIPPED", "reason": verdict.reason}
+        hashes = fingerprint.hashes()
+
+        # Persist prompt, cooldown logs and status in one commit
         canon = json_canonical = None
         from .prompt.canonical import canonical_dump
         json_canonical = canonical_dump(prompt)
-        prompt_rec_id = insert_prompt_record(
-            run_id, prompt, json_canonical, hashes["simhash"], hashes["minhash"], novelty_score=0.6
-        )
-        log_cooldown(used_item_ids)
-        # Save prompt to file
-        save_prompt_json(prompt, f"run_{run_id}_prompt")
-
-        # Image generation and de-dupe
-        img_attempts = 0
-        while True:
-            result = provider.generate(prompt)
-            dh = dhash_gray(result.image_gray)
-            ph = phash_gray(result.image_gray)
-            # compare to recent asset hashes
-            dupe = False
-            for ph_prev, dh_prev in recent_asset_hashes(200):
-                if not ph_prev or not dh_prev:
-                    continue
-                # Hamming distance via int bit_count
-                if ((int(ph_prev, 16) ^ int(ph, 16)).bit_count() <= int(policy.get("image_dupe_threshold", 5))):
-                    dupe = True
-                    break
-            if dupe:
-                img_attempts += 1
-                if img_attempts > max_retries:
-                    update_design_run_status(run_id, "SKIPPED", "Image duplicate threshold reached")
-                    return {"status": "SKIPPED", "reason": "image dupe"}
-                # mutate prompt then re-generate
-                prompt = mutate_prompt(prompt)
-                continue
-            # Ensure a unique filename per run to avoid dashboard collisions/caching
-            try:
-                from pathlib import Path
-                import os
-                src = Path(result.file_path)
-                unique_name = f"run_{run_id}_{uuid.uuid4().hex[:8]}.png"
-                dst = ASSETS_DIR / unique_name
-                if src.resolve() != dst.resolve():
-                    try:
-                        os.replace(str(src), str(dst))
-                    except Exception:
-                        import shutil
-                        shutil.copyfile(str(src), str(dst))
-                        try:
-                            src.unlink()
-                        except Exception:
-                            pass
-                final_path = str(dst)
-            except Exception:
-                final_path = result.file_path
-
-            # Save asset record
-            insert_asset_record(
-                run_id,
-                prompt_rec_id,
-                provider=(policy.get("provider") or DEFAULT_PROVIDER),
-                request_payload={"seed": prompt.get("output", {}).get("seed")},
-                response_payload=result.response_payload or {},
-                file_path=final_path,
-                phash_hex=ph,
-                dhash_hex=dh,
-                width=result.width,
-                height=result.height,
-                dpi=prompt.get("print_spec", {}).get("dpi_target", 300),
+        with transaction():
+            update_design_run_status(run_id, "PROMPTED")
+            prompt_rec_id = insert_prompt_record(
+                run_id, json_canonical, hashes["simhash"], hashes["minhash"], novelty_score=0.6
             )
-            break
+            # The items this run reserved while building become cooldowns
+            confirm_item_reservations(run_id)
+
+        try:
+            # Image generation and de-dupe
+            img_attempts = 0
+            while True:
+                result = provider.generate(prompt)
+                dh = dhash_gray(result.image_gray)
+                ph = phash_gray(result.image_gray)
+                # compare to recent asset hashes
+                dupe = False
+                for ph_prev, dh_prev in recent_asset_hashes(200):
+                    if not ph_prev or not dh_prev:
+                        continue
+                    # Hamming distance via int bit_count
+                    if ((int(ph_prev, 16) ^ int(ph, 16)).bit_count() <= int(policy.get("image_dupe_threshold", 5))):
+                        dupe = True
+                        break
+                if dupe:
+                    img_attempts += 1
+                    if img_attempts > max_retries:
+                        update_design_run_status(run_id, "SKIPPED", "Image duplicate threshold reached")
+                        return {"status": "SKIPPED", "reason": "image dupe"}
+                    # mutate prompt, re-gate it (against everything but its own
+                    # record) before any image work, then re-generate; the
+                    # stored record follows. New draws stay reserved until an
+                    # asset is stored
+                    prompt, _ = mutate_prompt(prompt, rng, run_id=run_id)
+                    fingerprint.update(prompt)
+                    verdict, _ = make_novel(
+                        prompt, fingerprint, policy, rng, max_retries, exclude=prompt_rec_id, run_id=run_id
+                    )
+                    if not verdict.ok:
+                        update_design_run_status(run_id, "SKIPPED", f"Novelty failure: {verdict.reason}")
+                        return {"status": "SKIPPED", "reason": verdict.reason}
+                    hashes = fingerprint.hashes()
+                    update_prompt_record(prompt_rec_id, canonical_dump(prompt), hashes["simhash"], hashes["minhash"])
+                    continue
+                # Move the output into the content-addressed store (dedupes identical bytes)
+                stored = put_file(result.file_path)
+                final_path = str(stored.path)
+                # Small renditions for the dashboard; missing ones are backfilled on demand
+                try:
+                    make_thumbnails(stored.path, stored.content_hash)
+                except Exception:
+                    pass
+
+                # Save asset record
+                with transaction():
+                    insert_asset_record(
+                        run_id,
+                        prompt_rec_id,
+                        provider=(policy.get("provider") or DEFAULT_PROVIDER),
+                        request_payload={"seed": prompt.get("output", {}).get("seed")},
+                        response_payload=result.response_payload or {},
+                        file_path=final_path,
+                        phash_hex=ph,
+                        dhash_hex=dh,
+                        width=result.width,
+                        height=result.height,
+                        dpi=prompt.get("print_spec", {}).get("dpi_target", 300),
+                        file_url=stored.url,
+                        content_hash=stored.content_hash,
+                    )
+                    update_design_run_status(run_id, "GENERATED")
+                    # Items drawn by image-dupe mutations become cooldowns
+                    confirm_item_reservations(run_id)
+                break
+        finally:
+            # Archive (or per-run file, per FAE_PROMPT_STORE) the prompt once
+            # it is final, however image generation ended: one record per run
+            save_prompt(prompt, run_id)
 
-        update_design_run_status(run_id, "GENERATED")
-        return {"status": "GENERATED", "run_id": str(run_id), "file": final_path}
+        return {"status": "GENERATED", "run_id": str(run_id), "file": final_path, "seed": str(seed)}
     except Exception as e:
         update_design_run_status(run_id, "FAILED", str(e))
         return {"status": "FAILED", "error": str(e)}
+    finally:
+        # Skipped or failed before an item's use was confirmed: free it
+        release_item_reservations(run_id)
+
+
+def _scheduled_backup() -> None:
+    # A failed backup must not stop tomorrow's run
+    from .backup import create_backup
+    try:
+        info = create_backup()
+        print(f"Backup {info['path']} ({info['backup_bytes']} bytes, {info['duration_ms']} ms)")
+    except Exception as e:
+        print("Backup failed:", e)
+
+
+def _refill_llm_reservoir() -> None:
+    # Like backups, a failed refill must not stop the scheduler
+    from .llm_cache import purge_expired
+    from .reservoir import refill
+    try:
+        purge_expired()
+        stats = refill()
+        added = sum(stats["added"].values())
+        if added or stats["expired"]:
+            print(f"LLM reservoir: +{added} values, {stats['expired']} expired")
+    except Exception as e:
+        print("LLM reservoir refill failed:", e)
 
 
 def run_scheduler():
-    # Simple loop that waits until next schedule hour, runs once, repeats
+    # Simple loop that waits until next schedule hour, runs once, repeats.
+    # While waiting it tops up the LLM value reservoir every LLM_REFILL_INTERVAL.
     hour = DEFAULT_SCHEDULE_HOUR
     print(f"Scheduler started (hour={hour:02d}:00). Ctrl+C to stop.")
     try:
@@ -158,8 +209,15 @@ def run_scheduler():
             delta = (target - now).total_seconds()
             mins = int(delta // 60)
             print(f"Sleeping {mins} min until {target.isoformat()}")
-            time.sleep(max(5, delta))
+            while True:
+                _refill_llm_reservoir()
+                remaining = (target - datetime.now()).total_seconds()
+                if remaining <= 0:
+                    break
+                time.sleep(max(5, min(remaining, LLM_REFILL_INTERVAL)))
             print("Running scheduled job...")
             print(run_once())
+            if BACKUP_ON_SCHEDULE:
+                _scheduled_backup()
     except KeyboardInterrupt:
         print("Scheduler stopped.")
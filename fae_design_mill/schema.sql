@@ -1,5 +1,7 @@
 PRAGMA foreign_keys=ON;
 
+-- Current schema for fresh databases; upgrades live in db.MIGRATIONS
+
 CREATE TABLE IF NOT EXISTS variable_list (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   name TEXT NOT NULL UNIQUE,
@@ -17,7 +19,9 @@ CREATE TABLE IF NOT EXISTS variable_item (
   FOREIGN KEY(variable_list_id) REFERENCES variable_list(id) ON DELETE CASCADE
 );
 
-CREATE INDEX IF NOT EXISTS idx_variable_item_list ON variable_item(variable_list_id);
+CREATE INDEX IF NOT EXISTS idx_variable_item_list_value ON variable_item(variable_list_id, value);
+CREATE INDEX IF NOT EXISTS idx_variable_item_list_enabled ON variable_item(variable_list_id, enabled);
+CREATE INDEX IF NOT EXISTS idx_variable_item_list_id ON variable_item(variable_list_id, id);
 
 CREATE TABLE IF NOT EXISTS variable_defaults (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -71,23 +75,33 @@ CREATE TABLE IF NOT EXISTS generation_policy (
   provider_params TEXT
 );
 
+-- rng_seed: seed of the run's random.Random (replay with run-once --seed)
 CREATE TABLE IF NOT EXISTS design_run (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   scheduled_for TEXT,
   status TEXT NOT NULL,
   reason TEXT,
   job_key TEXT UNIQUE,
+  rng_seed INTEGER,
   created_at TEXT NOT NULL,
   updated_at TEXT NOT NULL
 );
 
 CREATE INDEX IF NOT EXISTS idx_design_run_status ON design_run(status);
+CREATE INDEX IF NOT EXISTS idx_design_run_created ON design_run(created_at);
+
+-- payload: canonical prompt JSON, zlib-compressed with a preset dictionary
+-- from prompt_dict (payload_codec = 'zd:<prompt_dict.id>')
+CREATE TABLE IF NOT EXISTS prompt_dict (
+  id TEXT PRIMARY KEY,
+  data BLOB NOT NULL
+);
 
 CREATE TABLE IF NOT EXISTS prompt_record (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   design_run_id INTEGER NOT NULL,
-  json_payload TEXT NOT NULL,
-  canonical_str TEXT NOT NULL,
+  payload BLOB NOT NULL,
+  payload_codec TEXT NOT NULL,
   prompt_hash_simhash TEXT,
   prompt_hash_minhash TEXT,
   embedding BLOB,
@@ -96,6 +110,10 @@ CREATE TABLE IF NOT EXISTS prompt_record (
   FOREIGN KEY(design_run_id) REFERENCES design_run(id) ON DELETE CASCADE
 );
 
+CREATE INDEX IF NOT EXISTS idx_prompt_record_run ON prompt_record(design_run_id);
+-- prompt_fts (FTS5) and its delete trigger are created by migration 7, which
+-- is skipped on SQLite builds without FTS5; rows are written by the repository
+
 CREATE TABLE IF NOT EXISTS asset_record (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   design_run_id INTEGER NOT NULL,
@@ -111,12 +129,22 @@ CREATE TABLE IF NOT EXISTS asset_record (
   height INTEGER,
   dpi INTEGER,
   created_at TEXT NOT NULL,
+  content_hash TEXT,
   FOREIGN KEY(design_run_id) REFERENCES design_run(id) ON DELETE CASCADE,
   FOREIGN KEY(prompt_record_id) REFERENCES prompt_record(id) ON DELETE CASCADE
 );
 
+CREATE INDEX IF NOT EXISTS idx_asset_record_run ON asset_record(design_run_id);
+CREATE INDEX IF NOT EXISTS idx_asset_record_provider_run ON asset_record(provider, design_run_id);
 CREATE INDEX IF NOT EXISTS idx_asset_hashes ON asset_record(image_hash_phash, image_hash_dhash);
 
+-- Legacy flat asset names (run_<id>_<uuid>.png) mapped to their content address
+CREATE TABLE IF NOT EXISTS asset_alias (
+  name TEXT PRIMARY KEY,
+  content_hash TEXT NOT NULL,
+  relpath TEXT NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS cooldown_log (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   variable_item_id INTEGER NOT NULL,
@@ -124,9 +152,52 @@ CREATE TABLE IF NOT EXISTS cooldown_log (
   FOREIGN KEY(variable_item_id) REFERENCES variable_item(id) ON DELETE CASCADE
 );
 
+CREATE INDEX IF NOT EXISTS idx_cooldown_item_used ON cooldown_log(variable_item_id, used_at);
+
+-- Items drawn by a run still in flight; other builds skip them until they
+-- expire, are released, or become cooldown_log rows
+CREATE TABLE IF NOT EXISTS item_reservation (
+  design_run_id INTEGER NOT NULL,
+  variable_item_id INTEGER NOT NULL,
+  expires_at TEXT NOT NULL,
+  PRIMARY KEY(design_run_id, variable_item_id),
+  FOREIGN KEY(variable_item_id) REFERENCES variable_item(id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_item_reservation_expires ON item_reservation(expires_at);
+
 CREATE TABLE IF NOT EXISTS series_template (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   name TEXT NOT NULL UNIQUE,
   description TEXT,
   json_patch TEXT
 );
+
+-- One row per online backup (see backup.py); pruned files keep their row so
+-- size and duration history survives retention
+CREATE TABLE IF NOT EXISTS backup_log (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  created_at TEXT NOT NULL,
+  path TEXT NOT NULL,
+  compressed INTEGER NOT NULL DEFAULT 0,
+  db_bytes INTEGER NOT NULL,
+  backup_bytes INTEGER NOT NULL,
+  duration_ms INTEGER NOT NULL
+);
+
+-- Pre-generated LLM-mode values (see reservoir.py), consumed oldest first;
+-- rows only match while the key's template and the model are unchanged
+CREATE TABLE IF NOT EXISTS llm_reservoir (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  key_path TEXT NOT NULL,
+  template_hash TEXT NOT NULL,
+  model TEXT NOT NULL,
+  value TEXT NOT NULL,
+  value_hash TEXT NOT NULL,
+  created_at TEXT NOT NULL,
+  UNIQUE(key_path, template_hash, model, value_hash)
+);
+CREATE INDEX IF NOT EXISTS idx_llm_reservoir_pop ON llm_reservoir(key_path, template_hash, model, id);
+
+-- config_generation and the triggers that bump it on writes to the config
+-- tables are created by migration 9
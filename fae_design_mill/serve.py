@@ -0,0 +1,115 @@
+from __future__ import annotations
+import multiprocessing
+import signal
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+try:
+    import gunicorn  # noqa: F401  (optional: pip install gunicorn)
+except ImportError:
+    gunicorn = None  # type: ignore
+
+from .config import (
+    SERVE_GRACEFUL_TIMEOUT,
+    SERVE_MAX_REQUESTS,
+    SERVE_SCHEDULER,
+    SERVE_THREADS,
+    SERVE_TIMEOUT,
+    SERVE_WORKERS,
+)
+from .db import close_all, init_db
+
+
+# Production serving. The parent process is a small supervisor: it runs the
+# schema migrations once, then starts
+#   - gunicorn (fae_design_mill.wsgi:app) with N workers x T threads, and
+#   - one background process running the scheduler,
+# and forwards signals to them. gunicorn runs as its own process because its
+# arbiter reaps every child it has, which would swallow the background one.
+#   SIGHUP          graceful reload of the gunicorn workers
+#   SIGTERM/SIGINT  graceful shutdown of both
+
+_RESTART_DELAY = 5.0
+
+
+def gunicorn_command(host: str, port: int, workers: int = SERVE_WORKERS, threads: int = SERVE_THREADS,
+                     timeout: int = SERVE_TIMEOUT, graceful_timeout: int = SERVE_GRACEFUL_TIMEOUT,
+                     max_requests: int = SERVE_MAX_REQUESTS) -> List[str]:
+    cmd = [
+        sys.executable, "-m", "gunicorn",
+        "--bind", f"{host}:{port}",
+        "--workers", str(max(1, workers)),
+        "--threads", str(max(1, threads)),
+        # gthread keeps the heartbeat on the worker's main loop, so long
+        # streamed exports and downloads are not mistaken for a hung worker
+        "--worker-class", "gthread",
+        "--timeout", str(timeout),
+        "--graceful-timeout", str(graceful_timeout),
+        "--access-logfile", "-",
+    ]
+    if max_requests > 0:
+        cmd += ["--max-requests", str(max_requests), "--max-requests-jitter", str(max(1, max_requests // 10))]
+    return cmd + ["fae_design_mill.wsgi:app"]
+
+
+def _background_main() -> None:
+    from .scheduler import run_scheduler
+
+    def _stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    run_scheduler()
+
+
+def _start_background() -> multiprocessing.Process:
+    proc = multiprocessing.Process(target=_background_main, name="fae-background", daemon=False)
+    proc.start()
+    return proc
+
+
+def serve_production(host: str, port: int, workers: int = SERVE_WORKERS, threads: int = SERVE_THREADS,
+                     timeout: int = SERVE_TIMEOUT, graceful_timeout: int = SERVE_GRACEFUL_TIMEOUT,
+                     max_requests: int = SERVE_MAX_REQUESTS, scheduler: bool = SERVE_SCHEDULER) -> int:
+    """Run gunicorn plus the background process until told to stop; returns the exit code."""
+    if gunicorn is None:
+        print("Production serving needs gunicorn: pip install gunicorn")
+        return 1
+    init_db()
+    # Nothing SQLite-related may cross the fork into the children
+    close_all()
+
+    background: Optional[multiprocessing.Process] = _start_background() if scheduler else None
+    server = subprocess.Popen(gunicorn_command(host, port, workers, threads, timeout, graceful_timeout, max_requests))
+    stopping = False
+
+    def _forward(signum, frame):
+        nonlocal stopping
+        if signum == signal.SIGHUP:
+            server.send_signal(signal.SIGHUP)
+            return
+        stopping = True
+        server.send_signal(signal.SIGTERM)
+        if background is not None and background.is_alive():
+            background.terminate()
+
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(sig, _forward)
+
+    try:
+        while server.poll() is None:
+            if background is not None and not background.is_alive() and not stopping:
+                print(f"Background process exited ({background.exitcode}); restarting in {_RESTART_DELAY:.0f}s")
+                time.sleep(_RESTART_DELAY)
+                if not stopping:
+                    background = _start_background()
+            time.sleep(0.5)
+    finally:
+        if background is not None:
+            if background.is_alive():
+                background.terminate()
+            background.join(graceful_timeout)
+    return server.returncode or 0
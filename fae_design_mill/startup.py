@@ -0,0 +1,99 @@
+from __future__ import annotations
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+from .config import ROOT_DIR
+
+
+# Start-up checks for the CLI. The probe imports what `manage.py run-once`
+# loads before doing any work, in a fresh interpreter. A module that should
+# only load on first use (provider SDKs, Flask, Pillow) showing up is an
+# error. Import time is measured under `python -X importtime` relative to
+# importing the DB layer alone on the same machine, because absolute
+# timings vary too much between runs and runners to gate on; going over the
+# ratio budget is a warning unless checked strictly.
+
+STARTUP_PROBE = "import manage, fae_design_mill.scheduler"
+STARTUP_REFERENCE = "import fae_design_mill.db"
+STARTUP_BUDGET_RATIO = float(os.getenv("FAE_STARTUP_BUDGET_RATIO", "3.5"))
+LAZY_MODULES = ("openai", "httpx", "pydantic", "flask", "werkzeug", "jinja2", "PIL")
+
+
+def measure_startup(probe: str = STARTUP_PROBE, runs: int = 3) -> Tuple[float, Dict[str, float]]:
+    """Best-of-`runs` total import time (ms) and per top-level module times.
+
+    Interpreter start-up imports (site, encodings, ...) are excluded.
+    """
+    best: Tuple[float, Dict[str, float]] = (float("inf"), {})
+    baseline = _top_level(_importtime("pass"))
+    for _ in range(max(1, runs)):
+        mods = {k: v for k, v in _top_level(_importtime(probe)).items() if k not in baseline}
+        total = sum(mods.values())
+        if total < best[0]:
+            best = (total, mods)
+    return best
+
+
+def measure_relative(probe: str = STARTUP_PROBE, reference: str = STARTUP_REFERENCE,
+                     runs: int = 5) -> Tuple[float, float, Dict[str, float]]:
+    """Best-of-`runs` import time (ms) of probe and of reference, measured in
+    alternation so both see the same machine load, plus the probe's
+    per-module times."""
+    probe_best: Tuple[float, Dict[str, float]] = (float("inf"), {})
+    ref_best = float("inf")
+    for _ in range(max(1, runs)):
+        probe_best = min(probe_best, measure_startup(probe, runs=1), key=lambda r: r[0])
+        ref_best = min(ref_best, measure_startup(reference, runs=1)[0])
+    return probe_best[0], ref_best, probe_best[1]
+
+
+def _importtime(code: str) -> str:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=str(ROOT_DIR), capture_output=True, text=True, check=True,
+    )
+    return proc.stderr
+
+
+def _top_level(report: str) -> Dict[str, float]:
+    # "import time: self [us] | cumulative | imported package"; nesting is
+    # shown by indenting the name, top-level imports have one space
+    out: Dict[str, float] = {}
+    for line in report.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2]
+        if len(name) - len(name.lstrip()) == 1:
+            out[name.strip()] = int(parts[1]) / 1000.0
+    return out
+
+
+def loaded_lazy_modules(probe: str = STARTUP_PROBE) -> List[str]:
+    code = f"{probe}\nimport sys\nprint(' '.join(sorted(sys.modules)))"
+    proc = subprocess.run([sys.executable, "-c", code], cwd=str(ROOT_DIR), capture_output=True, text=True, check=True)
+    loaded = set(proc.stdout.split())
+    return [m for m in LAZY_MODULES if m in loaded]
+
+
+def check_startup(budget_ratio: float = STARTUP_BUDGET_RATIO) -> Tuple[float, float, List[str], List[str]]:
+    """Probe import time (ms), its ratio to the reference import, the errors
+    found (eagerly loaded modules) and warnings (over the ratio budget)."""
+    problems = [
+        f"{mod} is imported at start-up; import it on first use (fae_design_mill.lazy)"
+        for mod in loaded_lazy_modules()
+    ]
+    warnings: List[str] = []
+    total, ref, mods = measure_relative()
+    ratio = total / ref if ref else float("inf")
+    if ratio > budget_ratio:
+        slowest = sorted(mods.items(), key=lambda kv: kv[1], reverse=True)[:5]
+        warnings.append(
+            f"imports take {total:.0f} ms, {ratio:.1f}x `{STARTUP_REFERENCE}` ({ref:.0f} ms; "
+            f"budget {budget_ratio:.1f}x); slowest: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in slowest)
+        )
+    return total, ratio, problems, warnings
@@ -0,0 +1,102 @@
+from __future__ import annotations
+import gzip
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process lock only
+    fcntl = None  # type: ignore
+
+from ..config import PROMPT_ARCHIVE_DIR
+
+
+# Append-only prompt archive. One segment per UTC day:
+#   YYYY-MM-DD.jsonl.gz  each record is its own gzip member holding one compact
+#                        JSON line, so the file is still a valid .gz stream
+#   YYYY-MM-DD.idx       "run_id<TAB>offset<TAB>length" per record for random access
+# The scheduler appends one record per run, once its prompt is final. Should a
+# run appear more than once, lookups return its newest record; iter_prompts()
+# yields every record as stored.
+
+_lock = threading.Lock()
+_index_cache: Dict[Path, Tuple[int, Dict[int, Tuple[int, int]]]] = {}
+
+
+def _segment(day: str) -> Tuple[Path, Path]:
+    return PROMPT_ARCHIVE_DIR / f"{day}.jsonl.gz", PROMPT_ARCHIVE_DIR / f"{day}.idx"
+
+
+def append_prompt(run_id: int, prompt_json: Dict[str, Any], when: Optional[datetime] = None) -> Path:
+    day = (when or datetime.utcnow()).strftime("%Y-%m-%d")
+    seg, idx = _segment(day)
+    line = json.dumps({"run_id": run_id, "prompt": prompt_json}, separators=(",", ":")) + "\n"
+    member = gzip.compress(line.encode("utf-8"), compresslevel=6, mtime=0)
+    PROMPT_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    with _lock, open(seg, "ab") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            offset = f.seek(0, 2)
+            f.write(member)
+            f.flush()
+            with open(idx, "a", encoding="utf-8") as fi:
+                fi.write(f"{run_id}\t{offset}\t{len(member)}\n")
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    return seg
+
+
+def _load_index(idx: Path) -> Dict[int, Tuple[int, int]]:
+    mtime = idx.stat().st_mtime_ns
+    cached = _index_cache.get(idx)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    entries: Dict[int, Tuple[int, int]] = {}
+    with open(idx, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split("\t")
+            if len(parts) == 3:
+                entries[int(parts[0])] = (int(parts[1]), int(parts[2]))
+    _index_cache[idx] = (mtime, entries)
+    return entries
+
+
+def lookup_prompt(run_id: int) -> Optional[Dict[str, Any]]:
+    """Random-access read of one run's prompt via the segment indexes.
+
+    Returns the run's newest record: segments are searched newest day first
+    and a later index line for the same run replaces an earlier one.
+    """
+    if not PROMPT_ARCHIVE_DIR.exists():
+        return None
+    for idx in sorted(PROMPT_ARCHIVE_DIR.glob("*.idx"), reverse=True):
+        hit = _load_index(idx).get(run_id)
+        if hit is None:
+            continue
+        offset, length = hit
+        with open(idx.with_name(idx.stem + ".jsonl.gz"), "rb") as f:
+            f.seek(offset)
+            rec = json.loads(gzip.decompress(f.read(length)))
+        if rec.get("run_id") == run_id:
+            return rec["prompt"]
+    return None
+
+
+def iter_prompts(since: Optional[str] = None, until: Optional[str] = None) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Stream (run_id, prompt) from segments whose day is within [since, until]."""
+    if not PROMPT_ARCHIVE_DIR.exists():
+        return
+    for seg in sorted(PROMPT_ARCHIVE_DIR.glob("*.jsonl.gz")):
+        day = seg.name[:10]
+        if (since and day < since[:10]) or (until and day > until[:10]):
+            continue
+        with gzip.open(seg, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    yield rec["run_id"], rec["prompt"]
@@ -0,0 +1,152 @@
+from __future__ import annotations
+import hashlib
+import os
+import re
+import shutil
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from ..config import ASSETS_DIR
+from ..db import get_conn
+
+
+# Blobs are stored under a sha256 content address with two-level sharding:
+#   ASSETS_DIR/ab/cd/abcd...ef.png
+# Byte-identical outputs share one file; the number of asset_record rows with
+# the same content_hash is the blob's reference count.
+
+_CHUNK = 1 << 20
+_LEGACY_EXTS = {".png", ".webp", ".jpg", ".jpeg"}
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+@dataclass
+class StoredAsset:
+    content_hash: str
+    path: Path
+    relpath: str
+    url: str
+    created: bool  # False when an identical blob was already stored
+
+
+def file_sha256(path: Path | str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=4096)
+def _cached_sha256(path: str, mtime_ns: int, size: int) -> str:
+    return file_sha256(path)
+
+
+def content_hash_for(relpath: str) -> str:
+    """Content hash of a file under ASSETS_DIR (free for content addresses)."""
+    stem = os.path.splitext(os.path.basename(relpath))[0]
+    if _HASH_RE.match(stem):
+        return stem
+    full = ASSETS_DIR / relpath
+    st = full.stat()
+    return _cached_sha256(str(full), st.st_mtime_ns, st.st_size)
+
+
+def blob_relpath(content_hash: str, ext: str = ".png") -> str:
+    return f"{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{ext}"
+
+
+def asset_url(relpath: str) -> str:
+    return f"/assets/{relpath}"
+
+
+def put_file(src: Path | str, ext: Optional[str] = None, content_hash: Optional[str] = None) -> StoredAsset:
+    """Move a freshly written file into the content-addressed store.
+
+    If an identical blob already exists the source file is discarded and the
+    existing blob is returned.
+    """
+    src = Path(src)
+    digest = content_hash or file_sha256(src)
+    rel = blob_relpath(digest, (ext or src.suffix or ".png").lower())
+    dst = ASSETS_DIR / rel
+    created = False
+    if dst.exists():
+        if src.resolve() != dst.resolve():
+            try:
+                src.unlink()
+            except Exception:
+                pass
+    else:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(str(src), str(dst))
+        except Exception:
+            shutil.copyfile(str(src), str(dst))
+            try:
+                src.unlink()
+            except Exception:
+                pass
+        created = True
+    return StoredAsset(content_hash=digest, path=dst, relpath=rel, url=asset_url(rel), created=created)
+
+
+def resolve_asset(filename: str) -> Optional[str]:
+    """Map a requested /assets/<filename> to a path relative to ASSETS_DIR.
+
+    Content addresses and not-yet-migrated flat files are served as-is; legacy
+    run_<id>_<uuid>.png names are looked up in asset_alias after migration.
+    """
+    if filename.startswith("/") or ".." in filename.replace("\\", "/").split("/"):
+        return None
+    if (ASSETS_DIR / filename).is_file():
+        return filename
+    name = os.path.basename(filename)
+    with get_conn() as conn:
+        row = conn.execute("SELECT relpath FROM asset_alias WHERE name = ?", (name,)).fetchone()
+    return row["relpath"] if row else None
+
+
+def migrate_legacy_assets() -> Dict[str, int]:
+    """Move flat files in ASSETS_DIR into the sharded store.
+
+    Each legacy name is recorded in asset_alias so old /assets/<name> URLs keep
+    working, and matching asset_record rows are repointed at the new blob.
+    """
+    stats = {"files": 0, "deduped": 0, "records": 0}
+    if not ASSETS_DIR.exists():
+        return stats
+    legacy: List[Path] = [
+        p for p in ASSETS_DIR.iterdir()
+        if p.is_file() and p.suffix.lower() in _LEGACY_EXTS
+    ]
+    if not legacy:
+        return stats
+    with get_conn() as conn:
+        by_name: Dict[str, List[int]] = {}
+        cur = conn.execute("SELECT id, file_path FROM asset_record WHERE content_hash IS NULL AND file_path IS NOT NULL")
+        for r in cur.fetchall():
+            by_name.setdefault(os.path.basename(r["file_path"]), []).append(r["id"])
+        for p in legacy:
+            # Repoint the DB first so an interrupted migration can simply be re-run
+            digest = file_sha256(p)
+            rel = blob_relpath(digest, p.suffix.lower())
+            conn.execute(
+                "INSERT OR REPLACE INTO asset_alias(name, content_hash, relpath) VALUES(?,?,?)",
+                (p.name, digest, rel),
+            )
+            ids = by_name.get(p.name, [])
+            if ids:
+                conn.executemany(
+                    "UPDATE asset_record SET file_path=?, file_url=?, content_hash=? WHERE id=?",
+                    [(str(ASSETS_DIR / rel), asset_url(rel), digest, i) for i in ids],
+                )
+                stats["records"] += len(ids)
+            conn.commit()
+            stored = put_file(p, content_hash=digest)
+            stats["files"] += 1
+            if not stored.created:
+                stats["deduped"] += 1
+    return stats
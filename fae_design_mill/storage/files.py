@@ -3,7 +3,8 @@ import json
 from pathlib import Path
 from typing import Any, Dict
 
-from ..config import PROMPTS_DIR
+from ..config import PROMPTS_DIR, PROMPT_STORE
+from .archive import append_prompt
 
 
 def save_prompt_json(prompt_json: Dict[str, Any], basename: str) -> Path:
@@ -11,3 +12,10 @@ def save_prompt_json(prompt_json: Dict[str, Any], basename: str) -> Path:
     out.write_text(json.dumps(prompt_json, indent=2), encoding="utf-8")
     return out
 
+
+def save_prompt(prompt_json: Dict[str, Any], run_id: int) -> Path:
+    # "files" keeps the legacy one-JSON-per-run layout; default is the archive
+    if PROMPT_STORE == "files":
+        return save_prompt_json(prompt_json, f"run_{run_id}_prompt")
+    return append_prompt(run_id, prompt_json)
+
@@ -0,0 +1,215 @@
+from __future__ import annotations
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..config import ASSETS_DIR, THUMBS_DIR, THUMB_SIZES
+from ..db import get_conn
+from ..lazy import optional_import
+
+
+# Thumbnails are keyed by the source blob's content hash and size, so once
+# written they never change: THUMBS_DIR/<size>/ab/cd/<sha256>.png
+
+
+def thumb_relpath(content_hash: str, size: int) -> str:
+    return f"{size}/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}.png"
+
+
+def thumb_url(content_hash: str, size: int) -> str:
+    return f"/thumbs/{thumb_relpath(content_hash, size)}"
+
+
+def thumb_urls(content_hash: str) -> Dict[str, str]:
+    return {str(s): thumb_url(content_hash, s) for s in THUMB_SIZES}
+
+
+def parse_thumb_relpath(relpath: str) -> Optional[Tuple[str, int]]:
+    """Return (content_hash, size) for a THUMBS_DIR-relative path, if well formed."""
+    parts = relpath.split("/")
+    if len(parts) != 4 or not parts[0].isdigit() or not parts[3].endswith(".png"):
+        return None
+    content_hash = parts[3][:-4]
+    size = int(parts[0])
+    if size not in THUMB_SIZES or len(content_hash) != 64:
+        return None
+    if parts[1] != content_hash[:2] or parts[2] != content_hash[2:4]:
+        return None
+    return content_hash, size
+
+
+def _blob_for(content_hash: str) -> Optional[Path]:
+    shard = ASSETS_DIR / content_hash[:2] / content_hash[2:4]
+    if not shard.is_dir():
+        return None
+    for p in shard.glob(f"{content_hash}.*"):
+        return p
+    return None
+
+
+def make_thumbnails(src: Path | str, content_hash: str, sizes: Iterable[int] = THUMB_SIZES) -> Dict[int, Path]:
+    """Write missing renditions of one asset; returns {size: path}."""
+    src = Path(src)
+    out: Dict[int, Path] = {}
+    todo: List[int] = []
+    for size in sizes:
+        dst = THUMBS_DIR / thumb_relpath(content_hash, size)
+        out[size] = dst
+        if not dst.exists():
+            todo.append(size)
+    if not todo:
+        return out
+    # Pillow is optional and loaded on first use; without it the pure-python
+    # PNG path below is used
+    Image = optional_import("PIL.Image")
+    if Image is not None:
+        with Image.open(src) as im:
+            im.load()
+            for size in todo:
+                rendition = im.copy()
+                rendition.thumbnail((size, size))
+                _atomic_write(out[size], lambda p: rendition.save(p, format="PNG", optimize=True))
+        return out
+    decoded = _read_png(src)
+    if decoded is None:
+        raise RuntimeError(f"Cannot decode {src.name} without Pillow")
+    width, height, color_type, rows = decoded
+    for size in todo:
+        tw, th, trows = _resize_nn(width, height, _CHANNELS[color_type], rows, size)
+        _atomic_write(out[size], lambda p: _write_png(p, tw, th, color_type, trows))
+    return out
+
+
+def ensure_thumbnail(content_hash: str, size: int) -> Optional[Path]:
+    """Return the rendition path, generating it from the stored blob on demand."""
+    dst = THUMBS_DIR / thumb_relpath(content_hash, size)
+    if dst.exists():
+        return dst
+    src = _blob_for(content_hash)
+    if src is None:
+        return None
+    return make_thumbnails(src, content_hash, [size]).get(size)
+
+
+def backfill_thumbnails() -> Dict[str, int]:
+    """Generate renditions for every stored asset that is missing one."""
+    stats = {"assets": 0, "failed": 0}
+    with get_conn() as conn:
+        cur = conn.execute(
+            "SELECT DISTINCT content_hash, file_path FROM asset_record WHERE content_hash IS NOT NULL"
+        )
+        rows = [(r["content_hash"], r["file_path"]) for r in cur.fetchall()]
+    for content_hash, file_path in rows:
+        src = Path(file_path) if file_path and Path(file_path).exists() else _blob_for(content_hash)
+        if src is None:
+            stats["failed"] += 1
+            continue
+        try:
+            make_thumbnails(src, content_hash)
+            stats["assets"] += 1
+        except Exception:
+            stats["failed"] += 1
+    return stats
+
+
+def _atomic_write(dst: Path, write) -> None:
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    # Unique per writer: concurrent requests for one rendition each finish
+    # their own file, and the last replace() wins with identical bytes
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}_{threading.get_ident()}.tmp")
+    try:
+        write(tmp)
+        tmp.replace(dst)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+# Minimal PNG codec for installs without Pillow: 8-bit, non-interlaced
+# grayscale / gray+alpha / RGB / RGBA, which covers provider outputs.
+
+_CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}
+
+
+def _read_png(path: Path) -> Optional[Tuple[int, int, int, List[bytes]]]:
+    data = path.read_bytes()
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        return None
+    pos = 8
+    width = height = color_type = 0
+    idat = bytearray()
+    while pos < len(data):
+        (length,) = struct.unpack("!I", data[pos:pos + 4])
+        ctype = data[pos + 4:pos + 8]
+        body = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if ctype == b"IHDR":
+            width, height, depth, color_type, _, _, interlace = struct.unpack("!IIBBBBB", body)
+            if depth != 8 or interlace or color_type not in _CHANNELS:
+                return None
+        elif ctype == b"IDAT":
+            idat.extend(body)
+        elif ctype == b"IEND":
+            break
+    bpp = _CHANNELS[color_type]
+    stride = width * bpp
+    raw = zlib.decompress(bytes(idat))
+    rows: List[bytes] = []
+    prev = bytearray(stride)
+    for y in range(height):
+        off = y * (stride + 1)
+        ftype = raw[off]
+        line = bytearray(raw[off + 1:off + 1 + stride])
+        if ftype == 1:
+            for i in range(bpp, stride):
+                line[i] = (line[i] + line[i - bpp]) & 0xFF
+        elif ftype == 2:
+            for i in range(stride):
+                line[i] = (line[i] + prev[i]) & 0xFF
+        elif ftype == 3:
+            for i in range(stride):
+                left = line[i - bpp] if i >= bpp else 0
+                line[i] = (line[i] + ((left + prev[i]) >> 1)) & 0xFF
+        elif ftype == 4:
+            for i in range(stride):
+                a = line[i - bpp] if i >= bpp else 0
+                b = prev[i]
+                c = prev[i - bpp] if i >= bpp else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                pred = a if (pa <= pb and pa <= pc) else (b if pb <= pc else c)
+                line[i] = (line[i] + pred) & 0xFF
+        rows.append(bytes(line))
+        prev = line
+    return width, height, color_type, rows
+
+
+def _resize_nn(width: int, height: int, bpp: int, rows: List[bytes], size: int) -> Tuple[int, int, List[bytes]]:
+    scale = min(1.0, size / max(width, height, 1))
+    tw, th = max(1, int(width * scale)), max(1, int(height * scale))
+    cols = [min(width - 1, int(x * width / tw)) * bpp for x in range(tw)]
+    out: List[bytes] = []
+    for y in range(th):
+        src = rows[min(height - 1, int(y * height / th))]
+        line = bytearray()
+        for c in cols:
+            line.extend(src[c:c + bpp])
+        out.append(bytes(line))
+    return tw, th, out
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack("!I", len(data)) + chunk_type + data + struct.pack("!I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF)
+
+
+def _write_png(path: Path, width: int, height: int, color_type: int, rows: List[bytes]) -> None:
+    raw = b"".join(b"\x00" + r for r in rows)
+    path.write_bytes(
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", struct.pack("!IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(raw, 9))
+        + _png_chunk(b"IEND", b"")
+    )
@@ -0,0 +1,9 @@
+"""WSGI entry point for gunicorn and other servers: fae_design_mill.wsgi:app
+
+Migrations are not run here; `manage.py serve --prod` runs them once before
+starting workers. Run `manage.py init-db` first when serving this module
+some other way.
+"""
+from .app import create_app
+
+app = create_app(run_migrations=False)
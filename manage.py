@@ -5,14 +5,15 @@ from pathlib import Path
 
 from fae_design_mill import config
 from fae_design_mill.db import init_db
-from fae_design_mill.repositories import seed_initial_data
-from fae_design_mill.scheduler import run_once, run_scheduler
+
+# Everything past config/db is imported inside the command that needs it, so
+# a cron-driven command only loads what it runs (see `check-startup`).
 
 
 def serve(host: str, port: int):
     try:
         from fae_design_mill.app import create_app
-        app = create_app()
+        app = create_app(run_migrations=False)
     except Exception as e:
         print("Flask server not available or failed to initialize:", e)
         print("Install dependencies: pip install -r requirements.txt")
@@ -28,12 +29,56 @@ def main():
     sub.add_parser("seed", help="Seed initial variable lists and policy")
     sub.add_parser("seed-all-lists", help="Seed comprehensive options for most variables")
     sub.add_parser("scaffold-lists", help="Ensure a variable_list exists for each key path in defaults")
-    sub.add_parser("run-once", help="Run a single generation now")
+    ponce = sub.add_parser("run-once", help="Run a single generation now")
+    ponce.add_argument("--seed", type=int, help="Replay a run: reuse its design_run.rng_seed")
     sub.add_parser("run-scheduler", help="Run the daily scheduler in foreground")
+    sub.add_parser("migrate-assets", help="Move flat asset files into the content-addressed store")
+    sub.add_parser("check-plans", help="Fail if a hot repository query plans a full table scan")
+    pstart = sub.add_parser("check-startup", help="Fail if CLI imports load SDKs eagerly; warn when import time is over budget")
+    pstart.add_argument("--budget-ratio", type=float, help="Override FAE_STARTUP_BUDGET_RATIO")
+    pstart.add_argument("--strict", action="store_true", help="Fail, rather than warn, when over the time budget")
+    prefill = sub.add_parser("refill-llm", help="Top up pre-generated values for LLM-mode keys")
+    prefill.add_argument("--depth", type=int, default=config.LLM_RESERVOIR_DEPTH, help="Ready values per key (default %(default)s)")
+    pcache = sub.add_parser("llm-cache", help="Show LLM reply cache hit rate and size")
+    pcache.add_argument("--purge", action="store_true", help="Delete replies older than FAE_LLM_CACHE_TTL first")
+    pcache.add_argument("--clear", action="store_true", help="Delete every cached reply and reset the counters")
+    sub.add_parser("thumbs", help="Backfill dashboard thumbnails for stored assets")
+    sub.add_parser("rebuild-search", help="Re-index every stored prompt for full-text search")
+    pexp = sub.add_parser("export-prompts", help="Stream archived prompts as JSONL to stdout")
+    pexp.add_argument("--since", help="First day (YYYY-MM-DD)")
+    pexp.add_argument("--until", help="Last day (YYYY-MM-DD)")
+
+    pimp = sub.add_parser("import-items", help="Bulk import items into a variable list from JSON, CSV or JSONL")
+    pimp.add_argument("list_name")
+    pimp.add_argument("file", help="Path to the file, or - for stdin")
+    pimp.add_argument("--format", choices=["json", "csv", "jsonl"], help="Defaults to the file extension")
+    pimp.add_argument("--weight", type=float, default=1.0)
+    pimp.add_argument("--cooldown-days", type=int, default=0)
+    pimp.add_argument("--disabled", action="store_true", help="Import items disabled")
+    pimp.add_argument("--tags", default="", help="Comma-separated tags for rows without their own")
+
+    pexr = sub.add_parser("export", help="Stream runs with their prompt and asset metadata as JSONL or CSV")
+    pexr.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    pexr.add_argument("--since", help="First day or timestamp (run created_at)")
+    pexr.add_argument("--until", help="Last day (inclusive) or timestamp")
+    pexr.add_argument("--status", help="Only runs with this status, e.g. GENERATED")
+    pexr.add_argument("--no-prompt", action="store_true", help="Leave out the prompt JSON")
+    pexr.add_argument("--output", "-o", help="File to write (default stdout)")
 
-    pserve = sub.add_parser("serve", help="Start Flask API/UI")
+    pbak = sub.add_parser("backup", help="Online backup of the SQLite database into data/backups")
+    pbak.add_argument("--no-compress", action="store_true", help="Write a plain .db instead of .db.gz")
+    pbak.add_argument("--keep", type=int, default=config.BACKUP_KEEP, help="Backups to retain (default %(default)s)")
+
+    pserve = sub.add_parser("serve", help="Start Flask API/UI (dev server unless --prod)")
     pserve.add_argument("--host", default="127.0.0.1")
     pserve.add_argument("--port", default=5000, type=int)
+    pserve.add_argument("--prod", action="store_true", help="Serve with gunicorn workers and a background scheduler process")
+    pserve.add_argument("--workers", type=int, default=config.SERVE_WORKERS, help="Worker processes (default %(default)s)")
+    pserve.add_argument("--threads", type=int, default=config.SERVE_THREADS, help="Threads per worker (default %(default)s)")
+    pserve.add_argument("--timeout", type=int, default=config.SERVE_TIMEOUT, help="Seconds before an unresponsive worker is restarted")
+    pserve.add_argument("--graceful-timeout", type=int, default=config.SERVE_GRACEFUL_TIMEOUT, help="Seconds in-flight requests get on reload/shutdown")
+    pserve.add_argument("--max-requests", type=int, default=config.SERVE_MAX_REQUESTS, help="Recycle a worker after this many requests (0 = never)")
+    pserve.add_argument("--no-scheduler", action="store_true", help="Do not start the background scheduler process")
 
     args = parser.parse_args()
 
@@ -47,6 +92,7 @@ def main():
         print(f"DB initialized at {config.DB_PATH}")
     elif args.cmd == "seed":
         init_db()
+        from fae_design_mill.repositories import seed_initial_data
         count = seed_initial_data()
         print(f"Seeded {count} items (lists + defaults + policy)")
     elif args.cmd == "scaffold-lists":
@@ -56,14 +102,137 @@ def main():
         print(f"Ensured lists for {n} key paths")
     elif args.cmd == "run-once":
         init_db()
-        result = run_once()
+        from fae_design_mill.scheduler import run_once
+        result = run_once(seed=args.seed)
         print("Run result:", result)
     elif args.cmd == "run-scheduler":
         init_db()
+        from fae_design_mill.scheduler import run_scheduler
         run_scheduler()
     elif args.cmd == "serve":
+        if args.prod:
+            from fae_design_mill.serve import serve_production
+            sys.exit(serve_production(
+                args.host,
+                args.port,
+                workers=args.workers,
+                threads=args.threads,
+                timeout=args.timeout,
+                graceful_timeout=args.graceful_timeout,
+                max_requests=args.max_requests,
+                scheduler=config.SERVE_SCHEDULER and not args.no_scheduler,
+            ))
         init_db()
         serve(args.host, args.port)
+    elif args.cmd == "migrate-assets":
+        init_db()
+        from fae_design_mill.storage.assets import migrate_legacy_assets
+        stats = migrate_legacy_assets()
+        print(f"Migrated {stats['files']} files ({stats['deduped']} duplicates), repointed {stats['records']} asset records")
+    elif args.cmd == "check-plans":
+        init_db()
+        from fae_design_mill.repositories import check_query_plans
+        problems = check_query_plans()
+        for name, lines in problems.items():
+            print(f"{name}: {'; '.join(lines)}")
+        if problems:
+            sys.exit(1)
+        print("Query plans OK")
+    elif args.cmd == "check-startup":
+        from fae_design_mill.startup import STARTUP_BUDGET_RATIO, check_startup
+        budget = args.budget_ratio if args.budget_ratio is not None else STARTUP_BUDGET_RATIO
+        total, ratio, problems, warnings = check_startup(budget)
+        for line in problems:
+            print(line)
+        for line in warnings:
+            print(f"warning: {line}")
+        if problems or (warnings and args.strict):
+            sys.exit(1)
+        if not warnings:
+            print(f"Start-up imports OK ({total:.0f} ms, {ratio:.1f}x the DB layer, budget {budget:.1f}x)")
+    elif args.cmd == "refill-llm":
+        init_db()
+        from fae_design_mill.reservoir import refill
+        stats = refill(target=args.depth)
+        for key_path, added in stats["added"].items():
+            print(f"{key_path}: +{added}")
+        print(f"Expired {stats['expired']} stale values")
+    elif args.cmd == "llm-cache":
+        from fae_design_mill import llm_cache
+        if args.clear:
+            print(f"Cleared {llm_cache.clear()} cached replies")
+        elif args.purge:
+            print(f"Purged {llm_cache.purge_expired()} expired replies")
+        stats = llm_cache.cache_stats()
+        rate = "n/a" if stats["hit_rate"] is None else f"{stats['hit_rate']:.1%}"
+        print(f"{stats['responses']} replies for {stats['keys']} requests; hit rate {rate}")
+        print(", ".join(f"{name} {stats[name]}" for name in llm_cache.COUNTERS))
+    elif args.cmd == "thumbs":
+        init_db()
+        from fae_design_mill.storage.thumbs import backfill_thumbnails
+        stats = backfill_thumbnails()
+        print(f"Thumbnails ready for {stats['assets']} assets ({stats['failed']} failed)")
+    elif args.cmd == "rebuild-search":
+        init_db()
+        from fae_design_mill.repositories import rebuild_search_index
+        n = rebuild_search_index()
+        if n is None:
+            sys.exit("Search index unavailable: this SQLite build has no FTS5")
+        print(f"Indexed {n} prompts")
+    elif args.cmd == "export-prompts":
+        import json
+        from fae_design_mill.storage.archive import iter_prompts
+        for run_id, prompt in iter_prompts(args.since, args.until):
+            sys.stdout.write(json.dumps({"run_id": run_id, "prompt": prompt}, separators=(",", ":")) + "\n")
+    elif args.cmd == "import-items":
+        init_db()
+        from fae_design_mill.importers import ImportFormatError, detect_format, iter_rows
+        from fae_design_mill.repositories import bulk_add_variable_items
+        fmt = args.format or detect_format(name=args.file)
+        if not fmt:
+            print("Cannot tell the format from the file name; pass --format")
+            sys.exit(2)
+        stream = sys.stdin.buffer if args.file == "-" else open(args.file, "rb")
+        try:
+            stats = bulk_add_variable_items(
+                args.list_name,
+                iter_rows(stream, fmt),
+                weight=args.weight,
+                enabled=not args.disabled,
+                cooldown_days=args.cooldown_days,
+                tags=[t.strip() for t in args.tags.split(",") if t.strip()],
+            )
+        except (ImportFormatError, ValueError) as e:
+            print(f"Import failed, nothing written: {e}")
+            sys.exit(1)
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+        print(f"Imported into {args.list_name}: {stats['created']} created, {stats['skipped']} skipped")
+    elif args.cmd == "export":
+        init_db()
+        from fae_design_mill.export import export_chunks
+        out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+        try:
+            for chunk in export_chunks(
+                args.format,
+                since=args.since,
+                until=args.until,
+                status=args.status.upper() if args.status else None,
+                include_prompt=not args.no_prompt,
+            ):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    elif args.cmd == "backup":
+        init_db()
+        from fae_design_mill.backup import create_backup
+        info = create_backup(compress=not args.no_compress, keep=args.keep)
+        print(
+            f"Backup written to {info['path']}: {info['backup_bytes']} bytes "
+            f"(db {info['db_bytes']} bytes) in {info['duration_ms']} ms; pruned {info['pruned']}"
+        )
     elif args.cmd == "seed-all-lists":
         init_db()
         from fae_design_mill.repositories import seed_comprehensive_variable_lists, scaffold_lists_for_defaults